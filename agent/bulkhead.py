@@ -0,0 +1,193 @@
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+from .tracing import tracer
+
+EXECUTOR_ASYNC = "async"   # 在事件循环中执行（异步IO工具）
+EXECUTOR_THREAD = "thread" # 同步的 execute 整体在工具专属线程池中执行；异步工具的阻塞调用通过 Tool.run_blocking 执行
+
+class ToolBulkhead:
+    """单个工具的隔离舱：并发上限、排队上限、超时和专属线程池
+
+    同名工具的所有实例（每个请求都会新建代理和工具）共享同一个隔离舱，
+    因此限制在进程范围内生效。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, timeout: float,
+                 executor: str = EXECUTOR_ASYNC, max_queue: int = 16):
+        """初始化隔离舱
+
+        Args:
+            name: 工具名称
+            max_concurrency: 同时执行的最大调用数
+            timeout: 单次调用的最长执行时间（秒，不含排队），<=0 表示不限制
+            executor: 执行后端，"async" 或 "thread"
+            max_queue: 最大排队数，超出时直接拒绝
+        """
+        if executor not in (EXECUTOR_ASYNC, EXECUTOR_THREAD):
+            raise ValueError(f"未知的执行后端: {executor}")
+        self.name = name
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.timeout = timeout
+        self.executor = executor
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.stats = {
+            "calls": 0, "completed": 0, "errors": 0, "timeouts": 0, "rejected": 0, "cancelled": 0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0, "run_ms_total": 0.0, "run_ms_max": 0.0,
+        }
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        """工具专属线程池，避免阻塞调用占满默认执行器"""
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                   thread_name_prefix=f"tool-{self.name}")
+        return self._thread_pool
+
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """在专属线程池中运行阻塞函数
+
+        超时或取消时线程无法被中断，但线程池大小等于并发上限，
+        失控的调用最多占满本工具的线程，不影响其它工具。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, functools.partial(func, *args, **kwargs))
+
+    def _invoke(self, tool, kwargs: Dict) -> Awaitable:
+        """按执行后端启动一次工具调用"""
+        if self.executor == EXECUTOR_THREAD and not asyncio.iscoroutinefunction(tool.execute):
+            # 同步实现的工具整体放到专属线程池，不阻塞事件循环
+            return self.run_blocking(tool.execute, **kwargs)
+        return tool.execute(**kwargs)
+
+    async def call(self, tool, **kwargs) -> Dict:
+        """在隔离舱限制下执行工具
+
+        Args:
+            tool: 工具实例
+            **kwargs: 工具参数
+
+        Returns:
+            Dict: 工具结果；排队已满或超时时返回 {"error": ...}
+        """
+        self.stats["calls"] += 1
+        if self.max_queue >= 0 and self.waiting >= self.max_queue and self._semaphore.locked():
+            self.stats["rejected"] += 1
+            logger.warning(f"工具 {self.name} 繁忙：{self.in_flight} 个执行中，{self.waiting} 个排队，拒绝新调用")
+            return {"error": f"工具 {self.name} 当前繁忙，请稍后再试"}
+
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        wait_ms = (time.monotonic() - queued_at) * 1000
+
+        self.in_flight += 1
+        started_at = time.monotonic()
+        try:
+            # 超时会取消执行中的协程，取消沿调用链传到aiohttp请求
+            if self.timeout and self.timeout > 0:
+                result = await asyncio.wait_for(self._invoke(tool, kwargs), timeout=self.timeout)
+            else:
+                result = await self._invoke(tool, kwargs)
+            self.stats["completed"] += 1
+            if isinstance(result, dict) and result.get("error"):
+                self.stats["errors"] += 1
+            return result
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning(f"工具 {self.name} 执行超时 (>{self.timeout}秒)，已取消")
+            return {"error": f"工具 {self.name} 执行超时 (>{self.timeout}秒)"}
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        finally:
+            run_ms = (time.monotonic() - started_at) * 1000
+            self.in_flight -= 1
+            self._semaphore.release()
+            self.stats["wait_ms_total"] += wait_ms
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+            self.stats["run_ms_total"] += run_ms
+            self.stats["run_ms_max"] = max(self.stats["run_ms_max"], run_ms)
+            span = tracer.current_span()
+            if span is not None:
+                span.set_attributes(queue_wait_ms=round(wait_ms, 2), run_ms=round(run_ms, 2))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前配置和累计指标"""
+        finished = max(self.stats["calls"] - self.stats["rejected"], 1)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout,
+            "executor": self.executor,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            **{key: value for key, value in self.stats.items() if not key.endswith("_total")},
+            "wait_ms_avg": round(self.stats["wait_ms_total"] / finished, 2),
+            "run_ms_avg": round(self.stats["run_ms_total"] / finished, 2),
+        }
+
+class BulkheadRegistry:
+    """进程级的工具隔离舱注册表
+
+    默认限制来自工具类属性（max_concurrency / timeout / executor），
+    可被配置 [bulkhead.<工具名>] 覆盖。
+    """
+
+    def __init__(self):
+        self._bulkheads: Dict[str, ToolBulkhead] = {}
+        self._overrides: Dict[str, Dict] = {}
+
+    def configure(self, overrides: Dict[str, Dict]) -> None:
+        """设置按工具名覆盖的限制，已创建的隔离舱会在下次使用时按新配置重建"""
+        self._overrides = {name: dict(values) for name, values in (overrides or {}).items() if isinstance(values, dict)}
+        for name in list(self._bulkheads):
+            if name in self._overrides:
+                del self._bulkheads[name]
+
+    def get(self, tool) -> ToolBulkhead:
+        """获取（必要时创建）工具对应的隔离舱"""
+        bulkhead = self._bulkheads.get(tool.name)
+        if bulkhead is None:
+            override = self._overrides.get(tool.name, {})
+            bulkhead = ToolBulkhead(
+                name=tool.name,
+                max_concurrency=override.get("max_concurrency", tool.max_concurrency),
+                timeout=override.get("timeout", tool.timeout),
+                executor=override.get("executor", tool.executor),
+                max_queue=override.get("max_queue", tool.max_queue),
+            )
+            self._bulkheads[tool.name] = bulkhead
+            logger.debug(f"工具 {tool.name} 隔离舱: 并发 {bulkhead.max_concurrency}, 超时 {bulkhead.timeout}s, 执行后端 {bulkhead.executor}")
+        return bulkhead
+
+    async def call(self, tool, **kwargs) -> Dict:
+        return await self.get(tool).call(tool, **kwargs)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """所有工具的隔离舱指标"""
+        return {name: bulkhead.snapshot() for name, bulkhead in self._bulkheads.items()}
+
+    def format_metrics(self) -> str:
+        """格式化为日志友好的文本"""
+        lines = []
+        for name, m in self.metrics().items():
+            lines.append(f"{name}: 调用 {m['calls']} 超时 {m['timeouts']} 拒绝 {m['rejected']} 取消 {m['cancelled']} "
+                         f"排队 avg {m['wait_ms_avg']:.0f}ms/max {m['wait_ms_max']:.0f}ms "
+                         f"执行 avg {m['run_ms_avg']:.0f}ms/max {m['run_ms_max']:.0f}ms "
+                         f"(执行中 {m['in_flight']}/{m['max_concurrency']}, 排队 {m['waiting']})")
+        return "\n".join(lines)
+
+# 进程内共享的隔离舱注册表
+bulkheads = BulkheadRegistry()
@@ -0,0 +1,256 @@
+import os
+import re
+import gzip
+import json
+import time
+import copy
+import asyncio
+import hashlib
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, List, Any, Optional, AsyncGenerator, AsyncIterator, Callable, Awaitable, Iterator
+
+from loguru import logger
+
+CASSETTE_VERSION = 1
+
+_active_cassette: ContextVar[Optional["Cassette"]] = ContextVar("openmanus_cassette", default=None)
+
+class CassetteMiss(LookupError):
+    """回放时找不到匹配的录制记录"""
+
+def current_cassette() -> Optional["Cassette"]:
+    """返回当前上下文中正在录制或回放的cassette"""
+    return _active_cassette.get()
+
+def activate_cassette(cassette: "Cassette") -> Token:
+    """在当前上下文（及之后在其中创建的任务）中启用cassette，返回用于停用的token"""
+    return _active_cassette.set(cassette)
+
+def deactivate_cassette(token: Token) -> None:
+    """停用 activate_cassette 启用的cassette"""
+    _active_cassette.reset(token)
+
+@contextmanager
+def use_cassette(cassette: "Cassette") -> Iterator["Cassette"]:
+    """以上下文管理器形式启用cassette"""
+    token = activate_cassette(cassette)
+    try:
+        yield cassette
+    finally:
+        deactivate_cassette(token)
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def _endpoint(url: str) -> str:
+    """从请求URL中提取 模型:方法，不保存带API Key的完整URL"""
+    match = re.search(r'/models/([^:/]+):(\w+)', url)
+    return f"{match.group(1)}:{match.group(2)}" if match else url.split("?", 1)[0]
+
+class Cassette:
+    """一次真实请求中所有Gemini请求/响应和工具输入/输出的录制
+
+    record 模式下由 GeminiClient 和 MCPAgent 写入交互记录；
+    replay 模式下按相同的键（请求内容摘要）依次返回录制结果，
+    键不匹配且非严格模式时，按同组交互（LLM请求 / 同一工具）的录制顺序返回。
+    """
+
+    def __init__(self, mode: str = "record", metadata: Dict = None, interactions: List[Dict] = None,
+                 latency: str = "original", strict: bool = False):
+        """初始化cassette
+
+        Args:
+            mode: "record" 或 "replay"
+            metadata: 请求信息（指令、历史、代理设置、工具定义等）
+            interactions: 已录制的交互记录
+            latency: 回放延迟，"original" 按录制耗时等待，"zero" 不等待
+            strict: 回放时是否要求请求内容完全一致
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的cassette模式: {mode}")
+        self.mode = mode
+        self.metadata = metadata or {}
+        self.interactions = interactions or []
+        self.latency = latency
+        self.strict = strict
+        self.stats = {"llm_calls": 0, "tool_calls": 0, "misses": 0,
+                      "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        self._by_key: Dict[str, deque] = defaultdict(deque)
+        self._by_group: Dict[str, deque] = defaultdict(deque)
+        self._used = set()
+        for index, interaction in enumerate(self.interactions):
+            self._by_key[interaction["key"]].append(index)
+            self._by_group[interaction["group"]].append(index)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _append(self, interaction: Dict) -> None:
+        interaction["seq"] = len(self.interactions)
+        self.interactions.append(interaction)
+
+    def _take(self, group: str, key: str, description: str) -> Dict:
+        """取出下一条匹配的录制记录"""
+        queue = self._by_key.get(key)
+        while queue:
+            index = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return self.interactions[index]
+        if self.strict:
+            raise CassetteMiss(f"cassette中没有匹配的{description}")
+        self.stats["misses"] += 1
+        queue = self._by_group.get(group)
+        while queue:
+            index = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                logger.debug(f"cassette键不匹配，按录制顺序回放{description}")
+                return self.interactions[index]
+        raise CassetteMiss(f"cassette中的{description}已用完")
+
+    async def _sleep(self, ms: float) -> None:
+        if self.latency == "original" and ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+    def _count_usage(self, chunks: List[Dict]) -> None:
+        # 流式响应的usageMetadata为累计值，只计最后一次
+        usage = next((chunk["usageMetadata"] for chunk in reversed(chunks)
+                      if isinstance(chunk, dict) and chunk.get("usageMetadata")), None)
+        if usage:
+            self.stats["prompt_tokens"] += usage.get("promptTokenCount", 0)
+            self.stats["output_tokens"] += usage.get("candidatesTokenCount", 0)
+            self.stats["total_tokens"] += usage.get("totalTokenCount", 0)
+
+    async def llm_request(self, url: str, payload: Dict, stream: bool,
+                          send: Callable[[], AsyncGenerator[Dict, None]]) -> AsyncIterator[Dict]:
+        """录制或回放一次Gemini请求
+
+        Args:
+            url: 请求URL
+            payload: 请求体
+            stream: 是否流式
+            send: 实际发送请求的函数，返回响应块的异步生成器
+
+        Yields:
+            Dict: 响应块
+        """
+        endpoint = _endpoint(url)
+        key = f"llm:{endpoint}:{_digest(payload)}"
+        self.stats["llm_calls"] += 1
+
+        if self.replaying:
+            interaction = self._take("llm", key, f"LLM请求 ({endpoint})")
+            self._count_usage(interaction["response"])
+            elapsed = 0.0
+            for offset_ms, chunk in zip(interaction["offsets_ms"], interaction["response"]):
+                await self._sleep(offset_ms - elapsed)
+                elapsed = offset_ms
+                yield copy.deepcopy(chunk)
+            return
+
+        start = time.monotonic()
+        chunks, offsets_ms = [], []
+        try:
+            async for chunk in send():
+                offsets_ms.append(round((time.monotonic() - start) * 1000, 2))
+                chunks.append(copy.deepcopy(chunk))
+                yield chunk
+        finally:
+            self._count_usage(chunks)
+            # 流被提前关闭时也保存已收到的部分
+            self._append({
+                "kind": "llm",
+                "group": "llm",
+                "key": key,
+                "endpoint": endpoint,
+                "stream": stream,
+                "request": payload,
+                "response": chunks,
+                "offsets_ms": offsets_ms,
+            })
+
+    async def tool_call(self, tool_name: str, key: str, arguments: Dict,
+                        execute: Callable[[], Awaitable[Dict]]) -> Dict:
+        """录制或回放一次工具调用
+
+        Args:
+            tool_name: 工具名称
+            key: 调用键（工具名 + 规范化参数）
+            arguments: 调用参数
+            execute: 实际执行工具的函数
+
+        Returns:
+            Dict: 工具结果
+        """
+        self.stats["tool_calls"] += 1
+        if self.replaying:
+            interaction = self._take(f"tool:{tool_name}", f"tool:{key}", f"工具调用 ({tool_name})")
+            await self._sleep(interaction["latency_ms"])
+            if interaction.get("exception"):
+                raise RuntimeError(interaction["exception"])
+            if interaction.get("cancelled"):
+                # 录制时被取消的调用（如未命中的预取）没有结果
+                return {"error": "录制时该工具调用已被取消"}
+            return copy.deepcopy(interaction["result"])
+
+        start = time.monotonic()
+        interaction = {"kind": "tool", "group": f"tool:{tool_name}", "key": f"tool:{key}",
+                       "tool": tool_name, "arguments": arguments}
+        try:
+            result = await execute()
+            interaction["result"] = copy.deepcopy(result)
+            return result
+        except asyncio.CancelledError:
+            interaction["cancelled"] = True
+            raise
+        except Exception as e:
+            interaction["exception"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            interaction["latency_ms"] = round((time.monotonic() - start) * 1000, 2)
+            self._append(interaction)
+
+    def unused_interactions(self) -> int:
+        """回放结束后未被使用的录制记录数"""
+        return len(self.interactions) - len(self._used)
+
+    def to_dict(self) -> Dict:
+        return {"version": CASSETTE_VERSION, "metadata": self.metadata, "interactions": self.interactions}
+
+    def save(self, path: str) -> str:
+        """保存为gzip压缩的JSON文件
+
+        Args:
+            path: 文件路径
+
+        Returns:
+            str: 文件路径
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, default=str)
+        logger.info(f"cassette已保存: {path} ({len(self.interactions)} 条交互)")
+        return path
+
+    @classmethod
+    def load(cls, path: str, latency: str = "original", strict: bool = False) -> "Cassette":
+        """加载cassette用于回放
+
+        Args:
+            path: 文件路径
+            latency: 回放延迟，"original" 或 "zero"
+            strict: 是否要求请求内容完全一致
+
+        Returns:
+            Cassette: replay 模式的cassette
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"不支持的cassette版本: {data.get('version')}")
+        return cls(mode="replay", metadata=data.get("metadata"), interactions=data.get("interactions"),
+                   latency=latency, strict=strict)
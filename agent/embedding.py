@@ -0,0 +1,85 @@
+import re
+import zlib
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+
+# 语气词和无实际含义的请求套话，归一化时去掉
+_FILLER_PATTERN = re.compile(r'请问|请|帮我|帮忙|麻烦|一下|告诉我|我想知道|想问问|想问')
+_PUNCTUATION_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+_TRAILING_PARTICLES_PATTERN = re.compile(r'[吗呢啊呀吧哈嘛]+$')
+# 切分单元：英文词和数字整体作为一个单元，其余每个字符一个单元
+_UNIT_PATTERN = re.compile(r'[a-z]+|\d+(?:\.\d+)?|[^a-z\d]')
+
+# 同义表达统一为一种写法
+_SYNONYMS = [
+    ("怎么样", ("如何", "怎样", "咋样")),
+    ("是什么", ("是啥", "指什么", "什么意思", "啥意思")),
+    ("今天", ("今日",)),
+    ("明天", ("明日",)),
+]
+
+def normalize_text(text: str) -> str:
+    """归一化查询文本：全角转半角、小写、统一同义词、去掉套话、标点和句末语气词"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    for canonical, variants in _SYNONYMS:
+        for variant in variants:
+            text = text.replace(variant, canonical)
+    text = _FILLER_PATTERN.sub("", text)
+    text = _PUNCTUATION_PATTERN.sub("", text)
+    return _TRAILING_PARTICLES_PATTERN.sub("", text)
+
+@lru_cache(maxsize=65536)
+def _hash_ngram(ngram: str, dim: int) -> Tuple[int, float]:
+    """n-gram 映射到 (维度下标, 符号)，使用稳定哈希保证跨进程结果一致"""
+    value = zlib.crc32(ngram.encode("utf-8"))
+    return value % dim, 1.0 if (value >> 31) & 1 else -1.0
+
+class HashingEmbedder:
+    """本地、仅CPU的字符n-gram哈希向量化
+
+    中文没有空格分词，以单字（英文词、数字整体）为单元取 unigram/bigram 并哈希到固定维度。
+    unigram 权重更高，使向量对语序变化（"今天北京" / "北京今天"）不敏感；同义改写由
+    normalize_text 统一。不需要模型文件，单次向量化耗时在微秒级。
+    """
+
+    def __init__(self, dim: int = 512, ngram_weights: Tuple[float, ...] = (1.0, 0.5)):
+        """初始化
+
+        Args:
+            dim: 向量维度
+            ngram_weights: 各长度n-gram的权重，第i项对应长度为 i+1 的n-gram
+        """
+        self.dim = dim
+        self.ngram_weights = ngram_weights
+
+    def embed(self, text: str, normalized: bool = False) -> np.ndarray:
+        """向量化单条文本
+
+        Args:
+            text: 文本
+            normalized: 文本是否已经过 normalize_text
+
+        Returns:
+            np.ndarray: L2归一化的 float32 向量，空文本返回零向量
+        """
+        if not normalized:
+            text = normalize_text(text)
+        units = _UNIT_PATTERN.findall(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n, weight in enumerate(self.ngram_weights, 1):
+            for i in range(len(units) - n + 1):
+                index, sign = _hash_ngram("".join(units[i:i + n]), self.dim)
+                vector[index] += sign * weight
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_batch(self, texts: List[str], normalized: bool = False) -> np.ndarray:
+        """向量化多条文本，返回形状为 (len(texts), dim) 的矩阵"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack([self.embed(text, normalized=normalized) for text in texts])
@@ -0,0 +1,194 @@
+import time
+import asyncio
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+from loguru import logger
+
+class AgentHooks:
+    """代理事件钩子基类，子类按需覆盖
+
+    钩子在代理的主流程中被依次等待，应当快速返回；耗时操作请自行创建任务。
+    钩子抛出的异常只记录日志，不影响代理运行。
+    """
+
+    async def on_step_start(self, agent, step: int) -> None:
+        """逐步模式中每一步开始时调用"""
+
+    async def on_llm_call(self, agent, phase: str, model: str) -> None:
+        """每次调用Gemini前调用，phase 为 "step"/"plan"/"final" """
+
+    async def on_tool_start(self, agent, tool_name: str, arguments: Dict) -> None:
+        """工具开始执行时调用"""
+
+    async def on_tool_end(self, agent, tool_name: str, arguments: Dict, result: Dict, duration_ms: float) -> None:
+        """工具执行结束时调用（包括出错和超时）"""
+
+    async def on_answer_chunk(self, agent, text: str) -> None:
+        """最终答案产出文本时调用；流式模式下每个增量调用一次，非流式模式下调用一次"""
+
+class HookDispatcher:
+    """把事件依次分发给已注册的钩子"""
+
+    def __init__(self, hooks: Optional[List[AgentHooks]] = None):
+        self.hooks: List[AgentHooks] = list(hooks or [])
+
+    def add(self, hook: AgentHooks) -> None:
+        self.hooks.append(hook)
+
+    async def emit(self, event: str, *args) -> None:
+        """分发事件
+
+        Args:
+            event: 钩子方法名，如 "on_tool_start"
+            *args: 钩子参数（不含 self）
+        """
+        for hook in self.hooks:
+            try:
+                await getattr(hook, event)(*args)
+            except Exception as e:
+                logger.warning(f"代理钩子 {type(hook).__name__}.{event} 执行出错: {e}")
+
+# 工具执行较慢时发送的进度提示
+DEFAULT_PROGRESS_MESSAGES = {
+    "weather": "正在查询天气…",
+    "search": "正在搜索相关信息…",
+    "stock": "正在查询行情数据…",
+    "firecrawl": "正在抓取网页内容，请稍候…",
+    "generate_image": "正在绘制图片，可能需要一两分钟…",
+    "code": "正在运行代码…",
+}
+DEFAULT_THINKING_MESSAGE = "问题有点复杂，正在思考中，请稍候…"
+
+class ProgressNotifier(AgentHooks):
+    """长时间运行时向用户发送进度提示
+
+    工具执行超过 delay 秒仍未结束时发送该工具的提示；整个运行超过 delay 秒仍未开始
+    输出答案时发送思考提示。两次提示至少间隔 min_interval 秒，每次运行最多 max_notices 条，
+    答案开始输出后不再提示。
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[Any]], delay: float = 8, min_interval: float = 20,
+                 max_notices: int = 2, messages: Dict[str, str] = None, thinking_message: str = DEFAULT_THINKING_MESSAGE):
+        """初始化
+
+        Args:
+            send: 发送提示文本的协程函数
+            delay: 操作持续多少秒后才发送提示
+            min_interval: 两条提示之间的最小间隔（秒）
+            max_notices: 每次运行最多发送的提示数
+            messages: 工具名 -> 提示文本，未列出的工具不提示
+            thinking_message: 整体运行较慢时的提示文本，为空则不提示
+        """
+        self.send = send
+        self.delay = delay
+        self.min_interval = min_interval
+        self.max_notices = max_notices
+        self.messages = {**DEFAULT_PROGRESS_MESSAGES, **(messages or {})}
+        self.thinking_message = thinking_message
+        self.sent = 0
+        self._last_sent = 0.0
+        self._answering = False
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def _schedule(self, key: str, text: str) -> None:
+        if self._answering or self.sent >= self.max_notices or key in self._pending:
+            return
+        self._pending[key] = asyncio.create_task(self._notify_later(key, text))
+
+    def _cancel(self, key: str) -> None:
+        task = self._pending.pop(key, None)
+        if task:
+            task.cancel()
+
+    async def _notify_later(self, key: str, text: str) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+            wait = self.min_interval - (time.monotonic() - self._last_sent)
+            if self.sent and wait > 0:
+                await asyncio.sleep(wait)
+            if self._answering or self.sent >= self.max_notices:
+                return
+            self.sent += 1
+            self._last_sent = time.monotonic()
+            await self.send(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"发送进度提示失败: {e}")
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+
+    async def on_step_start(self, agent, step: int) -> None:
+        if step == 1 and self.thinking_message:
+            self._schedule("thinking", self.thinking_message)
+
+    async def on_tool_start(self, agent, tool_name: str, arguments: Dict) -> None:
+        text = self.messages.get(tool_name)
+        if text:
+            # 工具提示更具体，取代思考提示
+            self._cancel("thinking")
+            self._schedule(f"tool:{tool_name}", text)
+
+    async def on_tool_end(self, agent, tool_name: str, arguments: Dict, result: Dict, duration_ms: float) -> None:
+        self._cancel(f"tool:{tool_name}")
+
+    async def on_answer_chunk(self, agent, text: str) -> None:
+        if not self._answering:
+            self._answering = True
+            self.close()
+
+    def close(self) -> None:
+        """取消所有未发送的提示，运行结束（或被取消）时调用"""
+        for key in list(self._pending):
+            self._cancel(key)
+
+class MetricsHook(AgentHooks):
+    """进程级的代理运行指标：按阶段/模型的LLM调用数，按工具的调用数、错误数和耗时"""
+
+    def __init__(self):
+        self.steps = 0
+        self.llm_calls: Dict[str, int] = {}
+        self.tools: Dict[str, Dict[str, float]] = {}
+
+    async def on_step_start(self, agent, step: int) -> None:
+        self.steps += 1
+
+    async def on_llm_call(self, agent, phase: str, model: str) -> None:
+        key = f"{phase}:{model}"
+        self.llm_calls[key] = self.llm_calls.get(key, 0) + 1
+
+    async def on_tool_end(self, agent, tool_name: str, arguments: Dict, result: Dict, duration_ms: float) -> None:
+        stats = self.tools.setdefault(tool_name, {"calls": 0, "errors": 0, "ms_total": 0.0, "ms_max": 0.0})
+        stats["calls"] += 1
+        if isinstance(result, dict) and result.get("error"):
+            stats["errors"] += 1
+        stats["ms_total"] += duration_ms
+        stats["ms_max"] = max(stats["ms_max"], duration_ms)
+
+    def metrics(self) -> Dict[str, Any]:
+        """累计指标"""
+        return {
+            "steps": self.steps,
+            "llm_calls": dict(self.llm_calls),
+            "tools": {
+                name: {"calls": stats["calls"], "errors": stats["errors"],
+                       "ms_avg": round(stats["ms_total"] / max(stats["calls"], 1), 2),
+                       "ms_max": round(stats["ms_max"], 2)}
+                for name, stats in self.tools.items()
+            },
+        }
+
+class ToolImageCollector(AgentHooks):
+    """收集工具结果中按引用返回的图片（{"images": [{"image_id": ...}]}），回答发送后由插件取出发送"""
+
+    def __init__(self):
+        self.image_ids: List[str] = []
+
+    async def on_tool_end(self, agent, tool_name: str, arguments: Dict, result: Dict, duration_ms: float) -> None:
+        if not isinstance(result, dict):
+            return
+        for image in result.get("images") or []:
+            image_id = image.get("image_id") if isinstance(image, dict) else None
+            if image_id and image_id not in self.image_ids:
+                self.image_ids.append(image_id)
@@ -6,14 +6,37 @@ import json
 import time
 import platform
 import importlib.util
-from typing import Dict, List, Any, Optional, Tuple, Union
+from typing import Dict, List, Any, Optional, Tuple, Union, AsyncIterator
 
 from loguru import logger
 
 from ..api_client import GeminiClient
+from .shaping import shape_tool_result, estimate_tokens
+from .planner import build_planning_prompt, parse_plan, execute_plan, PlanError
+from .tracing import tracer
+from .cassette import current_cassette, CassetteMiss
+from .bulkhead import bulkheads, EXECUTOR_ASYNC
+from .tool_selector import ToolSelector
+from .hooks import AgentHooks, HookDispatcher
 
 class Tool:
-    """工具基类"""
+    """工具基类
+    
+    子类可通过类属性（或在实例上）声明隔离舱限制，由 MCPAgent 在执行时强制：
+        max_concurrency: 进程内同时执行的最大调用数
+        timeout: 单次调用的最长执行时间（秒），超时会取消调用
+        executor: "async" 在事件循环中执行；"thread" 表示在专属线程池执行：execute 为同步方法时整体
+            在线程池中运行，为协程时其中的阻塞调用通过 run_blocking 在线程池中运行
+        max_queue: 最大排队调用数，超出时直接返回繁忙错误
+    
+    keywords 为提示工具相关性的关键词，供 ToolSelector 按请求挑选要声明的工具。
+    """
+    max_concurrency: int = 4
+    timeout: float = 60
+    executor: str = EXECUTOR_ASYNC
+    max_queue: int = 16
+    keywords: Tuple[str, ...] = ()
+    
     def __init__(self, name: str, description: str, parameters: Dict = None):
         self.name = name
         self.description = description
@@ -51,6 +74,18 @@ class Tool:
             Dict: 执行结果
         """
         raise NotImplementedError("工具子类必须实现execute方法")
+    
+    async def run_blocking(self, func, *args, **kwargs) -> Any:
+        """在本工具专属的线程池中运行阻塞函数，不占用默认执行器
+        
+        Args:
+            func: 阻塞函数
+            *args, **kwargs: 函数参数
+            
+        Returns:
+            Any: 函数返回值
+        """
+        return await bulkheads.get(self).run_blocking(func, *args, **kwargs)
 
 class MCPAgent:
     """MCP代理，实现多步骤思考过程"""
@@ -60,7 +95,17 @@ class MCPAgent:
                  max_steps: int = 5, thinking_steps: int = 3,
                  force_thinking: bool = True,
                  thinking_prompt: str = "请深入思考这个问题，分析多个角度并考虑是否需要查询额外信息，然后提供具体的解决方案。思考要全面但不要在最终回答中展示思考过程。",
-                 system_prompt: Optional[str] = None):
+                 system_prompt: Optional[str] = None,
+                 tool_result_token_budget: int = 800,
+                 plan_and_execute: bool = False,
+                 plan_max_nodes: int = 12,
+                 step_model: Optional[str] = None,
+                 plan_model: Optional[str] = None,
+                 final_model: Optional[str] = None,
+                 escalate_on_invalid: bool = True,
+                 tool_top_k: int = 0,
+                 always_include_tools: Optional[List[str]] = None,
+                 hooks: Optional[List[AgentHooks]] = None):
         """初始化MCP代理
         
         Args:
@@ -73,11 +118,33 @@ class MCPAgent:
             force_thinking: 是否强制执行思考步骤
             thinking_prompt: 思考提示词
             system_prompt: 自定义系统提示词，如果为None则使用默认提示词
+            tool_result_token_budget: 每个工具结果回传给模型的token预算，<=0表示不压缩
+            plan_and_execute: 是否启用计划-执行模式（先生成工具调用依赖图，再并发执行）
+            plan_max_nodes: 计划中允许的最大工具调用数
+            step_model: 工具决策和思考步骤使用的模型，为None时使用 model
+            plan_model: 计划-执行模式中生成计划使用的模型，为None时使用 step_model
+            final_model: 生成最终答案使用的模型，为None时使用 model
+            escalate_on_invalid: 步骤模型未返回有效操作时是否改用 model 重试该步骤
+            tool_top_k: 每个请求只向模型声明最相关的k个工具，<=0 表示声明全部工具
+            always_include_tools: 启用工具筛选时总是声明的工具名称
+            hooks: 事件钩子列表（进度提示、指标等），也可通过 self.hooks.add() 追加
         """
         if not isinstance(client, GeminiClient):
              raise TypeError("client must be an instance of GeminiClient")
         self.client = client
         self.model = model
+        self.step_model = step_model or model
+        self.plan_model = plan_model or self.step_model
+        self.final_model = final_model or model
+        self.escalate_on_invalid = escalate_on_invalid
+        self.escalations = 0
+        self.tool_top_k = tool_top_k
+        self.always_include_tools = list(always_include_tools or [])
+        self.tool_selector = ToolSelector(top_k=tool_top_k, always_include=self.always_include_tools) if tool_top_k > 0 else None
+        # 本次运行声明的工具名称，None 表示声明全部工具
+        self.active_tools: Optional[List[str]] = None
+        self.tool_token_stats = {"full": 0, "sent": 0, "expansions": 0}
+        self.hooks = HookDispatcher(hooks)
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.max_steps = max_steps
@@ -88,6 +155,41 @@ class MCPAgent:
         self.thinking_history = []
         self.conversation_history = []
         self.system_prompt = system_prompt
+        self.tool_result_token_budget = tool_result_token_budget
+        self.plan_and_execute = plan_and_execute
+        self.plan_max_nodes = plan_max_nodes
+        # 本次运行中工具返回的完整结果，压缩后的版本才会回传给模型
+        self.full_tool_results = []
+        self.compaction_stats = {"raw_tokens": 0, "shaped_tokens": 0}
+        # 预取的工具调用 {调用键: asyncio.Task}
+        self._prefetched = {}
+        self.prefetch_stats = {"issued": 0, "hits": 0, "cancelled": 0, "unused": 0}
+        
+    def get_settings(self) -> Dict[str, Any]:
+        """返回构造参数（不含client），用于录制和按相同设置重建代理
+        
+        Returns:
+            Dict[str, Any]: 可直接作为关键字参数传给 MCPAgent 的设置
+        """
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "max_steps": self.max_steps,
+            "thinking_steps": self.thinking_steps,
+            "force_thinking": self.force_thinking,
+            "thinking_prompt": self.thinking_prompt,
+            "system_prompt": self.system_prompt,
+            "tool_result_token_budget": self.tool_result_token_budget,
+            "plan_and_execute": self.plan_and_execute,
+            "plan_max_nodes": self.plan_max_nodes,
+            "step_model": self.step_model,
+            "plan_model": self.plan_model,
+            "final_model": self.final_model,
+            "escalate_on_invalid": self.escalate_on_invalid,
+            "tool_top_k": self.tool_top_k,
+            "always_include_tools": self.always_include_tools,
+        }
         
     def register_tool(self, tool: Tool) -> None:
         """注册工具
@@ -108,15 +210,133 @@ class MCPAgent:
             self.register_tool(tool)
             
     def get_tool_definitions(self) -> List[Dict]:
-        """获取所有工具定义
+        """获取本次运行声明的工具定义（启用工具筛选时只含选中的工具）
         
         Returns:
             List[Dict]: 工具定义列表
         """
-        return [tool.to_dict() for tool in self.tools.values()]
+        if self.active_tools is None:
+            return [tool.to_dict() for tool in self.tools.values()]
+        return [self.tools[name].to_dict() for name in self.active_tools if name in self.tools]
+    
+    def select_tools(self, instruction: str, history: List[Dict] = None) -> None:
+        """按请求挑选本次运行声明的工具
+        
+        上一轮用户消息也参与判断，使 "那上海呢" 这类追问仍能选中上一轮的工具；
+        已预取的工具总会被选中。
+        
+        Args:
+            instruction: 用户指令
+            history: 历史对话记录，可选
+        """
+        self.active_tools = None
+        if not self.tool_selector or len(self.tools) <= self.tool_top_k:
+            return
+        text = instruction
+        previous = [message.get("content") for message in (history or []) if message.get("role") == "user"]
+        if previous and isinstance(previous[-1], str):
+            text = f"{instruction} {previous[-1]}"
+        prefetched = {key.split(":", 1)[0] for key in self._prefetched}
+        self.active_tools = self.tool_selector.select(text, self.tools, required=prefetched)
+        logger.info(f"工具筛选: 声明 {len(self.active_tools)}/{len(self.tools)} 个工具 {self.active_tools}")
+    
+    def _expand_tools(self, reason: str) -> bool:
+        """改为声明全部工具
+        
+        Returns:
+            bool: 之前是否只声明了部分工具
+        """
+        if self.active_tools is None:
+            return False
+        logger.info(f"{reason}，改为声明全部工具")
+        self.active_tools = None
+        self.tool_token_stats["expansions"] += 1
+        return True
+    
+    def _record_tool_tokens(self, tool_definitions: List[Dict]) -> None:
+        """记录一次调用声明工具的token数，以及声明全部工具时的token数"""
+        sent = estimate_tokens(tool_definitions) if tool_definitions else 0
+        full = sent if self.active_tools is None else estimate_tokens([tool.to_dict() for tool in self.tools.values()])
+        self.tool_token_stats["sent"] += sent
+        self.tool_token_stats["full"] += full
+        
+    def _tool_call_key(self, tool_name: str, arguments: Dict) -> str:
+        """生成工具调用的规范化键，用于匹配预取结果
+        
+        参数会先补齐工具定义中的默认值，整数值的浮点数统一为整数，
+        以保证模型显式传入默认值时仍能命中。
+        """
+        tool = self.tools.get(tool_name)
+        normalized = {}
+        if tool:
+            normalized = {name: details["default"] for name, details in tool.parameters.items() if "default" in details}
+        for name, value in arguments.items():
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            normalized[name] = value
+        return f"{tool_name}:{json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)}"
+        
+    def prefetch_tool(self, tool_name: str, **kwargs) -> bool:
+        """在后台提前执行预测到的工具调用
+        
+        模型随后以相同参数请求该工具时，execute_tool 会直接复用进行中或已完成的结果。
+        
+        Args:
+            tool_name: 工具名称
+            **kwargs: 工具参数
+            
+        Returns:
+            bool: 是否发起了预取
+        """
+        if tool_name not in self.tools:
+            return False
+        key = self._tool_call_key(tool_name, kwargs)
+        if key in self._prefetched:
+            return False
+        self._prefetched[key] = asyncio.create_task(self._execute_tool(tool_name, **kwargs))
+        self.prefetch_stats["issued"] += 1
+        logger.info(f"预取工具调用: {tool_name}, 参数: {json.dumps(kwargs, ensure_ascii=False)}")
+        return True
+        
+    def cancel_prefetches(self) -> Dict[str, int]:
+        """取消所有未被使用的预取，返回本次运行的预取统计"""
+        for task in self._prefetched.values():
+            if task.done():
+                self.prefetch_stats["unused"] += 1
+            else:
+                task.cancel()
+                self.prefetch_stats["cancelled"] += 1
+        self._prefetched.clear()
+        return dict(self.prefetch_stats)
         
     async def execute_tool(self, tool_name: str, **kwargs) -> Dict:
-        """执行工具
+        """执行工具，优先复用相同参数的预取结果
+        
+        Args:
+            tool_name: 工具名称
+            **kwargs: 工具参数
+            
+        Returns:
+            Dict: 执行结果
+        """
+        await self.hooks.emit("on_tool_start", self, tool_name, kwargs)
+        started_at = time.monotonic()
+        result = {"error": "工具执行被取消"}
+        try:
+            if self._prefetched:
+                task = self._prefetched.pop(self._tool_call_key(tool_name, kwargs), None)
+                if task is not None and not task.cancelled():
+                    self.prefetch_stats["hits"] += 1
+                    logger.info(f"工具 {tool_name} 命中预取结果{'（已完成）' if task.done() else '（进行中）'}")
+                    result = await task
+                    return result
+            result = await self._execute_tool(tool_name, **kwargs)
+            return result
+        finally:
+            await self.hooks.emit("on_tool_end", self, tool_name, kwargs, result, (time.monotonic() - started_at) * 1000)
+        
+    async def _execute_tool(self, tool_name: str, **kwargs) -> Dict:
+        """实际执行工具
         
         Args:
             tool_name: 工具名称
@@ -130,20 +350,65 @@ class MCPAgent:
         
         tool = self.tools[tool_name]
         
-        try:
-            start_time = time.time()
-            logger.debug(f"Executing tool '{tool_name}' with args: {kwargs}")
-            result = await tool.execute(**kwargs)
-            elapsed = time.time() - start_time
-            logger.info(f"工具 {tool_name} 执行完成，耗时 {elapsed:.2f}s")
+        with tracer.span("tool.execute", tool=tool_name) as span:
+            try:
+                start_time = time.time()
+                logger.debug(f"Executing tool '{tool_name}' with args: {kwargs}")
+                cassette = current_cassette()
+                if cassette is not None:
+                    # 录制/回放模式：经由cassette执行
+                    result = await cassette.tool_call(tool_name, self._tool_call_key(tool_name, kwargs), kwargs,
+                                                      lambda: bulkheads.call(tool, **kwargs))
+                else:
+                    # 按工具的并发上限和超时执行，慢工具不会拖垮其它会话
+                    result = await bulkheads.call(tool, **kwargs)
+                elapsed = time.time() - start_time
+                logger.info(f"工具 {tool_name} 执行完成，耗时 {elapsed:.2f}s")
+            except CassetteMiss:
+                # 回放偏离了录制内容，直接上抛，不能当作普通工具错误交给模型
+                raise
+            except TypeError as te:
+                 logger.error(f"工具 '{tool_name}' 参数错误: {te}. Provided args: {kwargs}")
+                 result = {"error": f"工具 '{tool_name}' 参数错误: {te}"}
+            except Exception as e:
+                logger.exception(f"工具 {tool_name} 执行异常")
+                result = {"error": f"工具执行异常: {str(e)}"}
+            if isinstance(result, dict) and result.get("error"):
+                span.set_error(result["error"])
             return result
-        except TypeError as te:
-             logger.error(f"工具 '{tool_name}' 参数错误: {te}. Provided args: {kwargs}")
-             return {"error": f"工具 '{tool_name}' 参数错误: {te}"}
-        except Exception as e:
-            logger.exception(f"工具 {tool_name} 执行异常")
-            return {"error": f"工具执行异常: {str(e)}"}
     
+    def _build_tool_response(self, step: int, tool_name: str, tool_args: Dict, tool_result: Dict) -> Dict:
+        """保存完整工具结果，并生成回传给模型的精简响应内容
+        
+        Args:
+            step: 当前步骤
+            tool_name: 工具名称
+            tool_args: 调用参数
+            tool_result: 工具返回的完整结果
+            
+        Returns:
+            Dict: functionResponse 中的 content
+        """
+        self.full_tool_results.append({
+            "step": step,
+            "tool": tool_name,
+            "arguments": tool_args,
+            "result": tool_result
+        })
+        
+        if "error" in tool_result and tool_result["error"]:
+            return {"error": tool_result["error"]}
+        
+        shaped = shape_tool_result(tool_name, tool_result, self.tool_result_token_budget)
+        if self.tool_result_token_budget > 0:
+            raw_tokens = estimate_tokens(tool_result)
+            shaped_tokens = estimate_tokens(shaped)
+            self.compaction_stats["raw_tokens"] += raw_tokens
+            self.compaction_stats["shaped_tokens"] += shaped_tokens
+            if shaped_tokens < raw_tokens:
+                logger.debug(f"工具 {tool_name} 结果已压缩: 约 {raw_tokens} -> {shaped_tokens} tokens")
+        return shaped
+        
     def _extract_text_from_gemini_response(self, response: Dict) -> str:
         """从Gemini API响应中安全地提取文本内容"""
         try:
@@ -163,23 +428,106 @@ class MCPAgent:
             logger.warning(f"无法从Gemini响应中提取文本: {e}, 响应: {response}")
         return "" # Return empty string if text cannot be extracted
         
-    async def run(self, instruction: str, history: List[Dict[str, str]] = None) -> Dict:
+    async def _stream_final_answer(self, final_messages: List[Dict], system_prompt: str,
+                                   has_final_prompt: bool = True) -> AsyncIterator[str]:
+        """以流式方式生成最终答案，逐块产出文本增量
+        
+        生成结束后（包括调用方提前停止迭代时）会用已生成的文本更新对话历史。
+        
+        Args:
+            final_messages: 包含最终提示的完整消息历史
+            system_prompt: 系统提示词
+            has_final_prompt: 最后一条消息是否为追加的最终提示（更新历史时移除）；
+                为False时最后一条是用户的问题，保留在历史中
+            
+        Yields:
+            str: 文本增量
+        """
+        collected = []
+        try:
+            logger.debug("向Gemini发送最终答案生成请求 (流式)")
+            await self.hooks.emit("on_llm_call", self, "final", self.final_model)
+            async for chunk in self.client.chat_completion(
+                model=self.final_model,
+                messages=final_messages,
+                system_prompt=system_prompt,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            ):
+                if "error" in chunk:
+                    logger.error(f"流式生成最终答案时出错: {chunk['error']}")
+                    if not collected:
+                        error_text = f"抱歉，在生成最终回复时遇到错误: {chunk['error'].get('message', '未知错误')}"
+                        collected.append(error_text)
+                        yield error_text
+                    break
+                text = self._extract_text_from_gemini_response(chunk)
+                if text:
+                    collected.append(text)
+                    await self.hooks.emit("on_answer_chunk", self, text)
+                    yield text
+            
+            if not collected:
+                logger.warning("Gemini流式响应未生成任何最终文本答案。")
+                fallback = "抱歉，我无法生成有效的回复。"
+                collected.append(fallback)
+                yield fallback
+        finally:
+            # 更新主对话历史记录 (移除最终提示，追加已生成的回答)
+            self.conversation_history = final_messages[:-1] if has_final_prompt else list(final_messages)
+            self.conversation_history.append({"role": "assistant", "content": "".join(collected).strip()})
+        
+    async def run(self, instruction: str, history: List[Dict[str, str]] = None, stream: bool = False) -> Dict:
         """执行代理
         
         Args:
             instruction: 用户指令
             history: 历史对话记录，可选
+            stream: 是否流式生成最终答案。为True且需要单独生成最终答案时，
+                回答通过结果中的 "answer_stream"（文本增量的异步迭代器）返回
             
         Returns:
             Dict: 执行结果
         """
+        self.escalations = 0
+        self.tool_token_stats = {"full": 0, "sent": 0, "expansions": 0}
+        self.select_tools(instruction, history)
+        with tracer.span("agent.run", model=self.model, step_model=self.step_model, final_model=self.final_model,
+                         plan_and_execute=self.plan_and_execute) as span:
+            result = await self._run(instruction, history, stream=stream)
+            if result.get("answer"):
+                await self.hooks.emit("on_answer_chunk", self, result["answer"])
+            span.set_attributes(
+                steps=len(result.get("steps", [])),
+                tool_calls=len(self.full_tool_results),
+                escalations=self.escalations,
+                tool_tokens_sent=self.tool_token_stats["sent"],
+                tool_tokens_saved=self.tool_token_stats["full"] - self.tool_token_stats["sent"],
+                streamed="answer_stream" in result
+            )
+            if self.tool_token_stats["full"] > self.tool_token_stats["sent"]:
+                logger.info(f"工具筛选节省: 工具声明约 {self.tool_token_stats['full']} -> {self.tool_token_stats['sent']} tokens "
+                            f"(扩展为全部工具 {self.tool_token_stats['expansions']} 次)")
+            return result
+    
+    async def _run(self, instruction: str, history: List[Dict[str, str]] = None, stream: bool = False) -> Dict:
+        """执行代理的主流程，参数同 run"""
         # 记录MCP模式设置
         logger.info(f"MCPAgent运行模式: thinking_steps={self.thinking_steps}, force_thinking={self.force_thinking}")
+        self.full_tool_results = []
+        
+        # 计划-执行模式：LLM往返次数只取决于计划深度，计划无效时回退到逐步模式
+        if self.plan_and_execute:
+            planned_result = await self._run_planned(instruction, history, stream=stream)
+            if planned_result is not None:
+                return planned_result
+            logger.info("计划-执行模式未能生成或执行计划，回退到逐步执行模式")
         
         # 快速路径：检查是否已禁用MCP（thinking_steps=0）
         if self.thinking_steps <= 0:
             logger.info("MCP模式已禁用 (thinking_steps=0)，将直接处理请求而不进行多步思考")
-            return await self._direct_response(instruction, history)
+            return await self._direct_response(instruction, history, stream=stream)
         
         # 如果提供了历史记录，使用历史记录初始化会话
         # 否则创建新的会话历史
@@ -203,27 +551,23 @@ class MCPAgent:
         # 记录当前已完成的思考步骤数
         completed_thinking_steps = 0
         
+        step_span = None
         for step in range(self.max_steps):
             logger.info(f"执行步骤 {step+1}/{self.max_steps}")
+            # 每一步一个span；提前return时由agent.run的span一并结束
+            if step_span:
+                step_span.end()
+            step_span = tracer.start_span("agent.step", activate=True, step=step + 1)
+            await self.hooks.emit("on_step_start", self, step + 1)
             
             # 检查是否已完成足够的思考步骤
             if self.force_thinking and completed_thinking_steps < self.thinking_steps:
                 logger.info(f"当前已完成思考步骤: {completed_thinking_steps}/{self.thinking_steps}")
             
-            # 获取工具定义 (OpenAI format)
-            tool_definitions = self.get_tool_definitions()
-            logger.trace(f"工具定义 (传递给GeminiClient): {json.dumps(tool_definitions, ensure_ascii=False)}")
-            
             # 调用 Gemini 进行函数/工具调用决策
             # GeminiClient.function_calling handles message and tool format conversion
             logger.debug(f"向Gemini发送函数调用请求 (第 {step+1} 步)")
-            function_decision_result = await self.client.function_calling(
-                model=self.model,
-                messages=messages_for_gemini, # Pass current history
-                tools=tool_definitions,
-                system_prompt=system_prompt,
-                temperature=self.temperature # Pass temperature
-            )
+            function_decision_result = await self._decide(messages_for_gemini, system_prompt)
             
             # 检查API调用是否出错
             if "error" in function_decision_result:
@@ -257,6 +601,11 @@ class MCPAgent:
             if not tool_calls and llm_message:
                 # 检查是否已经执行了足够的思考步骤
                 if not self.force_thinking or completed_thinking_steps >= self.thinking_steps:
+                    if self.final_model != self.step_model:
+                        # 分级模型：步骤模型的回复作为草稿，由最终模型合成答案
+                        logger.info(f"已完成 {completed_thinking_steps} 步思考，由 {self.final_model} 生成最终回复。")
+                        messages_for_gemini.append({"role": "assistant", "parts": [{"text": llm_message}]})
+                        break
                     logger.info(f"已完成 {completed_thinking_steps} 步思考，达到或超过所需的 {self.thinking_steps} 步，返回最终回复。")
                     final_answer = llm_message
                     # 使用标准格式添加到历史
@@ -313,25 +662,12 @@ class MCPAgent:
                      logger.info(f"执行工具: {tool_name}, 参数: {json.dumps(tool_args, ensure_ascii=False)}")
                      tool_result = await self.execute_tool(tool_name, **tool_args)
                      
-                     # Prepare the content for the functionResponse part
-                     response_content = {}
+                     # Prepare the content for the functionResponse part (压缩后回传，完整结果保留在本地)
+                     response_content = self._build_tool_response(step + 1, tool_name, tool_args, tool_result)
                      if "error" in tool_result and tool_result["error"]:
                          tools_execution_failed[tool_name] = tool_result["error"]
                          logger.warning(f"工具 {tool_name} 执行失败: {tool_result['error']}")
-                         response_content = {"error": tool_result["error"]}
                          all_tools_succeeded = False
-                     else:
-                         # 根据工具名称处理不同的响应格式
-                         if tool_name == "code":
-                             # 代码工具返回可能包含多个字段，统一为一个结构化响应
-                             response_content = {
-                                 "result": tool_result.get("result"),
-                                 "stdout": tool_result.get("stdout", ""),
-                                 "stderr": tool_result.get("stderr", ""),
-                                 "error": tool_result.get("error")
-                             }
-                         else:
-                             response_content = tool_result # 其他工具使用完整结果字典
                          
                      # Create the individual functionResponse part and add to list
                      tool_response_parts.append({
@@ -390,8 +726,12 @@ class MCPAgent:
             else:
                  logger.info("没有工具调用请求，进入下一步思考或生成最终答案。")
                  # 注意：此处不直接break，让循环继续判断是否需要更多思考步骤
+        if step_span:
+            step_span.end()
         
         logger.info(f"已完成的思考步骤总数: {completed_thinking_steps}/{self.thinking_steps}")
+        if self.compaction_stats["raw_tokens"]:
+            logger.info(f"工具结果压缩: 约 {self.compaction_stats['raw_tokens']} -> {self.compaction_stats['shaped_tokens']} tokens")
         
         # --- 生成最终答案 --- 
         logger.info("工具调用循环结束或达到最大步骤，开始生成最终答案...")
@@ -419,15 +759,40 @@ class MCPAgent:
              
         final_messages.append({"role": "user", "content": final_prompt_text})
         
+        if stream:
+            return {
+                "steps": results_log,
+                "answer_stream": self._stream_final_answer(final_messages, system_prompt)
+            }
+        
+        final_answer = await self._complete_final_answer(final_messages, system_prompt)
+        return {
+            "steps": results_log, # Log of actions taken
+            "answer": final_answer
+        } 
+
+    async def _complete_final_answer(self, final_messages: List[Dict], system_prompt: str,
+                                     has_final_prompt: bool = True) -> str:
+        """以非流式方式生成最终答案，并更新对话历史
+        
+        Args:
+            final_messages: 包含最终提示的完整消息历史
+            system_prompt: 系统提示词
+            has_final_prompt: 最后一条消息是否为追加的最终提示，见 _stream_final_answer
+            
+        Returns:
+            str: 最终答案（出错时为面向用户的错误说明）
+        """
         final_answer = ""
         error_generating_final = False
         
         # 使用 chat_completion 生成最终答案 (非流式)
         try:
             logger.debug("向Gemini发送最终答案生成请求 (非流式)")
+            await self.hooks.emit("on_llm_call", self, "final", self.final_model)
             # Get the async generator
             response_generator = self.client.chat_completion(
-                model=self.model,
+                model=self.final_model,
                 messages=final_messages,
                 system_prompt=system_prompt,
                 temperature=self.temperature,
@@ -468,13 +833,194 @@ class MCPAgent:
              logger.warning("Gemini未生成任何最终文本答案。")
              
         # 更新主对话历史记录 (用最后一次生成请求前的历史)
-        self.conversation_history = final_messages[:-1] # Remove the final prompt we added
+        self.conversation_history = final_messages[:-1] if has_final_prompt else list(final_messages) # Remove the final prompt we added
         self.conversation_history.append({"role": "assistant", "content": final_answer})
         
+        return final_answer.strip()
+
+    async def _run_planned(self, instruction: str, history: List[Dict[str, str]] = None, stream: bool = False) -> Optional[Dict]:
+        """计划-执行模式：一次调用生成工具调用依赖图，本地并发执行后一次合成最终答案
+        
+        Args:
+            instruction: 用户指令
+            history: 历史对话记录，可选
+            stream: 是否流式生成最终答案
+            
+        Returns:
+            Optional[Dict]: 执行结果；计划无法生成、解析或执行时返回None
+        """
+        system_prompt = self.system_prompt or "你是一个能力强大的AI助手，可以使用各种工具来解决问题。请仔细分析用户的问题，决定是否需要使用工具，并生成最终的详细回答。"
+        base_history = history.copy() if history else []
+        
+        await self.hooks.emit("on_step_start", self, 1)
+        
+        # 1. 生成计划
+        plan_span = tracer.start_span("agent.plan")
+        tool_definitions = self.get_tool_definitions()
+        self._record_tool_tokens(tool_definitions)
+        # 计划只能使用本次声明给模型的工具
+        tool_names = [definition["function"]["name"] for definition in tool_definitions]
+        planning_prompt = build_planning_prompt(instruction, tool_definitions, self.plan_max_nodes)
+        try:
+            logger.debug("向Gemini发送计划生成请求")
+            levels = await self._generate_plan(self.plan_model, base_history, planning_prompt, system_prompt, tool_names)
+            if levels is None and self.escalate_on_invalid and self.plan_model != self.model:
+                logger.info(f"计划模型 {self.plan_model} 未生成有效计划，升级到 {self.model} 重试")
+                self.escalations += 1
+                plan_span.set_attribute("escalated", True)
+                levels = await self._generate_plan(self.model, base_history, planning_prompt, system_prompt, tool_names)
+        except CassetteMiss:
+            plan_span.end()
+            raise
+        except Exception as e:
+            logger.exception("生成工具调用计划时发生意外错误")
+            plan_span.set_error(e)
+            plan_span.end()
+            return None
+        
+        if levels is None:
+            plan_span.set_error("无有效计划")
+            plan_span.end()
+            return None
+        plan_span.set_attributes(nodes=sum(len(level) for level in levels), depth=len(levels))
+        plan_span.end()
+        logger.info(f"工具调用计划: {sum(len(level) for level in levels)} 个调用，深度 {len(levels)}")
+        
+        # 2. 执行计划
+        self.conversation_history = base_history + [{"role": "user", "content": instruction}]
+        messages = self.conversation_history.copy()
+        results_log = []
+        tools_execution_failed = {}
+        
+        if levels:
+            try:
+                executed = await execute_plan(levels, self.execute_tool)
+            except CassetteMiss:
+                raise
+            except Exception:
+                logger.exception("执行工具调用计划时发生意外错误")
+                return None
+            assistant_parts = []
+            tool_response_parts = []
+            for item in executed:
+                tool_name = item["node"]["tool"]
+                tool_result = item["result"]
+                assistant_parts.append({"functionCall": {"name": tool_name, "args": item["args"]}})
+                response_content = self._build_tool_response(item["depth"], tool_name, item["args"], tool_result)
+                tool_response_parts.append({
+                    "functionResponse": {
+                        "name": tool_name,
+                        "response": {
+                            "content": response_content
+                        }
+                    }
+                })
+                if "error" in tool_result and tool_result["error"]:
+                    tools_execution_failed[f"{tool_name}({item['node']['id']})"] = tool_result["error"]
+                    logger.warning(f"工具 {tool_name} 执行失败: {tool_result['error']}")
+                results_log.append({
+                    "step": item["depth"],
+                    "tool": tool_name,
+                    "result_summary": f"工具 {tool_name} 结果: {json.dumps(response_content, ensure_ascii=False, default=str)[:200]}..."
+                })
+            messages.append({"role": "assistant", "parts": assistant_parts})
+            messages.append({"role": "tool", "parts": tool_response_parts})
+        
+        # 3. 合成最终答案
+        final_prompt_text = """根据以上工具执行结果，请生成最终回答。
+请直接提供用户可以采取行动的具体回答，不要重复工具执行的过程。"""
+        if self.check_results_for_tool_usage(results_log, "weather"):
+            final_prompt_text += "\n\n如果获取了天气信息，请在回答的开头明确总结天气信息，并据此给出具体建议。"
+        if tools_execution_failed:
+            error_details = "\n".join([f"- 工具 '{name}' 失败: {reason}" for name, reason in tools_execution_failed.items()])
+            final_prompt_text += f"\n\n以下工具执行失败了:\n{error_details}\n请告知用户相关信息无法获取，并根据可用的信息给出回答。"
+        messages.append({"role": "user", "content": final_prompt_text})
+        
+        if stream:
+            return {
+                "steps": results_log,
+                "answer_stream": self._stream_final_answer(messages, system_prompt)
+            }
         return {
-            "steps": results_log, # Log of actions taken
-            "answer": final_answer.strip()
-        } 
+            "steps": results_log,
+            "answer": await self._complete_final_answer(messages, system_prompt)
+        }
+
+    async def _generate_plan(self, model: str, base_history: List[Dict], planning_prompt: str, system_prompt: str,
+                             tool_names: List[str]) -> Optional[List[List[Dict]]]:
+        """用指定模型生成并解析工具调用计划，计划中只允许使用 tool_names 中的工具
+        
+        Returns:
+            Optional[List[List[Dict]]]: 按依赖层级分组的计划；请求失败或计划无效时返回None
+        """
+        await self.hooks.emit("on_llm_call", self, "plan", model)
+        response = await anext(self.client.chat_completion(
+            model=model,
+            messages=base_history + [{"role": "user", "content": planning_prompt}],
+            system_prompt=system_prompt,
+            temperature=0.0, # 计划需要稳定的JSON输出
+            max_tokens=self.max_tokens,
+            stream=False
+        ), None)
+        if response is None or "error" in response:
+            logger.warning(f"生成工具调用计划失败 ({model}): {response.get('error') if response else '无响应'}")
+            return None
+        
+        plan_text = self._extract_text_from_gemini_response(response)
+        try:
+            return parse_plan(plan_text, tool_names, self.plan_max_nodes)
+        except PlanError as e:
+            logger.warning(f"工具调用计划无效 ({model}): {e}, 原始输出: {plan_text[:200]}")
+            return None
+
+    def _is_valid_decision(self, decision: Dict) -> bool:
+        """工具决策是否为有效操作：文本回复，或参数为对象的已注册工具调用"""
+        if "error" in decision:
+            return False
+        tool_calls = decision.get("tool_calls") or []
+        if not tool_calls:
+            return bool(decision.get("message"))
+        return all(call.get("name") in self.tools and isinstance(call.get("arguments"), dict) for call in tool_calls)
+
+    async def _function_call(self, model: str, messages: List[Dict], system_prompt: str) -> Dict:
+        """以当前声明的工具发起一次工具决策请求"""
+        await self.hooks.emit("on_llm_call", self, "step", model)
+        tool_definitions = self.get_tool_definitions()
+        logger.trace(f"工具定义 (传递给GeminiClient): {json.dumps(tool_definitions, ensure_ascii=False)}")
+        self._record_tool_tokens(tool_definitions)
+        return await self.client.function_calling(
+            model=model,
+            messages=messages,
+            tools=tool_definitions,
+            system_prompt=system_prompt,
+            temperature=self.temperature
+        )
+
+    async def _decide(self, messages: List[Dict], system_prompt: str) -> Dict:
+        """用步骤模型做一次工具决策
+        
+        模型请求了未声明的工具时，声明全部工具后重试；仍未返回有效操作时升级到默认模型重试。
+        
+        Args:
+            messages: 当前消息历史
+            system_prompt: 系统提示词
+            
+        Returns:
+            Dict: GeminiClient.function_calling 的结果
+        """
+        decision = await self._function_call(self.step_model, messages, system_prompt)
+        if self.active_tools is not None and any(call.get("name") not in self.active_tools
+                                                 for call in decision.get("tool_calls") or []):
+            self._expand_tools("模型请求了未声明的工具")
+            decision = await self._function_call(self.step_model, messages, system_prompt)
+        if self.escalate_on_invalid and self.step_model != self.model and not self._is_valid_decision(decision):
+            logger.info(f"步骤模型 {self.step_model} 未返回有效操作，升级到 {self.model} 重试")
+            self.escalations += 1
+            span = tracer.current_span()
+            if span is not None:
+                span.set_attribute("escalated", True)
+            decision = await self._function_call(self.model, messages, system_prompt)
+        return decision
 
     def check_results_for_tool_usage(self, results_log, tool_name):
         """检查结果日志中是否使用了特定工具
@@ -492,12 +1038,13 @@ class MCPAgent:
             for result in results_log
         ) 
 
-    async def _direct_response(self, instruction: str, history: List[Dict[str, str]] = None) -> Dict:
+    async def _direct_response(self, instruction: str, history: List[Dict[str, str]] = None, stream: bool = False) -> Dict:
         """当MCP禁用时，直接生成回复而不进行多步思考
         
         Args:
             instruction: 用户指令
             history: 历史对话记录，可选
+            stream: 是否流式生成最终回复
             
         Returns:
             Dict: 执行结果
@@ -513,19 +1060,10 @@ class MCPAgent:
         
         system_prompt = self.system_prompt or "你是一个能力强大的AI助手，可以使用各种工具来解决问题。请仔细分析用户的问题，决定是否需要使用工具，并生成最终的详细回答。"
         
-        # 获取工具定义
-        tool_definitions = self.get_tool_definitions()
-        logger.trace(f"工具定义 (传递给GeminiClient): {json.dumps(tool_definitions, ensure_ascii=False)}")
-        
         # 调用 Gemini 进行单次函数/工具调用决策
         logger.debug("向Gemini发送单次函数调用请求 (MCP禁用模式)")
-        function_decision_result = await self.client.function_calling(
-            model=self.model,
-            messages=self.conversation_history,
-            tools=tool_definitions,
-            system_prompt=system_prompt,
-            temperature=self.temperature
-        )
+        await self.hooks.emit("on_step_start", self, 1)
+        function_decision_result = await self._decide(self.conversation_history, system_prompt)
         
         # 检查API调用是否出错
         if "error" in function_decision_result:
@@ -537,6 +1075,15 @@ class MCPAgent:
         llm_message = function_decision_result.get("message", "")
         tool_calls = function_decision_result.get("tool_calls", [])
         
+        # 分级模型：步骤模型直接给出回复时，改由最终模型回答
+        if not tool_calls and llm_message and self.final_model != self.step_model:
+            logger.info(f"步骤模型未要求工具调用，由 {self.final_model} 生成回复")
+            if stream:
+                return {"answer_stream": self._stream_final_answer(self.conversation_history.copy(), system_prompt,
+                                                                   has_final_prompt=False)}
+            return {"answer": await self._complete_final_answer(self.conversation_history.copy(), system_prompt,
+                                                                has_final_prompt=False)}
+        
         # 如果没有工具调用，直接返回文本回复
         if not tool_calls and llm_message:
             logger.info("Gemini未要求工具调用，直接返回文本回复")
@@ -572,23 +1119,11 @@ class MCPAgent:
                 logger.info(f"执行工具: {tool_name}, 参数: {json.dumps(tool_args, ensure_ascii=False)}")
                 tool_result = await self.execute_tool(tool_name, **tool_args)
                 
-                # 准备工具响应
-                response_content = {}
+                # 准备工具响应 (压缩后回传，完整结果保留在本地)
+                response_content = self._build_tool_response(1, tool_name, tool_args, tool_result)
                 if "error" in tool_result and tool_result["error"]:
                     tools_execution_failed[tool_name] = tool_result["error"]
                     logger.warning(f"工具 {tool_name} 执行失败: {tool_result['error']}")
-                    response_content = {"error": tool_result["error"]}
-                else:
-                    # 处理不同工具的响应格式
-                    if tool_name == "code":
-                        response_content = {
-                            "result": tool_result.get("result"),
-                            "stdout": tool_result.get("stdout", ""),
-                            "stderr": tool_result.get("stderr", ""),
-                            "error": tool_result.get("error")
-                        }
-                    else:
-                        response_content = tool_result
                 
                 # 添加工具响应
                 tool_response_parts.append({
@@ -643,11 +1178,18 @@ class MCPAgent:
             # 添加提示到历史记录
             self.conversation_history.append({"role": "user", "content": final_prompt_text})
             
+            if stream:
+                return {
+                    "steps": results_log,
+                    "answer_stream": self._stream_final_answer(self.conversation_history, system_prompt)
+                }
+            
             # 获取最终回复
             try:
                 logger.debug("向Gemini发送最终回复生成请求")
+                await self.hooks.emit("on_llm_call", self, "final", self.final_model)
                 response_generator = self.client.chat_completion(
-                    model=self.model,
+                    model=self.final_model,
                     messages=self.conversation_history,
                     system_prompt=system_prompt,
                     temperature=self.temperature,
@@ -0,0 +1,165 @@
+import re
+import json
+import asyncio
+from typing import Dict, List, Any, Callable, Awaitable
+
+from loguru import logger
+
+PLANNING_PROMPT = """请为下面的用户请求制定工具调用计划，只输出JSON，不要输出其它内容。
+
+可用工具:
+{tools}
+
+输出格式:
+{{"nodes": [{{"id": "n1", "tool": "工具名", "args": {{"参数名": "参数值"}}, "depends_on": []}}]}}
+
+规则:
+1. 每个节点是一次工具调用，id 唯一；互不依赖的调用不要添加依赖，它们会被并行执行
+2. 如果某个参数需要用到其它节点的结果，在 depends_on 中列出该节点，并在参数值中用 "${{节点id}}" 或 "${{节点id.字段名}}" 引用其结果
+3. 最多 {max_nodes} 个节点；如果不需要任何工具，输出 {{"nodes": []}}
+
+用户请求: {instruction}"""
+
+_REFERENCE_PATTERN = re.compile(r'\$\{([A-Za-z0-9_\-]+)((?:\.[^.}]+)*)\}')
+
+class PlanError(ValueError):
+    """工具调用计划无效"""
+
+def build_planning_prompt(instruction: str, tool_definitions: List[Dict], max_nodes: int) -> str:
+    """构造让模型输出工具调用依赖图的提示词"""
+    tool_lines = []
+    for definition in tool_definitions:
+        function = definition.get("function", {})
+        params = function.get("parameters", {}).get("properties", {})
+        param_desc = ", ".join(f"{name}: {details.get('description', '')}" for name, details in params.items())
+        tool_lines.append(f"- {function.get('name')}: {function.get('description', '')} (参数: {param_desc})")
+    return PLANNING_PROMPT.format(tools="\n".join(tool_lines), max_nodes=max_nodes, instruction=instruction)
+
+def parse_plan(text: str, available_tools: List[str], max_nodes: int) -> List[List[Dict]]:
+    """解析模型输出的计划，并按依赖关系分层
+
+    Args:
+        text: 模型输出的文本（可包含```json代码块）
+        available_tools: 可用工具名称（应与生成计划时声明的工具一致）
+        max_nodes: 最大节点数
+
+    Returns:
+        List[List[Dict]]: 按执行顺序排列的层，同一层的节点互不依赖
+
+    Raises:
+        PlanError: 计划无法解析或不合法
+    """
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        raise PlanError("未找到JSON计划")
+    try:
+        plan = json.loads(match.group(0))
+    except json.JSONDecodeError as e:
+        raise PlanError(f"计划JSON解析失败: {e}")
+
+    nodes = plan.get("nodes") if isinstance(plan, dict) else None
+    if not isinstance(nodes, list):
+        raise PlanError("计划缺少 nodes 列表")
+    if len(nodes) > max_nodes:
+        raise PlanError(f"计划节点数 {len(nodes)} 超过上限 {max_nodes}")
+
+    nodes_by_id = {}
+    for node in nodes:
+        if not isinstance(node, dict) or not node.get("id") or not node.get("tool"):
+            raise PlanError(f"节点格式错误: {node}")
+        node_id = str(node["id"])
+        if node_id in nodes_by_id:
+            raise PlanError(f"节点id重复: {node_id}")
+        if node["tool"] not in available_tools:
+            raise PlanError(f"节点 {node_id} 使用了未知工具: {node['tool']}")
+        args = node.get("args") or {}
+        if not isinstance(args, dict):
+            raise PlanError(f"节点 {node_id} 的参数不是对象: {args}")
+        nodes_by_id[node_id] = {
+            "id": node_id,
+            "tool": node["tool"],
+            "args": args,
+            "depends_on": [str(dep) for dep in node.get("depends_on") or []]
+        }
+
+    # 参数中引用的节点也视为依赖
+    for node in nodes_by_id.values():
+        referenced = {ref for ref, _ in _REFERENCE_PATTERN.findall(json.dumps(node["args"], ensure_ascii=False))}
+        for dep in set(node["depends_on"]) | referenced:
+            if dep not in nodes_by_id:
+                raise PlanError(f"节点 {node['id']} 依赖了不存在的节点: {dep}")
+        node["depends_on"] = sorted(set(node["depends_on"]) | referenced)
+
+    # 拓扑分层
+    levels = []
+    done = set()
+    remaining = dict(nodes_by_id)
+    while remaining:
+        ready = [node for node in remaining.values() if all(dep in done for dep in node["depends_on"])]
+        if not ready:
+            raise PlanError(f"计划存在循环依赖: {sorted(remaining)}")
+        levels.append(ready)
+        for node in ready:
+            done.add(node["id"])
+            del remaining[node["id"]]
+    return levels
+
+def _lookup(value: Any, path: str) -> Any:
+    """按 .字段 路径取值，列表支持数字下标"""
+    for key in filter(None, path.split(".")):
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return None
+    return value
+
+def resolve_args(args: Any, outputs: Dict[str, Dict]) -> Any:
+    """将参数中的 ${节点id.字段} 引用替换为依赖节点的结果"""
+    if isinstance(args, dict):
+        return {key: resolve_args(value, outputs) for key, value in args.items()}
+    if isinstance(args, list):
+        return [resolve_args(value, outputs) for value in args]
+    if not isinstance(args, str):
+        return args
+
+    whole = _REFERENCE_PATTERN.fullmatch(args)
+    if whole:
+        # 整个参数就是一个引用时保留原始类型
+        return _lookup(outputs.get(whole.group(1)), whole.group(2))
+
+    def replace(match):
+        value = _lookup(outputs.get(match.group(1)), match.group(2))
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return _REFERENCE_PATTERN.sub(replace, args)
+
+async def execute_plan(levels: List[List[Dict]],
+                       execute_fn: Callable[..., Awaitable[Dict]]) -> List[Dict]:
+    """逐层执行计划，同一层的节点并发执行，结果沿依赖边传递
+
+    Args:
+        levels: parse_plan 返回的分层节点
+        execute_fn: 工具执行函数，签名同 MCPAgent.execute_tool
+
+    Returns:
+        List[Dict]: 按执行顺序排列的 {"node": 节点, "depth": 层号, "args": 实际参数, "result": 结果}
+    """
+    outputs: Dict[str, Dict] = {}
+    executed = []
+
+    async def run_node(node: Dict) -> Dict:
+        failed_deps = [dep for dep in node["depends_on"] if outputs.get(dep, {}).get("error")]
+        if failed_deps:
+            return {"node": node, "args": node["args"],
+                    "result": {"error": f"依赖的步骤 {', '.join(failed_deps)} 执行失败，已跳过"}}
+        args = resolve_args(node["args"], outputs)
+        return {"node": node, "args": args, "result": await execute_fn(node["tool"], **args)}
+
+    for depth, level in enumerate(levels):
+        logger.info(f"执行计划第 {depth + 1}/{len(levels)} 层，共 {len(level)} 个并行调用")
+        for item in await asyncio.gather(*(run_node(node) for node in level)):
+            item["depth"] = depth + 1
+            outputs[item["node"]["id"]] = item["result"]
+            executed.append(item)
+    return executed
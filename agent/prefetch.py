@@ -0,0 +1,54 @@
+import re
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+# 查询前缀与时间词，匹配城市名前先去掉
+_QUERY_PREFIX_PATTERN = re.compile(r'^(?:请问|请|帮我|帮忙|给我)?(?:查询一下|查询|查一下|查查|查|看看|看一下|问一下)?')
+_TIME_WORDS_PATTERN = re.compile(r'今天|明天|后天|今日|明日|现在|目前|最近|这几天|未来几天|未来一周|一周|本周|这周')
+
+# 天气意图: "北京天气"、"北京今天的天气怎么样"
+_WEATHER_PATTERN = re.compile(r'^([一-龥]{2,8}?)(?:市)?的?天气')
+
+# 股票意图: A股6位代码 / 港股5位代码，需同时出现股票相关关键词
+_STOCK_A_PATTERN = re.compile(r'(?<![\d.])([036]\d{5})(?![\d])')
+_STOCK_HK_PATTERN = re.compile(r'(?<![\d.])(\d{5})(?:\.HK)?(?![\d])', re.IGNORECASE)
+_STOCK_KEYWORDS = ("股价", "股票", "行情", "走势", "涨跌", "股")
+
+def detect_tool_intents(query: str) -> List[Tuple[str, Dict]]:
+    """根据廉价的规则匹配预测用户请求可能用到的工具调用
+
+    只匹配含义明确的请求，预测失败的代价仅是一次被取消或未使用的工具调用。
+
+    Args:
+        query: 用户请求文本
+
+    Returns:
+        List[Tuple[str, Dict]]: (工具名称, 调用参数) 列表
+    """
+    intents = []
+    text = query.strip()
+    if not text:
+        return intents
+
+    # 天气
+    if "天气" in text:
+        cleaned = _TIME_WORDS_PATTERN.sub("", text)
+        cleaned = _QUERY_PREFIX_PATTERN.sub("", cleaned).strip()
+        match = _WEATHER_PATTERN.match(cleaned)
+        if match:
+            intents.append(("weather", {"city": match.group(1)}))
+
+    # 股票
+    if any(keyword in text for keyword in _STOCK_KEYWORDS):
+        a_codes = _STOCK_A_PATTERN.findall(text)
+        if len(a_codes) == 1:
+            intents.append(("stock", {"code": a_codes[0], "market": "A"}))
+        elif not a_codes and "港股" in text:
+            hk_codes = _STOCK_HK_PATTERN.findall(text)
+            if len(hk_codes) == 1:
+                intents.append(("stock", {"code": hk_codes[0], "market": "HK"}))
+
+    if intents:
+        logger.debug(f"检测到可预取的工具意图: {intents}")
+    return intents
@@ -0,0 +1,165 @@
+import json
+import re
+import sys
+from typing import Any, Callable, Dict
+
+# CJK字符约1 token/字，其它字符约4字符/token
+_CJK_PATTERN = re.compile(r'[　-〿一-鿿＀-￯]')
+
+TRUNCATION_MARK = "...(截断)"
+
+def estimate_tokens(value: Any) -> int:
+    """粗略估算文本或JSON结构的token数
+
+    Args:
+        value: 字符串或可序列化为JSON的对象
+
+    Returns:
+        int: 估算的token数
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    cjk_count = len(_CJK_PATTERN.findall(value))
+    return cjk_count + (len(value) - cjk_count + 3) // 4
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """按token预算截断文本，保留开头部分"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 先按最坏情况(每字符1 token)截取，再逐步放宽到预算内的最长前缀
+    low, high = max_tokens, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + TRUNCATION_MARK
+
+def _compact(value: Any, max_string_tokens: int, max_items: int) -> Any:
+    """递归压缩结构: 截断长字符串、限制列表长度、去掉空值"""
+    if isinstance(value, str):
+        return truncate_text(value, max_string_tokens)
+    if isinstance(value, float):
+        return round(value, 4)
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if item is None or item == "" or item == [] or item == {}:
+                continue
+            compacted[key] = _compact(item, max_string_tokens, max_items)
+        return compacted
+    if isinstance(value, (list, tuple)):
+        items = [_compact(item, max_string_tokens, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"...(其余 {len(value) - max_items} 项已省略)")
+        return items
+    return value
+
+def _page_summary(page: Dict, content_tokens: int) -> Dict:
+    """提取Firecrawl页面中模型需要的字段"""
+    metadata = page.get("metadata") or {}
+    content = page.get("markdown") or page.get("content") or page.get("html") or ""
+    summary = {
+        "url": page.get("url") or metadata.get("sourceURL") or metadata.get("url"),
+        "title": page.get("title") or metadata.get("title"),
+        "description": page.get("description") or metadata.get("description"),
+    }
+    if page.get("json"):
+        summary["json"] = page["json"]
+    if content:
+        summary["content"] = truncate_text(content, content_tokens)
+    return summary
+
+def _shape_firecrawl(result: Dict, budget: int) -> Dict:
+    payload = result.get("result")
+    shaped = {key: value for key, value in result.items() if key != "result"}
+    if isinstance(payload, dict) and isinstance(payload.get("data"), list):
+        pages = [page for page in payload["data"] if isinstance(page, dict)]
+        per_page = max(budget // max(len(pages), 1), 50)
+        shaped["pages"] = [_page_summary(page, per_page) for page in pages]
+        shaped["total_pages"] = len(pages)
+    elif isinstance(payload, dict):
+        shaped["page"] = _page_summary(payload, budget)
+    else:
+        shaped["result"] = payload
+    return shaped
+
+def _shape_search(result: Dict, budget: int) -> Dict:
+    results = result.get("results") or []
+    per_item = max(budget // max(len(results), 1), 40)
+    shaped = {key: value for key, value in result.items() if key != "results"}
+    shaped["results"] = [
+        {
+            "title": item.get("title", ""),
+            "snippet": truncate_text(item.get("snippet", ""), per_item),
+            "url": item.get("url", "")
+        }
+        for item in results if isinstance(item, dict)
+    ]
+    return shaped
+
+def _shape_code(result: Dict, budget: int) -> Dict:
+    # 代码工具返回可能包含多个字段，统一为一个结构化响应
+    output_budget = max(budget // 2, 50)
+    shaped = {
+        "result": result.get("result"),
+        "stdout": truncate_text(result.get("stdout", "") or "", output_budget),
+        "stderr": truncate_text(result.get("stderr", "") or "", output_budget // 2),
+        "error": result.get("error")
+    }
+    # 生成的图表和给模型的说明（如"图表会自动发送"）需要保留
+    for key in ("images", "message"):
+        if result.get(key):
+            shaped[key] = result[key]
+    return shaped
+
+def _shape_weather(result: Dict, budget: int) -> Dict:
+    shaped = dict(result)
+    # 天气指数只保留等级，详细描述对回答帮助不大
+    indexes = shaped.get("weather_indexes")
+    if isinstance(indexes, dict):
+        shaped["weather_indexes"] = {
+            name: info.get("level", "") if isinstance(info, dict) else info
+            for name, info in indexes.items()
+        }
+    return shaped
+
+_SHAPERS: Dict[str, Callable[[Dict, int], Dict]] = {
+    "firecrawl": _shape_firecrawl,
+    "search": _shape_search,
+    "code": _shape_code,
+    "weather": _shape_weather,
+}
+
+def shape_tool_result(tool_name: str, result: Dict, token_budget: int) -> Dict:
+    """将工具结果压缩为回传给模型的精简结构
+
+    先按工具类型只保留模型需要的字段，再整体压缩到token预算以内。
+    完整结果由调用方自行保存。
+
+    Args:
+        tool_name: 工具名称
+        result: 工具返回的完整结果
+        token_budget: 回传内容的token预算，<=0 表示不压缩
+
+    Returns:
+        Dict: 精简后的结果
+    """
+    if token_budget <= 0:
+        # 不压缩时仍统一代码工具的响应结构
+        return _shape_code(result, sys.maxsize) if tool_name == "code" else result
+
+    shaper = _SHAPERS.get(tool_name)
+    shaped = shaper(result, token_budget) if shaper else result
+
+    # 逐步收紧字符串和列表上限，直到满足预算
+    max_string_tokens, max_items = token_budget, 20
+    compacted = _compact(shaped, max_string_tokens, max_items)
+    while estimate_tokens(compacted) > token_budget and max_string_tokens > 20:
+        max_string_tokens //= 2
+        max_items = max(max_items // 2, 3)
+        compacted = _compact(shaped, max_string_tokens, max_items)
+    return compacted
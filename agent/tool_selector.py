@@ -0,0 +1,76 @@
+from typing import Dict, List, Iterable, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .embedding import HashingEmbedder, normalize_text
+
+class ToolSelector:
+    """按请求挑选相关工具，只向模型声明其中的 top-k 个
+
+    相关度 = 关键词命中得分 + 请求与工具描述（名称、描述、关键词、参数说明）的向量相似度。
+    关键词命中是强信号，命中的工具总会排在只有向量相似度的工具之前。
+    """
+
+    def __init__(self, top_k: int = 3, min_score: float = 0.2, keyword_weight: float = 1.0,
+                 always_include: Iterable[str] = (), embedder: HashingEmbedder = None):
+        """初始化
+
+        Args:
+            top_k: 最多选出的工具数（不含 always_include）
+            min_score: 入选所需的最低相关度，全部低于该值时不声明任何工具
+            keyword_weight: 每个关键词命中的得分（最多计两次）
+            always_include: 总是声明的工具名称
+            embedder: 向量化器，为None时使用 HashingEmbedder
+        """
+        self.top_k = top_k
+        self.min_score = min_score
+        self.keyword_weight = keyword_weight
+        self.always_include = set(always_include)
+        self.embedder = embedder or HashingEmbedder()
+        # (工具名, 描述) -> 工具画像向量，描述变化（如绘图工具更新模型列表）时重新计算
+        self._profiles: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def _profile(self, tool) -> np.ndarray:
+        key = (tool.name, tool.description)
+        vector = self._profiles.get(key)
+        if vector is None:
+            parts = [tool.name, tool.description, " ".join(getattr(tool, "keywords", ()))]
+            parts.extend(details.get("description", "") for details in tool.parameters.values()
+                         if isinstance(details, dict))
+            vector = self.embedder.embed(" ".join(parts))
+            self._profiles[key] = vector
+        return vector
+
+    def score(self, text: str, tools: Dict[str, object]) -> Dict[str, float]:
+        """计算每个工具与请求的相关度"""
+        query_vector = self.embedder.embed(text)
+        lowered = normalize_text(text)
+        scores = {}
+        for name, tool in tools.items():
+            keyword_hits = sum(1 for keyword in getattr(tool, "keywords", ()) if keyword.lower() in lowered)
+            similarity = float(self._profile(tool) @ query_vector)
+            scores[name] = min(keyword_hits, 2) * self.keyword_weight + max(similarity, 0.0)
+        return scores
+
+    def select(self, text: str, tools: Dict[str, object], required: Iterable[str] = ()) -> List[str]:
+        """选出与请求相关的工具
+
+        Args:
+            text: 用于判断相关度的文本（当前请求，可附带上一轮用户消息）
+            tools: 已注册的工具 {名称: 工具实例}
+            required: 必须包含的工具名称（如已预取的工具）
+
+        Returns:
+            List[str]: 选中的工具名称，按相关度排序
+        """
+        scores = self.score(text, tools)
+        ranked = sorted((name for name in tools if scores[name] >= self.min_score),
+                        key=lambda name: scores[name], reverse=True)
+        selected = ranked[:self.top_k]
+        for name in list(self.always_include) + list(required):
+            if name in tools and name not in selected:
+                selected.append(name)
+        logger.debug("工具相关度: " + ", ".join(f"{name}={scores[name]:.2f}" for name in
+                                            sorted(scores, key=scores.get, reverse=True)))
+        return selected
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import asyncio
+import secrets
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional, Iterator
+
+from loguru import logger
+
+try:
+    import aiohttp
+except ImportError: # OTLP导出是可选功能
+    aiohttp = None
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("openmanus_current_span", default=None)
+
+class Span:
+    """一次计时的操作，属于某个trace，可嵌套"""
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"] = None, attributes: Dict = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.error = None
+        self.start_time = time.time()
+        self.end_time = None
+        self._start_monotonic = time.monotonic()
+        self.duration_ms = None
+        self._token = None
+        self._open_children: List["Span"] = []
+
+    @property
+    def parent_id(self) -> Optional[str]:
+        return self.parent.span_id if self.parent else None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def set_error(self, error: Any) -> None:
+        self.status = "error"
+        self.error = str(error)[:500]
+
+    def end(self) -> None:
+        """结束span；重复调用无副作用，未结束的子span会一并结束"""
+        if self.end_time is not None:
+            return
+        for child in list(self._open_children):
+            child.end()
+        self.end_time = time.time()
+        self.duration_ms = round((time.monotonic() - self._start_monotonic) * 1000, 2)
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # 在其它上下文中被父span强制结束
+                pass
+            self._token = None
+        if self.parent and self in self.parent._open_children:
+            self.parent._open_children.remove(self)
+        self.tracer._on_span_end(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+class Tracer:
+    """轻量级追踪器
+
+    span通过contextvars嵌套，根span结束时整条trace写入内存环形缓冲区，
+    并可选地追加到JSONL文件和发送到OTLP/HTTP收集器。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.traces: deque = deque(maxlen=200)
+        self.jsonl_path = None
+        self.otlp_endpoint = None
+        self.service_name = "OpenManus"
+        self.slow_threshold_ms = 20000
+        self._pending: Dict[str, List[Span]] = {}
+        self._export_tasks = set()
+        # 写JSONL文件的单线程执行器：不阻塞事件循环，且按trace完成的顺序写入
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    def configure(self, enable: bool = True, buffer_size: int = 200, jsonl_path: str = None,
+                  otlp_endpoint: str = None, service_name: str = "OpenManus",
+                  slow_threshold_ms: float = 20000) -> None:
+        """配置追踪器
+
+        Args:
+            enable: 是否启用追踪
+            buffer_size: 内存中保留的trace条数
+            jsonl_path: JSONL文件路径，为空则不写文件
+            otlp_endpoint: OTLP/HTTP traces接口地址，如 http://127.0.0.1:4318/v1/traces，为空则不导出
+            service_name: 上报的服务名
+            slow_threshold_ms: 慢请求阈值（毫秒）
+        """
+        self.enabled = enable
+        self.traces = deque(self.traces, maxlen=max(int(buffer_size), 1))
+        self.jsonl_path = jsonl_path or None
+        self.otlp_endpoint = otlp_endpoint or None
+        self.service_name = service_name
+        self.slow_threshold_ms = slow_threshold_ms
+        if self.jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+        if self.otlp_endpoint and aiohttp is None:
+            logger.warning("未安装aiohttp，OTLP导出已禁用")
+            self.otlp_endpoint = None
+        logger.info(f"追踪配置: enable={enable}, buffer_size={buffer_size}, jsonl={self.jsonl_path}, otlp={self.otlp_endpoint}")
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, name: str, activate: bool = False, **attributes) -> Span:
+        """开始一个span，父span为当前上下文中的span
+
+        Args:
+            name: span名称
+            activate: 是否设为当前span（之后开始的span会成为它的子span）。
+                跨越yield的异步生成器中不要激活
+            **attributes: span属性
+
+        Returns:
+            Span: 需调用 end() 结束
+        """
+        parent = _current_span.get()
+        if parent is not None and parent.end_time is not None:
+            parent = None
+        span = Span(self, name, parent, attributes)
+        if parent is not None:
+            parent._open_children.append(span)
+        if activate:
+            span._token = _current_span.set(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """以上下文管理器形式记录span，异常会记录到span并继续抛出"""
+        span = self.start_span(name, activate=True, **attributes)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.status = "cancelled"
+            raise
+        except Exception as e:
+            span.set_error(e)
+            raise
+        finally:
+            span.end()
+
+    def _on_span_end(self, span: Span) -> None:
+        if not self.enabled:
+            return
+        if span.parent is not None:
+            if span.parent.end_time is None:
+                self._pending.setdefault(span.trace_id, []).append(span)
+            return
+        # 根span结束，整条trace完成
+        spans = self._pending.pop(span.trace_id, [])
+        spans.append(span)
+        trace = {
+            "trace_id": span.trace_id,
+            "name": span.name,
+            "start": span.start_time,
+            "duration_ms": span.duration_ms,
+            "status": span.status,
+            "attributes": span.attributes,
+            "spans": [s.to_dict() for s in sorted(spans, key=lambda s: s.start_time)],
+        }
+        self.traces.append(trace)
+        self._write_jsonl(trace)
+        self._export_otlp(spans)
+        if span.duration_ms is not None and span.duration_ms >= self.slow_threshold_ms:
+            logger.warning(f"慢请求 {span.duration_ms / 1000:.1f}s\n{format_trace_report(trace)}")
+
+    def _write_jsonl(self, trace: Dict) -> None:
+        if not self.jsonl_path:
+            return
+        # 在当前线程序列化，之后span属性再被修改也不影响写入的内容
+        line = json.dumps(trace, ensure_ascii=False, default=str) + "\n"
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append_line(self.jsonl_path, line)
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+        loop.run_in_executor(self._writer, self._append_line, self.jsonl_path, line)
+
+    @staticmethod
+    def _append_line(path: str, line: str) -> None:
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"写入trace文件失败: {e}")
+
+    def _export_otlp(self, spans: List[Span]) -> None:
+        if not self.otlp_endpoint:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._post_otlp(_to_otlp(spans, self.service_name)))
+        self._export_tasks.add(task)
+        task.add_done_callback(self._export_tasks.discard)
+
+    async def _post_otlp(self, payload: Dict) -> None:
+        try:
+            timeout = aiohttp.ClientTimeout(total=5)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.post(self.otlp_endpoint, json=payload) as response:
+                    if response.status >= 300:
+                        logger.debug(f"OTLP导出失败: {response.status} - {await response.text()}")
+        except Exception as e:
+            logger.debug(f"OTLP导出异常: {e}")
+
+    def recent_traces(self, limit: int = 20) -> List[Dict]:
+        """返回最近完成的trace，最新的在前"""
+        return list(self.traces)[-limit:][::-1]
+
+    def slow_traces(self, threshold_ms: float = None, limit: int = 10) -> List[Dict]:
+        """返回缓冲区中超过阈值的trace，按耗时降序"""
+        threshold = self.slow_threshold_ms if threshold_ms is None else threshold_ms
+        slow = [trace for trace in self.traces if (trace["duration_ms"] or 0) >= threshold]
+        return sorted(slow, key=lambda trace: trace["duration_ms"], reverse=True)[:limit]
+
+    def slow_report(self, threshold_ms: float = None, limit: int = 5) -> str:
+        """生成慢请求报告文本"""
+        slow = self.slow_traces(threshold_ms, limit)
+        if not slow:
+            return "没有超过阈值的慢请求"
+        return "\n\n".join(format_trace_report(trace) for trace in slow)
+
+def _span_category(name: str) -> str:
+    return name.split(".", 1)[0]
+
+def format_trace_report(trace: Dict, max_spans: int = 15) -> str:
+    """把一条trace格式化为耗时分解报告
+
+    按类别（llm/tool/tts/wechat...）汇总自身耗时（并发执行时合计可能超过总耗时），
+    并列出最慢的span。
+
+    Args:
+        trace: Tracer记录的trace
+        max_spans: 最多列出的span数
+
+    Returns:
+        str: 报告文本
+    """
+    spans = trace["spans"]
+    children_ms: Dict[str, float] = {}
+    for span in spans:
+        if span["parent_id"]:
+            children_ms[span["parent_id"]] = children_ms.get(span["parent_id"], 0) + (span["duration_ms"] or 0)
+
+    # 自身耗时 = 总耗时 - 子span耗时（并发子span可能使其为负，按0计）
+    by_category: Dict[str, float] = {}
+    for span in spans:
+        self_ms = max((span["duration_ms"] or 0) - children_ms.get(span["span_id"], 0), 0)
+        category = _span_category(span["name"])
+        by_category[category] = by_category.get(category, 0) + self_ms
+
+    total = trace["duration_ms"] or 0
+    lines = [f"trace {trace['trace_id']} [{trace['name']}] 总耗时 {total:.0f}ms 状态 {trace['status']}"]
+    for category, ms in sorted(by_category.items(), key=lambda item: item[1], reverse=True):
+        share = ms / total if total else 0
+        lines.append(f"  {category:<10} {ms:>9.0f}ms {share:>5.0%}")
+    lines.append("  最慢的span:")
+    for span in sorted(spans, key=lambda s: s["duration_ms"] or 0, reverse=True)[:max_spans]:
+        attrs = ", ".join(f"{k}={v}" for k, v in span["attributes"].items())
+        error = f" 错误: {span['error']}" if span["error"] else ""
+        lines.append(f"    {span['duration_ms'] or 0:>9.0f}ms {span['name']} ({attrs}){error}")
+    return "\n".join(lines)
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _to_otlp(spans: List[Span], service_name: str) -> Dict:
+    """转换为OTLP/HTTP JSON格式"""
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int(span.end_time * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "openmanus.tracing"}, "spans": otlp_spans}]
+        }]
+    }
+
+# 进程内共享的追踪器
+tracer = Tracer()
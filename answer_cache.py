@@ -0,0 +1,267 @@
+import re
+import time
+import itertools
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .agent.embedding import HashingEmbedder, normalize_text
+
+SCOPE_OFF = "off"        # 不缓存
+SCOPE_SESSION = "group"  # 每个群/私聊独立缓存
+SCOPE_GLOBAL = "global"  # 所有群共享缓存，私聊仍按用户隔离（除非 share_private）
+
+# 查询类型 -> 默认TTL（秒），0 表示不缓存
+DEFAULT_TTL_BY_TYPE = {"volatile": 0, "realtime": 600, "general": 86400}
+
+# 每次回答都应不同或与当前时刻相关的请求
+_VOLATILE_PATTERN = re.compile(r'几点|时间|随机|抽签|抽一个|笑话|猜|掷|骰子|占卜|运势|讲个故事')
+# 结果随行情/天气/新闻变化的请求
+_REALTIME_PATTERN = re.compile(r'天气|气温|下雨|股价|股票|行情|大盘|涨跌|汇率|油价|金价|新闻|热搜|最新|实时|现在|目前|今天|明天|本周|这周')
+# 涉及个人信息的请求，不缓存也不命中
+_PRIVATE_PATTERN = re.compile(r'我的|我叫|我是|记住|帮我记|身份证|手机号|电话|密码|地址|邮箱|银行卡|\d{11,}|[\w.+-]+@[\w-]+\.[\w.]+')
+# 依赖上文的追问，脱离对话历史无法正确回答
+_CONTEXT_PATTERN = re.compile(r'^(?:那|那么|它|他|她|这个|那个|这些|那些|继续|再|还有|然后|为什么)|刚才|上面|之前|前面|上一个|你说的')
+
+# 命中时比较实体：数字、英文/代码，以及去掉以下虚词后的汉字
+_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+_ASCII_WORD_PATTERN = re.compile(r'[a-z][a-z0-9]*')
+_FUNCTION_CHARS = set("的了吗呢啊呀吧么是在有会要能可以怎样什哪个一下请问帮我你")
+
+class CacheEntry:
+    """缓存的一条问答"""
+
+    def __init__(self, entry_id: int, scope: str, query: str, normalized: str, vector: np.ndarray,
+                 answer: str, query_type: str, ttl: float):
+        self.entry_id = entry_id
+        self.scope = scope
+        self.query = query
+        self.normalized = normalized
+        self.vector = vector
+        self.answer = answer
+        self.query_type = query_type
+        self.created_at = time.time()
+        self.expires_at = self.created_at + ttl
+        self.hits = 0
+
+class CacheHit:
+    """一次缓存命中"""
+
+    def __init__(self, entry: CacheEntry, similarity: float):
+        self.entry = entry
+        self.answer = entry.answer
+        self.similarity = similarity
+        self.age = time.time() - entry.created_at
+
+class _ScopeIndex:
+    """一个缓存范围内的向量矩阵，条目变化后在下次查询时重建"""
+
+    def __init__(self):
+        self.entry_ids: List[int] = []
+        self.matrix: Optional[np.ndarray] = None
+        self.dirty = False
+
+def _entities(normalized: str) -> Tuple[frozenset, frozenset, frozenset]:
+    """提取数字、英文词和实义汉字，用于防止 "北京/南京"、"600519/000001" 这类高相似度误命中"""
+    numbers = frozenset(_NUMBER_PATTERN.findall(normalized))
+    words = frozenset(_ASCII_WORD_PATTERN.findall(_NUMBER_PATTERN.sub(" ", normalized)))
+    chars = frozenset(ch for ch in normalized if "一" <= ch <= "鿿" and ch not in _FUNCTION_CHARS)
+    return numbers, words, chars
+
+class AnswerCache:
+    """答案级的语义缓存
+
+    查询归一化后用本地哈希向量化，在所属范围内按余弦相似度查找；相似度超过阈值且
+    数字/英文/实义汉字完全一致时直接返回缓存的最终回答。TTL按查询类型决定，
+    超出容量时按最近最少使用淘汰。
+    """
+
+    def __init__(self, scope: str = SCOPE_SESSION, threshold: float = 0.88, near_miss_threshold: float = 0.75,
+                 max_entries: int = 1000, ttl_by_type: Dict[str, float] = None, share_private: bool = False,
+                 max_query_chars: int = 200, embedder: HashingEmbedder = None):
+        """初始化
+
+        Args:
+            scope: 缓存范围，"group" 每个会话独立，"global" 群聊共享，"off" 关闭
+            threshold: 命中所需的最小余弦相似度
+            near_miss_threshold: 相似度在此值和 threshold 之间（或实体不一致）计为近似未命中
+            max_entries: 最大缓存条目数（所有范围合计）
+            ttl_by_type: 查询类型 -> TTL（秒），类型为 volatile/realtime/general
+            share_private: global 范围下私聊是否也共享缓存
+            max_query_chars: 超过该长度的查询不缓存
+            embedder: 向量化器，为None时使用 HashingEmbedder
+        """
+        if scope not in (SCOPE_OFF, SCOPE_SESSION, SCOPE_GLOBAL):
+            raise ValueError(f"未知的缓存范围: {scope}")
+        self.scope = scope
+        self.threshold = threshold
+        self.near_miss_threshold = near_miss_threshold
+        self.max_entries = max(int(max_entries), 1)
+        self.ttl_by_type = {**DEFAULT_TTL_BY_TYPE, **(ttl_by_type or {})}
+        self.share_private = share_private
+        self.max_query_chars = max_query_chars
+        self.embedder = embedder or HashingEmbedder()
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()  # 按最近使用排序
+        self._indexes: Dict[str, _ScopeIndex] = {}
+        self._ids = itertools.count()
+        self.stats = {"lookups": 0, "hits": 0, "near_misses": 0, "misses": 0, "skipped": 0,
+                      "stores": 0, "evictions": 0, "expired": 0}
+
+    def scope_key(self, session_id: str, is_group: bool) -> Optional[str]:
+        """确定会话所属的缓存范围；关闭时返回None"""
+        if self.scope == SCOPE_OFF or not session_id:
+            return None
+        if self.scope == SCOPE_GLOBAL and (is_group or self.share_private):
+            return "global"
+        return session_id
+
+    def classify(self, query: str) -> str:
+        """查询类型：volatile（不缓存）/ realtime（短TTL）/ general"""
+        if _VOLATILE_PATTERN.search(query):
+            return "volatile"
+        if _REALTIME_PATTERN.search(query):
+            return "realtime"
+        return "general"
+
+    def check_cacheable(self, query: str) -> Optional[str]:
+        """检查查询能否使用缓存
+
+        Returns:
+            Optional[str]: 不能使用缓存的原因；可以使用时返回None
+        """
+        if "\n" in query or len(query) > self.max_query_chars:
+            return "查询过长或为多条消息合并"
+        if _PRIVATE_PATTERN.search(query):
+            return "包含个人信息"
+        if _CONTEXT_PATTERN.search(query.strip()):
+            return "依赖上文"
+        if self.ttl_by_type.get(self.classify(query), 0) <= 0:
+            return "查询类型不缓存"
+        return None
+
+    def lookup(self, query: str, session_id: str, is_group: bool) -> Optional[CacheHit]:
+        """查找近似问题的缓存回答
+
+        Args:
+            query: 用户请求
+            session_id: 会话ID
+            is_group: 是否群聊
+
+        Returns:
+            Optional[CacheHit]: 命中结果；未命中时返回None
+        """
+        scope = self.scope_key(session_id, is_group)
+        if scope is None:
+            return None
+        reason = self.check_cacheable(query)
+        if reason:
+            self.stats["skipped"] += 1
+            logger.debug(f"答案缓存跳过 ({reason}): {query}")
+            return None
+
+        self.stats["lookups"] += 1
+        self._expire()
+        index = self._indexes.get(scope)
+        normalized = normalize_text(query)
+        if index is None or not index.entry_ids or not normalized:
+            self.stats["misses"] += 1
+            return None
+
+        if index.dirty or index.matrix is None:
+            index.matrix = np.vstack([self._entries[entry_id].vector for entry_id in index.entry_ids])
+            index.dirty = False
+        similarities = index.matrix @ self.embedder.embed(normalized, normalized=True)
+        # 按相似度从高到低检查超过阈值的候选，第一个实体一致的即为命中
+        entities = _entities(normalized)
+        for position in np.argsort(-similarities):
+            similarity = float(similarities[position])
+            if similarity < self.threshold:
+                break
+            entry = self._entries[index.entry_ids[position]]
+            if entities == _entities(entry.normalized):
+                entry.hits += 1
+                self._entries.move_to_end(entry.entry_id)
+                self.stats["hits"] += 1
+                logger.info(f"答案缓存命中 (相似度 {similarity:.3f}): '{query}' ≈ '{entry.query}'")
+                return CacheHit(entry, similarity)
+
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        entry = self._entries[index.entry_ids[best]]
+        if similarity >= self.near_miss_threshold:
+            self.stats["near_misses"] += 1
+            logger.debug(f"答案缓存近似未命中 (相似度 {similarity:.3f}): '{query}' vs '{entry.query}'")
+        else:
+            self.stats["misses"] += 1
+        return None
+
+    def store(self, query: str, answer: str, session_id: str, is_group: bool) -> bool:
+        """缓存一条问答
+
+        Returns:
+            bool: 是否已缓存
+        """
+        scope = self.scope_key(session_id, is_group)
+        if scope is None or not answer or self.check_cacheable(query):
+            return False
+        normalized = normalize_text(query)
+        if not normalized:
+            return False
+
+        query_type = self.classify(query)
+        entry = CacheEntry(next(self._ids), scope, query, normalized,
+                           self.embedder.embed(normalized, normalized=True), answer,
+                           query_type, self.ttl_by_type[query_type])
+        # 同一范围内归一化后相同的问题只保留最新回答
+        index = self._indexes.get(scope)
+        for entry_id in list(index.entry_ids) if index else []:
+            if self._entries[entry_id].normalized == normalized:
+                self._remove(entry_id)
+        # 删除重复条目可能移除了该范围的索引，之后再取得（或新建）
+        index = self._indexes.setdefault(scope, _ScopeIndex())
+        self._entries[entry.entry_id] = entry
+        index.entry_ids.append(entry.entry_id)
+        index.dirty = True
+        self.stats["stores"] += 1
+
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self._remove(oldest_id)
+            self.stats["evictions"] += 1
+        return True
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        index = self._indexes.get(entry.scope)
+        if index is None:
+            return
+        if entry_id in index.entry_ids:
+            index.entry_ids.remove(entry_id)
+        index.dirty = True
+        if not index.entry_ids:
+            del self._indexes[entry.scope]
+
+    def _expire(self) -> None:
+        now = time.time()
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry.expires_at <= now]:
+            self._remove(entry_id)
+            self.stats["expired"] += 1
+
+    def clear(self, session_id: Optional[str] = None) -> None:
+        """清空缓存；指定会话时只清空该会话自己的范围"""
+        for entry_id in [entry_id for entry_id, entry in self._entries.items()
+                         if session_id is None or entry.scope == session_id]:
+            self._remove(entry_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        """命中率和容量指标"""
+        lookups = max(self.stats["lookups"], 1)
+        return {
+            "entries": len(self._entries),
+            "scopes": len(self._indexes),
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4),
+            "near_miss_rate": round(self.stats["near_misses"] / lookups, 4),
+        }
@@ -1,6 +1,7 @@
 import aiohttp
 import json
 import asyncio
+import threading
 from typing import Dict, List, Optional, AsyncGenerator, Any, Tuple, Union
 from loguru import logger
 import time
@@ -14,6 +15,19 @@ import io
 import base64
 import requests
 
+from .agent.tracing import tracer
+from .agent.cassette import current_cassette
+
+def _record_usage(span, response: Dict) -> None:
+    """把Gemini响应中的token用量记录到span"""
+    usage = response.get("usageMetadata") if isinstance(response, dict) else None
+    if usage:
+        span.set_attributes(
+            prompt_tokens=usage.get("promptTokenCount", 0),
+            output_tokens=usage.get("candidatesTokenCount", 0),
+            total_tokens=usage.get("totalTokenCount", 0)
+        )
+
 # --- Helper function to convert OpenAI format messages to Gemini format ---
 def convert_messages_to_gemini(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Converts internal message history to Gemini's 'contents' format.
@@ -127,6 +141,9 @@ def convert_tools_to_gemini(tools: List[Dict]) -> Optional[List[Dict]]:
                 # Handle enums if present
                 if "enum" in schema:
                     param_properties[name]["enum"] = schema["enum"]
+                # Arrays must declare their item type
+                if "items" in schema:
+                    param_properties[name]["items"] = {"type": schema["items"].get("type", "string").upper()}
 
             declaration = {
                 "name": func_data.get("name"),
@@ -306,24 +323,53 @@ class GeminiClient:
         action = "streamGenerateContent" if stream else task
         # Assumes base_url like https://generativelanguage.googleapis.com/v1beta
         # Adjust if using Vertex AI (structure might differ, e.g., :predict)
-        return f"{self.base_url}/models/{model}:{action}?key={self.api_key}"
+        url = f"{self.base_url}/models/{model}:{action}?key={self.api_key}"
+        if stream:
+            # 流式接口默认返回JSON数组，alt=sse 才会返回 _make_request 解析的 "data: " 行
+            url += "&alt=sse"
+        return url
 
     async def _make_request(self,
                             url: str,
                             payload: Dict,
                             stream: bool) -> AsyncGenerator[Dict, None]:
+        """Makes the request, going through the active cassette (record/replay) if any."""
+        cassette = current_cassette()
+        if cassette is None:
+            async for chunk in self._send_request(url, payload, stream):
+                yield chunk
+            return
+        async for chunk in cassette.llm_request(url, payload, stream, lambda: self._send_request(url, payload, stream)):
+            yield chunk
+
+    async def _send_request(self,
+                            url: str,
+                            payload: Dict,
+                            stream: bool) -> AsyncGenerator[Dict, None]:
         """Makes the HTTP request and handles streaming/non-streaming responses."""
         headers = {'Content-Type': 'application/json'}
         # Increased timeout for potentially long generations or complex workflows
         timeout = aiohttp.ClientTimeout(total=300, connect=30)
+        # 记录LLM调用span（不激活：生成器跨越yield，不能改变调用方上下文）
+        model_match = re.search(r'/models/([^:/]+):(\w+)', url)
+        llm_span = tracer.start_span(
+            "llm.request",
+            model=model_match.group(1) if model_match else "",
+            action=model_match.group(2) if model_match else "",
+            stream=stream
+        )
+        chunk_count = 0
 
         try:
             async with aiohttp.ClientSession(timeout=timeout) as session:
                 logger.debug(f"Sending Gemini Request: URL={url}, Payload={json.dumps(payload, ensure_ascii=False)[:500]}...")
                 async with session.post(url, headers=headers, json=payload) as response:
+                    llm_span.set_attribute("http_status", response.status)
                     if response.status != 200:
                         error_text = await response.text()
                         logger.error(f"Gemini API Error: {response.status} - {error_text}")
+                        llm_span.set_error(error_text)
+                        llm_span.end()
                         yield {"error": {"code": response.status, "message": f"Gemini API Error: {error_text}"}}
                         return
 
@@ -337,6 +383,11 @@ class GeminiClient:
                                 try:
                                     # Gemini stream data might be a full JSON object per line now
                                     chunk = json.loads(data_str)
+                                    chunk_count += 1
+                                    if chunk_count == 1:
+                                        llm_span.set_attribute("first_chunk_ms", round((time.time() - llm_span.start_time) * 1000, 2))
+                                    # 流式响应的usageMetadata为累计值，以最后一次为准
+                                    _record_usage(llm_span, chunk)
                                     yield chunk # Yield the raw chunk structure
                                 except json.JSONDecodeError:
                                     logger.warning(f"Could not decode Gemini stream chunk: {data_str}")
@@ -348,6 +399,8 @@ class GeminiClient:
                         try:
                             full_response = await response.json()
                             logger.debug(f"Received Gemini Response: {json.dumps(full_response, ensure_ascii=False)[:500]}...")
+                            _record_usage(llm_span, full_response)
+                            llm_span.end()
                             yield full_response
                         except json.JSONDecodeError:
                             resp_text = await response.text()
@@ -360,13 +413,23 @@ class GeminiClient:
 
         except asyncio.TimeoutError:
              logger.error(f"Request to Gemini API timed out: {url}")
+             llm_span.set_error("Request Timeout")
+             llm_span.end()
              yield {"error": {"code": 408, "message": "Request Timeout"}}
         except aiohttp.ClientError as e:
             logger.error(f"HTTP Client Error connecting to Gemini API: {e}")
+            llm_span.set_error(e)
+            llm_span.end()
             yield {"error": {"code": 503, "message": f"HTTP Client Error: {e}"}}
         except Exception as e:
             logger.exception("Unexpected error during Gemini API request")
+            llm_span.set_error(e)
+            llm_span.end()
             yield {"error": {"code": 500, "message": f"Unexpected Error: {e}"}}
+        finally:
+            if stream:
+                llm_span.set_attribute("chunks", chunk_count)
+            llm_span.end()
 
     async def chat_completion(self,
                               model: str,
@@ -425,10 +488,12 @@ class GeminiClient:
 
         payload = {
             "contents": contents,
-            "tools": gemini_tools,
             # Optional: Tool Config to force function call 'mode': 'FUNCTION' or 'ANY'
             # "toolConfig": {"functionCallingConfig": {"mode": "ANY"}}
         }
+        # 工具筛选后可能没有任何工具需要声明
+        if gemini_tools:
+            payload["tools"] = gemini_tools
 
         # Add generation config (optional but can influence function choice/args)
         generation_config = {}
@@ -572,8 +637,11 @@ class TTSClient:
         return text
 
     # --- Helper function to run sync generator in thread ---
-    def _collect_audio_sync(self, session: FishSession, request: TTSRequest) -> bytes:
-         """Synchronously iterates over the TTS generator and collects audio chunks."""
+    def _collect_audio_sync(self, session: FishSession, request: TTSRequest, stop_event: Optional[threading.Event] = None) -> bytes:
+         """Synchronously iterates over the TTS generator and collects audio chunks.
+
+         stop_event 被设置时（请求已取消）停止读取，关闭生成器以释放HTTP连接。
+         """
          audio_buffer = io.BytesIO()
          chunk_count = 0
          total_bytes = 0
@@ -581,6 +649,9 @@ class TTSClient:
          try:
              # 使用带有超时的方式收集音频数据
              for chunk in session.tts(request):
+                  if stop_event is not None and stop_event.is_set():
+                       logger.info("Fish Audio TTS: 请求已取消，停止接收音频")
+                       break
                   if chunk:
                        audio_buffer.write(chunk)
                        chunk_count += 1
@@ -639,15 +710,20 @@ class TTSClient:
             # 记录开始请求TTS的时间
             start_time = time.time()
             
-            # 在线程中同步收集音频数据
+            # 在线程中同步收集音频数据；线程无法被中断，超时或取消时通知其尽快停止
+            stop_event = threading.Event()
             try:
                 audio_bytes = await asyncio.wait_for(
-                    asyncio.to_thread(self._collect_audio_sync, session, request),
+                    asyncio.to_thread(self._collect_audio_sync, session, request, stop_event),
                     timeout=30.0  # 30秒超时保护
                 )
             except asyncio.TimeoutError:
+                stop_event.set()
                 logger.error("Fish Audio TTS 请求超时(30秒)")
                 return None
+            except asyncio.CancelledError:
+                stop_event.set()
+                raise
                 
             # 记录请求完成的时间和音频大小
             end_time = time.time()
@@ -838,17 +914,16 @@ class MinimaxTTSClient:
                 logger.warning("流式请求尚未实现，切换为非流式模式")
                 payload["stream"] = False
             
-            # 发送非流式请求
-            response = await asyncio.to_thread(
-                lambda: requests.post(url, headers=headers, json=payload)
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"MiniMax T2A v2 API错误: {response.status_code} - {response.text}")
-                return None
-                
-            # 解析响应
-            result = response.json()
+            # 发送非流式请求（aiohttp请求可被取消，取消时立即关闭连接）
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, headers=headers, json=payload,
+                                        timeout=aiohttp.ClientTimeout(total=120)) as response:
+                    if response.status != 200:
+                        logger.error(f"MiniMax T2A v2 API错误: {response.status} - {await response.text()}")
+                        return None
+                        
+                    # 解析响应
+                    result = await response.json(content_type=None)
             
             # 检查响应中是否有错误
             if "base_resp" in result and result["base_resp"]["status_code"] != 0:
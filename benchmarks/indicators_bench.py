@@ -0,0 +1,171 @@
+"""
+技术指标引擎的正确性与性能基准
+
+在机器人根目录下运行:
+    python -m plugins.OpenManus.benchmarks.indicators_bench --symbols 200 --days 250 --repeat 3
+
+用随机游走行情，把 tools.indicators 的向量化结果与原先逐个列表计算的实现（下方 reference_*，
+保留自 StockTool 的 _calculate_sma/_calculate_rsi/_calculate_ema/_calculate_macd）逐点比较，
+并报告两者计算全部股票所用的时间。任何指标不一致时以非零状态退出。
+"""
+
+import sys
+import json
+import time
+import argparse
+from typing import Dict, List, Callable
+
+import numpy as np
+
+from ..tools import indicators
+
+def reference_sma(data: List[float], window: int) -> List[float]:
+    if len(data) < window:
+        return []
+    sma = []
+    for i in range(len(data)):
+        if i < window - 1:
+            sma.append(0)
+        else:
+            sma.append(sum(data[i-(window-1):i+1]) / window)
+    return sma
+
+def reference_rsi(data: List[float], period: int = 14) -> List[float]:
+    if len(data) <= period:
+        return []
+    deltas = [data[i] - data[i-1] for i in range(1, len(data))]
+    gains = [delta if delta > 0 else 0 for delta in deltas]
+    losses = [-delta if delta < 0 else 0 for delta in deltas]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    rsi = []
+    for i in range(len(data)):
+        if i < period:
+            rsi.append(0)
+        elif i == period:
+            rsi.append(100 if avg_loss == 0 else 100 - (100 / (1 + avg_gain / avg_loss)))
+        else:
+            avg_gain = (avg_gain * (period - 1) + gains[i-1]) / period
+            avg_loss = (avg_loss * (period - 1) + losses[i-1]) / period
+            rsi.append(100 if avg_loss == 0 else 100 - (100 / (1 + avg_gain / avg_loss)))
+    return rsi
+
+def reference_ema(data: List[float], period: int) -> List[float]:
+    if len(data) < period:
+        return []
+    multiplier = 2 / (period + 1)
+    ema = [0] * len(data)
+    ema[period-1] = sum(data[:period]) / period
+    for i in range(period, len(data)):
+        ema[i] = (data[i] - ema[i-1]) * multiplier + ema[i-1]
+    return ema
+
+def reference_macd(data: List[float], fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> tuple:
+    if len(data) <= slow_period:
+        return [], [], []
+    ema_fast = reference_ema(data, fast_period)
+    ema_slow = reference_ema(data, slow_period)
+    macd_line = [ema_fast[i] - ema_slow[i] for i in range(len(ema_fast))]
+    signal_line = reference_ema(macd_line, signal_period)
+    histogram = [macd_line[i] - signal_line[i] for i in range(len(signal_line))]
+    return macd_line, signal_line, histogram
+
+def random_walk(symbols: int, days: int, seed: int) -> np.ndarray:
+    """生成 (股票数, 天数) 的随机游走收盘价"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0005, 0.02, size=(symbols, days))
+    start = rng.uniform(5, 500, size=(symbols, 1))
+    return start * np.exp(np.cumsum(returns, axis=1))
+
+def _reference_all(rows: List[List[float]]) -> Dict[str, List[List[float]]]:
+    output = {"sma5": [], "sma20": [], "ema12": [], "rsi14": [], "macd": [], "signal": [], "hist": []}
+    for row in rows:
+        output["sma5"].append(reference_sma(row, 5))
+        output["sma20"].append(reference_sma(row, 20))
+        output["ema12"].append(reference_ema(row, 12))
+        output["rsi14"].append(reference_rsi(row, 14))
+        macd_line, signal_line, histogram = reference_macd(row)
+        output["macd"].append(macd_line)
+        output["signal"].append(signal_line)
+        output["hist"].append(histogram)
+    return output
+
+def _vectorized_all(closes: np.ndarray) -> Dict[str, np.ndarray]:
+    macd_line, signal_line, histogram = indicators.macd(closes)
+    return {"sma5": indicators.sma(closes, 5), "sma20": indicators.sma(closes, 20),
+            "ema12": indicators.ema(closes, 12), "rsi14": indicators.rsi(closes, 14),
+            "macd": macd_line, "signal": signal_line, "hist": histogram}
+
+def _best_time(func: Callable, repeat: int):
+    best, result = None, None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def compare(reference: Dict[str, List[List[float]]], vectorized: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """逐指标比较，返回相对于该股票指标最大绝对值的最大误差；原实现返回空列表时向量化结果应全为0"""
+    errors = {}
+    for name, rows in reference.items():
+        worst = 0.0
+        for position, expected in enumerate(rows):
+            actual = vectorized[name][position]
+            if not expected:
+                worst = max(worst, float(np.abs(actual).max(initial=0.0)))
+                continue
+            expected = np.asarray(expected, dtype=np.float64)
+            scale = max(float(np.abs(expected).max()), 1e-12)
+            worst = max(worst, float(np.abs(actual - expected).max()) / scale)
+        errors[name] = worst
+    return errors
+
+def run_benchmark(symbols: int, days: int, repeat: int, seed: int) -> Dict:
+    closes = random_walk(symbols, days, seed)
+    rows = closes.tolist()
+    reference_ms, reference = _best_time(lambda: _reference_all(rows), repeat)
+    vectorized_ms, vectorized = _best_time(lambda: _vectorized_all(closes), repeat)
+    per_symbol_ms, _ = _best_time(lambda: [_vectorized_all(row) for row in closes], repeat)
+    return {
+        "symbols": symbols,
+        "days": days,
+        "reference_ms": round(reference_ms, 2),
+        "vectorized_ms": round(vectorized_ms, 2),
+        "vectorized_per_symbol_ms": round(per_symbol_ms, 2),
+        "speedup": round(reference_ms / max(vectorized_ms, 1e-6), 1),
+        "max_relative_error": compare(reference, vectorized),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="技术指标向量化实现的正确性与性能基准")
+    parser.add_argument("--symbols", type=int, default=200, help="股票数")
+    parser.add_argument("--days", type=int, nargs="+", default=[10, 30, 250], help="每只股票的天数，可指定多个")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数，取耗时最小值")
+    parser.add_argument("--seed", type=int, default=0, help="随机行情种子")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="允许的最大相对误差")
+    parser.add_argument("--json", dest="json_path", help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    rows = [run_benchmark(args.symbols, days, args.repeat, args.seed) for days in args.days]
+    header = f"{'symbols':>7} {'days':>5} {'原实现ms':>10} {'二维ms':>9} {'逐只ms':>9} {'加速':>7} {'最大相对误差':>12}"
+    print(header)
+    print("-" * len(header))
+    failed = False
+    for row in rows:
+        error = max(row["max_relative_error"].values())
+        failed = failed or error > args.tolerance
+        print(f"{row['symbols']:>7} {row['days']:>5} {row['reference_ms']:>10.1f} {row['vectorized_ms']:>9.2f} "
+              f"{row['vectorized_per_symbol_ms']:>9.1f} {row['speedup']:>6.1f}x {error:>12.2e}")
+    if failed:
+        for row in rows:
+            print(f"days={row['days']}: {row['max_relative_error']}")
+        print(f"结果不一致（相对误差超过 {args.tolerance}）")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+回放录制的cassette，对 MCPAgent.run 做可重复的基准测试
+
+在机器人根目录下运行:
+    python -m plugins.OpenManus.benchmarks.replay_bench cassettes/ --latency zero --repeat 3
+
+每个cassette报告步骤数、LLM/工具调用数、token数和本地CPU耗时。
+回放不访问网络：Gemini响应和工具结果都来自cassette。
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List
+
+from loguru import logger
+
+from ..agent.mcp import MCPAgent, Tool
+from ..agent.cassette import Cassette, CassetteMiss, use_cassette
+from ..api_client import GeminiClient
+
+class ReplayTool(Tool):
+    """按录制的定义注册的占位工具，实际结果由cassette提供"""
+
+    def __init__(self, definition: Dict):
+        super().__init__(definition["name"], definition.get("description", ""), definition.get("parameters") or {})
+
+    async def execute(self, **kwargs) -> Dict:
+        raise CassetteMiss(f"回放时工具 {self.name} 不应被实际执行")
+
+def collect_cassettes(paths: List[str]) -> List[str]:
+    """展开目录，返回所有cassette文件路径"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.json.gz"))))
+        else:
+            files.append(path)
+    return files
+
+async def replay_cassette(path: str, latency: str = "zero", strict: bool = False) -> Dict:
+    """回放单个cassette并测量
+
+    Args:
+        path: cassette文件路径
+        latency: "zero" 忽略录制延迟，"original" 按录制延迟等待
+        strict: 请求内容与录制不一致时是否报错
+
+    Returns:
+        Dict: 测量结果
+    """
+    cassette = Cassette.load(path, latency=latency, strict=strict)
+    metadata = cassette.metadata
+    client = GeminiClient(api_key="replay", base_url="https://generativelanguage.googleapis.com/v1beta")
+    agent = MCPAgent(client, **metadata["agent"])
+    agent.register_tools([ReplayTool(definition) for definition in metadata.get("tools", [])])
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with use_cassette(cassette):
+        result = await agent.run(metadata["instruction"], history=metadata.get("history"),
+                                 stream=metadata.get("stream", False))
+        answer = result.get("answer", "")
+        if result.get("answer_stream") is not None:
+            answer = "".join([chunk async for chunk in result["answer_stream"]])
+    cpu_ms = (time.process_time() - cpu_start) * 1000
+    wall_ms = (time.perf_counter() - wall_start) * 1000
+
+    return {
+        "cassette": os.path.basename(path),
+        "steps": len(result.get("steps", [])),
+        "llm_calls": cassette.stats["llm_calls"],
+        "tool_calls": cassette.stats["tool_calls"],
+        "prompt_tokens": cassette.stats["prompt_tokens"],
+        "output_tokens": cassette.stats["output_tokens"],
+        "total_tokens": cassette.stats["total_tokens"],
+        "misses": cassette.stats["misses"],
+        "unused": cassette.unused_interactions(),
+        "cpu_ms": round(cpu_ms, 2),
+        "wall_ms": round(wall_ms, 2),
+        "answer_changed": (answer or "").strip() != (metadata.get("answer") or "").strip(),
+    }
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+def format_report(rows: List[Dict]) -> str:
+    """格式化为表格和汇总"""
+    header = f"{'cassette':<36} {'steps':>5} {'llm':>4} {'tool':>4} {'tokens':>8} {'miss':>4} {'cpu_ms':>9} {'wall_ms':>9}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        changed = " *" if row["answer_changed"] else ""
+        lines.append(f"{row['cassette'][:36]:<36} {row['steps']:>5} {row['llm_calls']:>4} {row['tool_calls']:>4} "
+                     f"{row['total_tokens']:>8} {row['misses']:>4} {row['cpu_ms']:>9.1f} {row['wall_ms']:>9.1f}{changed}")
+    cpu = [row["cpu_ms"] for row in rows]
+    tokens = [row["total_tokens"] for row in rows]
+    lines.append("-" * len(header))
+    lines.append(f"请求数 {len(rows)}  CPU(ms) 平均 {statistics.mean(cpu):.1f} p50 {_percentile(cpu, 0.5):.1f} "
+                 f"p95 {_percentile(cpu, 0.95):.1f}  tokens 平均 {statistics.mean(tokens):.0f} 合计 {sum(tokens)}")
+    if any(row["answer_changed"] for row in rows):
+        lines.append("* 回答与录制时不同（请求内容变化后按录制顺序回放）")
+    return "\n".join(lines)
+
+async def run_benchmark(paths: List[str], latency: str, repeat: int, strict: bool) -> List[Dict]:
+    """依次回放所有cassette，重复多次时取CPU耗时最小的一次"""
+    rows = []
+    for path in collect_cassettes(paths):
+        best = None
+        for _ in range(max(repeat, 1)):
+            try:
+                row = await replay_cassette(path, latency=latency, strict=strict)
+            except CassetteMiss as e:
+                logger.error(f"回放 {path} 失败: {e}")
+                break
+            if best is None or row["cpu_ms"] < best["cpu_ms"]:
+                best = row
+        if best:
+            rows.append(best)
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回放cassette并测量 MCPAgent.run")
+    parser.add_argument("paths", nargs="+", help="cassette文件或目录")
+    parser.add_argument("--latency", choices=["zero", "original"], default="zero", help="是否按录制延迟等待")
+    parser.add_argument("--repeat", type=int, default=1, help="每个cassette重复次数，取CPU耗时最小值")
+    parser.add_argument("--strict", action="store_true", help="请求内容与录制不一致时报错")
+    parser.add_argument("--json", dest="json_path", help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    rows = asyncio.run(run_benchmark(args.paths, args.latency, args.repeat, args.strict))
+    if not rows:
+        print("没有可回放的cassette")
+        return
+    print(format_report(rows))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import re
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+from .agent.bulkhead import bulkheads
+from .agent.tracing import tracer
+from .tools.calculator_tool import estimate_digits, MAX_RESULT_DIGITS
+
+WEEKDAYS = ["一", "二", "三", "四", "五", "六", "日"]
+
+# 计算: "计算 (245+37)*1.5"、"算一下 3^2"、"(245+37)*1.5 等于多少"、"1+1=?"
+_CALC_PREFIX_PATTERN = re.compile(r'^(?:请|帮我)?(?:计算一下|计算|算一下|算算|算)\s*[:：]?\s*(.+)$')
+_CALC_SUFFIX_PATTERN = re.compile(r'^(.+?)\s*(?:=|＝)?\s*(?:等于多少|等于几|是多少|得多少|=\s*[?？]|＝\s*[?？])[?？]?$')
+_EXPRESSION_PATTERN = re.compile(r'^(?:[0-9.+\-*/()\s]|sqrt|sin|cos|tan|log10|log|exp|abs|pi)+$')
+_OPERATOR_PATTERN = re.compile(r'[+\-*/]|sqrt|sin|cos|tan|log|exp|abs')
+# 纯算式必须在两个操作数之间有运算符；只由数字和"-"、"/"组成的可能是日期（"3/4"）或电话号码
+_BINARY_OPERATION_PATTERN = re.compile(r'[\d)]\s*(?:\*\*|[+\-*/])\s*[\d(]|sqrt|sin|cos|tan|log|exp|abs')
+_DATE_LIKE_PATTERN = re.compile(r'^[\d\s\-/]+$')
+
+# 日期时间: "现在几点"、"今天星期几"、"明天几号"
+_TIME_PATTERN = re.compile(r'^(?:现在|当前|目前)?(?:是)?(?:几点|几点钟|几点了|什么时间|时间)(?:了)?[?？吗呢啊]*$')
+_DATE_PATTERN = re.compile(r'^(今天|今日|明天|后天|昨天)(?:是)?(?:几号|几月几号|几月几日|日期|星期几|周几|礼拜几|什么日子)[?？吗呢啊]*$')
+_DAY_OFFSETS = {"今天": 0, "今日": 0, "明天": 1, "后天": 2, "昨天": -1}
+
+def _normalize_expression(text: str) -> str:
+    """把常见的中文/全角写法转换为计算器可识别的表达式"""
+    replacements = {"×": "*", "÷": "/", "（": "(", "）": ")", "＋": "+", "－": "-", "＊": "*", "／": "/", "^": "**"}
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    return text.strip()
+
+def _format_number(value) -> str:
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
+
+class FastPathRouter:
+    """确定性的本地快速路径，无需调用LLM即可回答含义明确的简单请求
+
+    只匹配无歧义的计算和日期时间请求；匹配失败或工具报错时返回None，
+    由调用方回退到代理处理。
+    """
+
+    def __init__(self, calculator=None, datetime_tool=None):
+        """初始化路由器
+
+        Args:
+            calculator: CalculatorTool 实例，为None时不处理计算请求
+            datetime_tool: DateTimeTool 实例，为None时不处理日期时间请求
+        """
+        self.calculator = calculator
+        self.datetime_tool = datetime_tool
+        self.stats = {"hits": 0, "fallbacks": 0}
+
+    def match(self, query: str) -> Optional[Tuple[str, Dict]]:
+        """判断请求是否可以走快速路径
+
+        Args:
+            query: 用户请求（已去掉触发词）
+
+        Returns:
+            Optional[Tuple[str, Dict]]: (类型, 参数)，类型为 "calculator"/"time"/"date"；不匹配时返回None
+        """
+        text = query.strip()
+        if not text or len(text) > 120:
+            return None
+
+        if self.datetime_tool:
+            if _TIME_PATTERN.match(text):
+                return "time", {}
+            match = _DATE_PATTERN.match(text)
+            if match:
+                return "date", {"days": _DAY_OFFSETS[match.group(1)]}
+
+        if self.calculator:
+            expression = None
+            for pattern in (_CALC_PREFIX_PATTERN, _CALC_SUFFIX_PATTERN):
+                match = pattern.match(text)
+                if match:
+                    expression = _normalize_expression(match.group(1))
+                    break
+            else:
+                # 纯算式，如 "(245+37)*1.5"
+                expression = _normalize_expression(text)
+                if not _BINARY_OPERATION_PATTERN.search(expression) or _DATE_LIKE_PATTERN.match(expression):
+                    return None
+            if (expression and _EXPRESSION_PATTERN.match(expression)
+                    and re.search(r'\d', expression) and _OPERATOR_PATTERN.search(expression)
+                    and estimate_digits(expression) <= MAX_RESULT_DIGITS):
+                return "calculator", {"expression": expression}
+        return None
+
+    async def answer(self, query: str) -> Optional[str]:
+        """尝试在本地直接回答
+
+        Args:
+            query: 用户请求（已去掉触发词）
+
+        Returns:
+            Optional[str]: 回答文本；无法处理或出错时返回None
+        """
+        try:
+            return await self._answer(query)
+        except Exception as e:
+            self.stats["fallbacks"] += 1
+            logger.warning(f"快速路径出错，回退到代理: {e}")
+            return None
+
+    async def _answer(self, query: str) -> Optional[str]:
+        matched = self.match(query)
+        if matched is None:
+            return None
+        kind, args = matched
+        with tracer.span("fast_path", kind=kind) as span:
+            if kind == "calculator":
+                result = await bulkheads.call(self.calculator, expression=args["expression"])
+                answer = None if result.get("error") else f"{args['expression']} = {_format_number(result.get('result'))}"
+            else:
+                operation = f"{args['days']:+d}d" if args.get("days") else ""
+                result = await bulkheads.call(self.datetime_tool, operation=operation)
+                answer = None if result.get("error") else self._format_datetime(kind, query, result)
+
+            if answer is None:
+                self.stats["fallbacks"] += 1
+                span.set_attribute("fallback", True)
+                logger.info(f"快速路径处理失败，回退到代理: {result.get('error')}")
+                return None
+        self.stats["hits"] += 1
+        logger.info(f"快速路径直接回答 ({kind}): {answer}")
+        return answer
+
+    def _format_datetime(self, kind: str, query: str, result: Dict) -> str:
+        moment = datetime.fromisoformat(result["iso_format"])
+        weekday = f"星期{WEEKDAYS[moment.weekday()]}"
+        if kind == "time":
+            return f"现在是 {moment.strftime('%Y-%m-%d %H:%M:%S')}（{weekday}）"
+        day_word = _DATE_PATTERN.match(query.strip()).group(1)
+        return f"{day_word}是 {moment.year}年{moment.month}月{moment.day}日，{weekday}"
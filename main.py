@@ -8,7 +8,7 @@ import base64 # <-- Import base64
 import math # <-- Import math for ceiling division
 from pydub import AudioSegment # <-- Import pydub
 import io # Already imported by fish_audio_sdk, but good practice
-from typing import Dict, List, Any, Optional, Tuple, AsyncGenerator
+from typing import Dict, List, Any, Optional, Tuple, AsyncGenerator, AsyncIterator
 from loguru import logger
 from datetime import datetime
 import time
@@ -21,8 +21,24 @@ from utils.plugin_base import PluginBase
 
 from .api_client import GeminiClient, TTSClient, MinimaxTTSClient
 from .agent.mcp import MCPAgent, Tool
+from .agent.prefetch import detect_tool_intents
+from .agent.tracing import tracer
+from .agent.cassette import Cassette, activate_cassette, deactivate_cassette
+from .agent.bulkhead import bulkheads
+from .agent.hooks import ProgressNotifier, MetricsHook, ToolImageCollector
 from .tools import CalculatorTool, DateTimeTool, SearchTool, WeatherTool, CodeTool, ModelScopeDrawingTool, FirecrawlTool
 from .tools.stock_tool import StockTool
+from .tools.stock_snapshot import stock_snapshots
+from .tools.ohlcv_store import ohlcv_store
+from .tools.stock_screener import sector_index
+from .tools.code_sandbox import sandbox_pool
+from .tools.code_cache import code_cache
+from .tools.image_store import image_store, send_image
+from .tools.code_kernels import code_kernels, KERNEL_SCOPE_OFF, KERNEL_SCOPE_RUN, KERNEL_SCOPE_SESSION
+from .fast_path import FastPathRouter
+from .session_queue import SessionQueueManager
+from .answer_cache import AnswerCache
+from .scheduler import FairScheduler, DEFAULT_PRIORITY_CLASSES, DEFAULT_SLO_MS
 # from .tools.virtual_tryon_tool import VirtualTryOnTool  # 此模块暂时缺失
 # from .memory import MessageMemory  # 此模块暂时缺失
 
@@ -119,6 +135,44 @@ def split_text_at_natural_breaks(text, max_duration_seconds=55):
     
     return segments
 
+async def iter_stream_paragraphs(text_stream: AsyncIterator[str], min_chars: int = 80, max_chars: int = 800) -> AsyncGenerator[str, None]:
+    """
+    将流式文本增量聚合为完整段落，段落一旦完整立即产出
+    
+    参数:
+        text_stream: 文本增量的异步迭代器
+        min_chars: 段落最小长度，过短的段落会与后续段落合并后再产出
+        max_chars: 缓冲区最大长度，超过时在最后一个句子结束处强制切分
+    
+    返回:
+        段落文本的异步生成器
+    """
+    sentence_endings = ['。', '！', '？', '；', '.', '!', '?', ';']
+    buffer = ""
+    
+    async for delta in text_stream:
+        buffer += delta
+        
+        while True:
+            # 优先在自然段落处切分
+            break_index = buffer.find("\n\n", min_chars)
+            if break_index != -1:
+                paragraph, buffer = buffer[:break_index], buffer[break_index + 2:]
+            elif len(buffer) > max_chars:
+                # 段落过长，在最后一个句子结束处切分
+                cut = max(buffer.rfind(mark, 0, max_chars) for mark in sentence_endings)
+                cut = cut + 1 if cut > 0 else max_chars
+                paragraph, buffer = buffer[:cut], buffer[cut:]
+            else:
+                break
+            
+            if paragraph.strip():
+                yield paragraph.strip()
+    
+    # 产出剩余内容
+    if buffer.strip():
+        yield buffer.strip()
+
 class OpenManus(PluginBase):
     """OpenManus插件主类 (使用Gemini + TTS)"""
     description = "基于Gemini的智能代理插件，支持文本转语音输出"
@@ -150,6 +204,18 @@ class OpenManus(PluginBase):
         self.max_tokens = agent_config.get("max_tokens", 8192)
         self.temperature = agent_config.get("temperature", 0.7)
         self.max_steps = agent_config.get("max_steps", 10)
+        self.stream_answer = agent_config.get("stream_answer", True)  # 是否流式生成并分段发送最终回答
+        self.stream_min_paragraph_chars = agent_config.get("stream_min_paragraph_chars", 80)
+        self.stream_send_interval = agent_config.get("stream_send_interval", 1.0)  # 分段消息最小发送间隔(秒)
+        self.enable_prefetch = agent_config.get("enable_prefetch", True)  # 是否根据意图预取工具结果
+        self.tool_result_token_budget = agent_config.get("tool_result_token_budget", 800)  # 工具结果回传模型的token预算
+        # 分级模型：空字符串表示使用默认模型
+        self.step_model = agent_config.get("step_model", "") or None
+        self.plan_model = agent_config.get("plan_model", "") or None
+        self.final_model = agent_config.get("final_model", "") or None
+        self.escalate_on_invalid = agent_config.get("escalate_on_invalid", True)
+        self.tool_top_k = agent_config.get("tool_top_k", 0)  # 每个请求只声明最相关的k个工具 (0 表示全部)
+        self.always_include_tools = agent_config.get("always_include_tools", [])
         
         # MCP配置
         mcp_config = self.config.get("mcp", {})
@@ -157,6 +223,8 @@ class OpenManus(PluginBase):
         self.thinking_steps = mcp_config.get("thinking_steps", 3)
         self.force_thinking = mcp_config.get("force_thinking", True)
         self.thinking_prompt = mcp_config.get("thinking_prompt", "请深入思考这个问题，分析多个角度并考虑是否需要查询额外信息")
+        self.plan_and_execute = mcp_config.get("plan_and_execute", False)  # 是否启用计划-执行(DAG)模式
+        self.plan_max_nodes = mcp_config.get("plan_max_nodes", 12)
         
         # 工具配置
         tools_config = self.config.get("tools", {})
@@ -221,14 +289,123 @@ class OpenManus(PluginBase):
         # 启用绘图工具
         self.enable_drawing = self.config.get("enable_drawing", True)
         
+        # 工具隔离舱配置: [bulkhead.<工具名>] 覆盖工具默认的并发上限、超时和执行后端
+        bulkheads.configure(self.config.get("bulkhead", {}))
+        
+        # 代码执行进程池：代码工具在预启动的工作进程中执行，带CPU/内存限制
+        code_config = self.config.get("code", {})
+        sandbox_pool.configure(
+            size=code_config.get("pool_size", 2),
+            cpu_seconds=code_config.get("cpu_seconds", code_config.get("timeout", 10)),
+            memory_mb=code_config.get("memory_mb", 512),
+            max_jobs_per_worker=code_config.get("max_jobs_per_worker", 100),
+            start_method=code_config.get("start_method") or None
+        )
+        code_cache.configure(
+            max_entries=code_config.get("result_cache_size", 256),
+            enable_results=code_config.get("result_cache", True)
+        )
+        # 会话内核：代码工具的变量在一次运行（run）或整个会话（session）内保留
+        self.code_kernel_scope = code_config.get("kernel_scope", KERNEL_SCOPE_OFF)
+        code_kernels.configure(
+            max_kernels=code_config.get("max_kernels", 4),
+            idle_timeout=code_config.get("kernel_idle_timeout", 600),
+            memory_mb=code_config.get("kernel_memory_mb", 1024),
+            cpu_seconds=code_config.get("cpu_seconds", code_config.get("timeout", 10)),
+            start_method=code_config.get("start_method") or None
+        )
+        
+        # 全市场行情快照：交易时段内短有效期，收盘后长有效期，并发的股票查询共享一次下载
+        stock_config = self.config.get("stock", {})
+        stock_snapshots.configure(
+            open_ttl=stock_config.get("snapshot_ttl_open", 30),
+            closed_ttl=stock_config.get("snapshot_ttl_closed", 1800)
+        )
+        # 日线行情本地列式存储：保存 stock_data_cache_days 个交易日（超过两倍时删除更早的数据），只增量下载新的交易日
+        ohlcv_store.configure(
+            root=stock_config.get("data_dir", "stock_data"),
+            history_days=self.stock_data_cache_days,
+            adjust=stock_config.get("adjust", "qfq")
+        )
+        # 选股时板块成分股的缓存有效期
+        sector_index.configure(ttl=stock_config.get("sector_ttl", 21600))
+        # 多股票比较时并行下载行情的线程数
+        self.stock_fetch_workers = stock_config.get("compare_workers", 4)
+        
+        # 本地快速路径：简单的计算/日期时间请求直接由工具回答，不调用LLM
+        fast_path_config = self.config.get("fast_path", {})
+        self.enable_fast_path = fast_path_config.get("enable", True)
+        self.fast_path = FastPathRouter(
+            calculator=CalculatorTool() if self.enable_calculator else None,
+            datetime_tool=DateTimeTool() if self.enable_datetime else None
+        ) if self.enable_fast_path else None
+        
+        # 进度提示：工具执行或思考较慢时提示用户，避免用户重复发送问题
+        progress_config = self.config.get("progress", {})
+        self.progress_enabled = progress_config.get("enable", True)
+        self.progress_delay = progress_config.get("delay", 8)
+        self.progress_min_interval = progress_config.get("min_interval", 20)
+        self.progress_max_notices = progress_config.get("max_notices", 2)
+        self.progress_messages = progress_config.get("messages", {})
+        # 所有代理运行共享的指标钩子
+        self.agent_metrics = MetricsHook()
+        
+        # 语义答案缓存：近似重复的问题直接返回缓存的回答
+        answer_cache_config = self.config.get("answer_cache", {})
+        self.answer_cache = AnswerCache(
+            scope=answer_cache_config.get("scope", "group"),
+            threshold=answer_cache_config.get("threshold", 0.88),
+            near_miss_threshold=answer_cache_config.get("near_miss_threshold", 0.75),
+            max_entries=answer_cache_config.get("max_entries", 1000),
+            ttl_by_type=answer_cache_config.get("ttl", {}),
+            share_private=answer_cache_config.get("share_private", False)
+        ) if answer_cache_config.get("enable", False) else None
+        
+        # 录制配置 (用于离线回放和基准测试)
+        cassette_config = self.config.get("cassette", {})
+        self.record_cassettes = cassette_config.get("record", False)
+        self.cassette_dir = cassette_config.get("dir", "cassettes")
+        
+        # 追踪配置
+        tracing_config = self.config.get("tracing", {})
+        tracer.configure(
+            enable=tracing_config.get("enable", True),
+            buffer_size=tracing_config.get("buffer_size", 200),
+            jsonl_path=tracing_config.get("jsonl_path", ""),
+            otlp_endpoint=tracing_config.get("otlp_endpoint", ""),
+            slow_threshold_ms=tracing_config.get("slow_threshold_ms", 20000)
+        )
+        
         # 初始化 API 客户端 (Gemini and TTS)
         self.gemini_client = None
         self.tts_client = None
         self.minimax_tts_client = None
         self._init_clients() # Renamed
         
-        # 用于记录响应状态的字典
-        self.responding_to = {}
+        # 全局调度器：限制同时运行的代理数，按优先级和会话加权公平放行
+        scheduler_config = self.config.get("scheduler", {})
+        self.admins = set(scheduler_config.get("admins", []))
+        self.scheduler = FairScheduler(
+            max_concurrency=scheduler_config.get("max_concurrency", 4),
+            priority_classes={**DEFAULT_PRIORITY_CLASSES, **scheduler_config.get("priorities", {})},
+            slo_ms={**DEFAULT_SLO_MS, **scheduler_config.get("slo_ms", {})},
+            weights=scheduler_config.get("weights", {})
+        )
+        
+        # 按会话排队处理请求，处理中收到的消息排队并合并，而不是直接拒绝
+        queue_config = self.config.get("session_queue", {})
+        self.session_queue = SessionQueueManager(
+            handler=self._handle_request,
+            max_queue=queue_config.get("max_queue", 5),
+            max_coalesce=queue_config.get("max_coalesce", 5),
+            idle_timeout=queue_config.get("idle_timeout", 300),
+            supersede=queue_config.get("supersede", "none"),
+            supersede_window=queue_config.get("supersede_window", 0)
+        )
+        self.cancel_commands = queue_config.get("cancel_commands", ["取消", "算了", "停止"])
+        
+        # 工具预取统计 (所有请求累计)
+        self.prefetch_stats = {"issued": 0, "hits": 0, "cancelled": 0, "unused": 0}
         
         logger.info(f"OpenManus插件(Gemini+TTS)初始化完成，版本: {self.version}")
         
@@ -404,8 +581,11 @@ class OpenManus(PluginBase):
         else:
             logger.info("MiniMax TTS功能未启用。")
 
-    def _create_and_register_agent(self) -> Optional[MCPAgent]:
-        """Creates a new MCPAgent instance and registers tools."""
+    def _create_and_register_agent(self, kernel_key: Optional[str] = None) -> Optional[MCPAgent]:
+        """Creates a new MCPAgent instance and registers tools.
+        
+        kernel_key 为代码工具使用的会话内核键，为None时代码每次在新的命名空间中执行。
+        """
         if not self.gemini_client:
              logger.error("Gemini客户端未初始化，无法创建代理")
              return None
@@ -435,7 +615,16 @@ class OpenManus(PluginBase):
                 thinking_steps=thinking_steps,  # 使用根据配置调整后的值
                 force_thinking=force_thinking,  # 使用根据配置调整后的值
                 thinking_prompt=self.thinking_prompt,
-                system_prompt=system_prompt  # 传递自定义系统提示词
+                system_prompt=system_prompt,  # 传递自定义系统提示词
+                tool_result_token_budget=self.tool_result_token_budget,
+                plan_and_execute=self.plan_and_execute,
+                plan_max_nodes=self.plan_max_nodes,
+                step_model=self.step_model,
+                plan_model=self.plan_model,
+                final_model=self.final_model,
+                escalate_on_invalid=self.escalate_on_invalid,
+                tool_top_k=self.tool_top_k,
+                always_include_tools=self.always_include_tools
             )
             
             # Register tools for this new agent instance
@@ -461,10 +650,12 @@ class OpenManus(PluginBase):
                 tools.append(CodeTool(
                     timeout=code_config.get("timeout", 10),
                     max_output_length=code_config.get("max_output_length", 2000),
-                    enable_exec=code_config.get("enable_exec", True)
+                    enable_exec=code_config.get("enable_exec", True),
+                    kernel_key=kernel_key
                 ))
             if self.enable_stock:
-                tools.append(StockTool(data_cache_days=self.stock_data_cache_days))
+                tools.append(StockTool(data_cache_days=self.stock_data_cache_days,
+                                       fetch_workers=self.stock_fetch_workers))
             if self.enable_drawing:
                 # 获取绘图工具配置
                 drawing_config = self.config.get("drawing", {})
@@ -494,8 +685,34 @@ class OpenManus(PluginBase):
              return None
 
     # --- Core Request Handler ---
-    async def _handle_request(self, bot: WechatAPIClient, message: dict, query: str):
-        """Handles the core logic for processing a request after validation."""
+    def _priority_class(self, user_id: Optional[str], is_group: bool) -> str:
+        """确定请求的调度优先级类别"""
+        if user_id and user_id in self.admins:
+            return "admin"
+        return "group" if is_group else "private"
+
+    async def _enqueue_request(self, bot: WechatAPIClient, message: dict, query: str):
+        """将请求放入会话队列，由会话的工作协程依次调用 _handle_request"""
+        is_group = message.get("IsGroup", False)
+        user_id = message.get("SenderWxid")
+        target_id = message.get("FromWxid") if is_group else user_id
+        if not target_id:
+            logger.error(f"无法确定消息的目标ID (target_id is None)，无法处理请求: {message}")
+            return False
+        at_list = [user_id] if is_group and user_id else []
+        
+        position = self.session_queue.submit(target_id, bot, message, query)
+        if position is None:
+            await bot.send_at_message(target_id, "待处理的消息太多了，请稍后再发送。", at_list)
+        elif position > 0:
+            await bot.send_at_message(target_id, f"收到，会在当前问题回答完后处理（前面还有 {position} 条）。", at_list)
+        return False # Block other plugins
+
+    async def _handle_request(self, bot: WechatAPIClient, message: dict, query: str, queued_ms: float = 0):
+        """Handles the core logic for processing a request after validation.
+        
+        由会话队列调用，同一会话的请求不会并发执行；queued_ms 为请求在队列中等待的时间。
+        """
         # Use the correct keys based on the message dictionary structure
         is_group = message.get("IsGroup", False) 
         user_id = message.get("SenderWxid") # ID of the user who sent the message
@@ -517,37 +734,109 @@ class OpenManus(PluginBase):
              # If user_id is strictly needed later, more checks might be required
 
         at_list = [user_id] if is_group and user_id else [] # Ensure user_id exists for at_list in groups
-        session_id = target_id # Use target_id for locking
-        
-        if session_id in self.responding_to and self.responding_to[session_id]:
-            await bot.send_at_message(target_id, "我正在思考上一个问题，请稍候...", at_list)
-            return False # Block other plugins, already handling
+        session_id = target_id # Use target_id as the session key
             
-        logger.info(f"OpenManus(Gemini+TTS)处理来自 {user_id or '未知用户'} 的请求 (目标: {target_id}): {query}")
-        self.responding_to[session_id] = True
+        logger.info(f"OpenManus(Gemini+TTS)处理来自 {user_id or '未知用户'} 的请求 (目标: {target_id}, 排队 {queued_ms:.0f}ms): {query}")
         # Keep track of all temp files created for cleanup
         temp_files_to_clean = []
+        agent = None
+        cassette = None
+        ticket = None
+        progress = None
+        tool_images = None
+        kernel_key = None
+        request_span = tracer.start_span("request", activate=True, session=session_id, user=user_id or "", is_group=is_group, query_chars=len(query), queued_ms=queued_ms)
         
         try:
-            # 1. Create Agent and get text response
-            agent = self._create_and_register_agent()
-            if not agent or not self.gemini_client:
-                logger.error("代理或Gemini客户端未初始化，无法处理请求")
-                await bot.send_at_message(target_id, "抱歉，内部服务未准备好，请稍后再试或联系管理员。", at_list)
-                return False # Handled (error)
+            # TTS需要完整文本，仅在纯文本回复时使用流式输出
+            tts_available = (self.minimax_tts_enabled and self.minimax_tts_client) or (self.tts_enabled and self.tts_client)
+            answer_stream = None
+            
+            # 0. 语义答案缓存：近似重复的问题直接使用缓存的最终回答，不进入代理循环
+            cache_hit = self.answer_cache.lookup(query, session_id, is_group) if self.answer_cache else None
+            if cache_hit:
+                request_span.set_attributes(cache_hit=True, cache_similarity=round(cache_hit.similarity, 4))
+                final_answer = cache_hit.answer
+            else:
+                # 1. Create Agent and get text response
+                if self.code_kernel_scope == KERNEL_SCOPE_SESSION:
+                    kernel_key = session_id
+                elif self.code_kernel_scope == KERNEL_SCOPE_RUN:
+                    kernel_key = f"{session_id}:{uuid.uuid4().hex[:8]}"
+                agent = self._create_and_register_agent(kernel_key=kernel_key)
+                if not agent or not self.gemini_client:
+                    logger.error("代理或Gemini客户端未初始化，无法处理请求")
+                    await bot.send_at_message(target_id, "抱歉，内部服务未准备好，请稍后再试或联系管理员。", at_list)
+                    return False # Handled (error)
+                agent.hooks.add(self.agent_metrics)
+                tool_images = ToolImageCollector()
+                agent.hooks.add(tool_images)
+                if self.progress_enabled:
+                    progress = ProgressNotifier(
+                        send=lambda text: bot.send_at_message(target_id, text, []),
+                        delay=self.progress_delay,
+                        min_interval=self.progress_min_interval,
+                        max_notices=self.progress_max_notices,
+                        messages=self.progress_messages
+                    )
+                    agent.hooks.add(progress)
+            
+                # 录制本次请求的所有LLM和工具交互（需在预取之前启用，预取任务会继承上下文）
+                if self.record_cassettes:
+                    cassette = Cassette(metadata={
+                        "instruction": query,
+                        "session": session_id,
+                        "created": datetime.now().isoformat(),
+                        "agent": agent.get_settings(),
+                        "tools": [
+                            {"name": tool.name, "description": tool.description, "parameters": tool.parameters}
+                            for tool in agent.tools.values()
+                        ],
+                    })
+                    cassette_token = activate_cassette(cassette)
+            
+                # 获取历史对话记录（如果启用记忆功能）
+                history = None
+                if self.enable_memory and self.gemini_client:
+                    history = self.gemini_client.get_chat_history(session_id)
+                    if history:
+                        logger.info(f"获取到会话 {session_id} 的历史记录，共 {len(history)} 条")
+                    else:
+                        logger.debug(f"会话 {session_id} 没有历史记录或已过期")
+            
+                # TTS需要完整文本，仅在纯文本回复时使用流式输出
+                use_stream = self.stream_answer and not tts_available
+                if cassette:
+                    cassette.metadata["history"] = history or []
+                    cassette.metadata["stream"] = use_stream
+            
+                # 等待全局调度器放行，许可覆盖代理运行和流式回答生成（不含TTS）
+                ticket = await self.scheduler.acquire(session_id, self._priority_class(user_id, is_group))
+                request_span.set_attribute("schedule_wait_ms", round(ticket.wait_ms, 2))
+            
+                # 在Gemini决策的同时预取可预测的工具调用（放行后才开始，预取同样受全局并发上限约束）
+                if self.enable_prefetch:
+                    for tool_name, tool_args in detect_tool_intents(query):
+                        agent.prefetch_tool(tool_name, **tool_args)
                 
-            # 获取历史对话记录（如果启用记忆功能）
-            history = None
-            if self.enable_memory and self.gemini_client:
-                history = self.gemini_client.get_chat_history(session_id)
-                if history:
-                    logger.info(f"获取到会话 {session_id} 的历史记录，共 {len(history)} 条")
+                # 执行代理，带上历史记录（如果有）
+                result = await agent.run(query, history=history, stream=use_stream)
+                answer_stream = result.get("answer_stream")
+                if answer_stream is not None:
+                    # 流式模式：边生成边按段落发送
+                    final_answer = await self._send_streamed_answer(bot, target_id, answer_stream, at_list)
                 else:
-                    logger.debug(f"会话 {session_id} 没有历史记录或已过期")
-            
-            # 执行代理，带上历史记录（如果有）
-            result = await agent.run(query, history=history)
-            final_answer = result.get("answer", "")  # 使用.get避免None错误
+                    final_answer = result.get("answer", "")  # 使用.get避免None错误
+                # 未被使用的预取不能在释放许可后继续运行（统计在finally中一并记录）
+                agent.cancel_prefetches()
+                ticket.release()
+                # 附带工具生成图片的回答不缓存（缓存命中时只有文本）
+                if (self.answer_cache and final_answer and not final_answer.startswith("抱歉")
+                        and not tool_images.image_ids):
+                    self.answer_cache.store(query, final_answer, session_id, is_group)
+                if cassette:
+                    cassette.metadata["answer"] = final_answer
+                    cassette.metadata["steps"] = len(result.get("steps", []))
             
             # 如果成功获取回答且启用了记忆功能，保存对话记录
             if final_answer and self.enable_memory and self.gemini_client:
@@ -564,9 +853,16 @@ class OpenManus(PluginBase):
                 
             logger.debug(f"从Gemini获取最终文本回复，长度:{len(final_answer)}")
             
-            # 2. 直接使用语义分段TTS
-            tts_available = (self.minimax_tts_enabled and self.minimax_tts_client) or (self.tts_enabled and self.tts_client)
+            # 代码工具等生成的图表在回复发送后单独发送
+            if tool_images and tool_images.image_ids:
+                asyncio.create_task(self._send_tool_images(bot, target_id, tool_images.image_ids))
+            
+            if answer_stream is not None:
+                # 回复已分段发送完毕
+                self._schedule_modelscope_image(bot, target_id, final_answer)
+                return False # 请求已处理
             
+            # 2. 直接使用语义分段TTS
             # 如果TTS服务可用
             if tts_available:
                 # --- 使用自然分段方式发送语音 ---
@@ -599,26 +895,53 @@ class OpenManus(PluginBase):
                     logger.debug("未启用任何TTS服务，发送文本回复。")
                     
                 # 检查回复中是否包含ModelScope图片链接
-                urls = []
-                if self.enable_drawing and "modelscope-studios.oss-cn-zhangjiakou.aliyuncs.com" in final_answer and (".png" in final_answer or ".jpg" in final_answer):
-                    urls = re.findall(r'https?://modelscope-studios\.oss-cn-zhangjiakou\.aliyuncs\.com/[^\s\]]+?(?:\.png|\.jpg)', final_answer)
-                    # 创建后台任务下载图片，但不等待其完成
-                    if urls:
-                        logger.info(f"检测到回复中包含ModelScope图片链接: {urls[0]}")
-                        asyncio.create_task(self._download_and_send_image(bot, target_id, urls[0]))
+                self._schedule_modelscope_image(bot, target_id, final_answer)
                 
                 # 发送文本回复
-                await bot.send_at_message(target_id, final_answer, at_list)
+                with tracer.span("wechat.send_text", chars=len(final_answer)):
+                    await bot.send_at_message(target_id, final_answer, at_list)
                 return False # 请求已处理
                 
+        except asyncio.CancelledError:
+            # 被新消息取代或用户发送了取消命令，清理后继续向上传递
+            logger.info(f"来自 {user_id or '未知'} 的请求已被取消 (目标: {target_id})")
+            request_span.status = "cancelled"
+            raise
         except Exception as e:
             logger.exception(f"处理来自 {user_id or '未知'} 的请求时发生意外异常") 
+            request_span.set_error(e)
             # Ensure target_id is valid before sending error message
             if target_id:
                  await bot.send_at_message(target_id, f"处理您的请求时出错，请稍后再试。", at_list) 
             return False 
         finally:
-            self.responding_to[session_id] = False
+            if progress:
+                progress.close()
+            if kernel_key and self.code_kernel_scope == KERNEL_SCOPE_RUN:
+                code_kernels.release(kernel_key)
+            if ticket:
+                ticket.release()
+            if agent:
+                self._record_prefetch_stats(agent.cancel_prefetches())
+                logger.debug(f"工具隔离舱指标:\n{bulkheads.format_metrics()}")
+                logger.debug(f"代理运行指标: {self.agent_metrics.metrics()}")
+                if self.enable_code:
+                    logger.debug(f"代码执行进程池指标: {sandbox_pool.metrics()}")
+                    logger.debug(f"代码缓存指标: {code_cache.metrics()}")
+                    if self.code_kernel_scope != KERNEL_SCOPE_OFF:
+                        logger.debug(f"代码内核指标: {code_kernels.metrics()}")
+                if self.enable_stock:
+                    logger.debug(f"行情快照指标: {stock_snapshots.metrics()}")
+                    logger.debug(f"日线存储指标: {ohlcv_store.metrics()}")
+                    logger.debug(f"板块成分股缓存指标: {sector_index.metrics()}")
+            logger.debug(f"会话队列指标: {self.session_queue.metrics()}")
+            logger.debug(f"调度器指标: {self.scheduler.metrics()}")
+            if self.answer_cache:
+                logger.debug(f"答案缓存指标: {self.answer_cache.metrics()}")
+            if cassette:
+                deactivate_cassette(cassette_token)
+                await self._save_cassette(cassette)
+            request_span.end()
             # Clean up ALL temporary files created
             for temp_file in temp_files_to_clean:
                  if temp_file and os.path.exists(temp_file):
@@ -631,6 +954,78 @@ class OpenManus(PluginBase):
                       except OSError as oe:
                            logger.error(f"清理临时语音文件失败: {oe}")
 
+    async def _save_cassette(self, cassette: Cassette) -> None:
+        """保存本次请求的录制文件，失败只记录日志"""
+        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.json.gz"
+        try:
+            await asyncio.to_thread(cassette.save, os.path.join(self.cassette_dir, filename))
+        except Exception as e:
+            logger.error(f"保存cassette失败: {e}")
+
+    def _record_prefetch_stats(self, run_stats: Dict[str, int]) -> None:
+        """累计单次运行的预取统计并记录命中率"""
+        if not run_stats.get("issued"):
+            return
+        for key, value in run_stats.items():
+            self.prefetch_stats[key] = self.prefetch_stats.get(key, 0) + value
+        issued = self.prefetch_stats["issued"]
+        logger.info(f"工具预取命中率: {self.prefetch_stats['hits']}/{issued} ({self.prefetch_stats['hits'] / issued:.0%})，"
+                    f"已取消 {self.prefetch_stats['cancelled']}，未使用 {self.prefetch_stats['unused']}")
+
+    async def _send_streamed_answer(self, bot: WechatAPIClient, target_id: str, answer_stream: AsyncIterator[str], at_list: List[str]) -> str:
+        """按段落发送流式生成的回答，并遵守消息发送频率限制
+        
+        Args:
+            bot: WechatAPIClient实例
+            target_id: 目标ID（群ID或用户ID）
+            answer_stream: 文本增量的异步迭代器
+            at_list: @用户列表
+            
+        Returns:
+            str: 完整的回答文本
+        """
+        paragraphs = []
+        last_sent = 0.0
+        
+        async for paragraph in iter_stream_paragraphs(answer_stream, min_chars=self.stream_min_paragraph_chars):
+            # 两条消息之间至少间隔 stream_send_interval 秒
+            wait = self.stream_send_interval - (time.monotonic() - last_sent)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # 只在第一条消息中@用户，避免刷屏
+            with tracer.span("wechat.send_text", chars=len(paragraph), paragraph=len(paragraphs) + 1):
+                await bot.send_at_message(target_id, paragraph, at_list if not paragraphs else [])
+            last_sent = time.monotonic()
+            paragraphs.append(paragraph)
+        
+        logger.info(f"流式回复已分 {len(paragraphs)} 段发送")
+        return "\n\n".join(paragraphs)
+
+    async def _send_tool_images(self, bot: WechatAPIClient, target_id: str, image_ids: List[str]) -> None:
+        """发送工具按引用返回的图片（保存在 image_store 中）"""
+        # 延迟一段时间后再发送图片（避免与文本回复过于接近）
+        await asyncio.sleep(1.5)
+        for image_id in image_ids:
+            image_data = image_store.get(image_id)
+            if image_data is None:
+                logger.warning(f"图片 {image_id} 已不在缓存中，跳过发送")
+                continue
+            try:
+                with tracer.span("wechat.send_image", bytes=len(image_data)):
+                    if not await send_image(bot, target_id, image_data):
+                        return
+            except Exception as e:
+                logger.exception(f"发送工具生成的图片失败: {e}")
+
+    def _schedule_modelscope_image(self, bot: WechatAPIClient, target_id: str, text: str) -> None:
+        """检测回复中的ModelScope图片链接，并创建后台任务下载发送"""
+        if self.enable_drawing and "modelscope-studios.oss-cn-zhangjiakou.aliyuncs.com" in text and (".png" in text or ".jpg" in text):
+            urls = re.findall(r'https?://modelscope-studios\.oss-cn-zhangjiakou\.aliyuncs\.com/[^\s\]]+?(?:\.png|\.jpg)', text)
+            # 创建后台任务下载图片，但不等待其完成
+            if urls:
+                logger.info(f"检测到回复中包含ModelScope图片链接: {urls[0]}")
+                asyncio.create_task(self._download_and_send_image(bot, target_id, urls[0]))
+
     # --- Trigger/Blocking Decorators ---
     @on_text_message(priority=90)
     async def detect_trigger_keyword(self, bot: WechatAPIClient, message: dict):
@@ -690,10 +1085,10 @@ class OpenManus(PluginBase):
         message['is_at_msg'] = True 
         return True # Let handle_at execute
 
-    # --- Main Handlers (Call _handle_request) ---
+    # --- Main Handlers (Call _enqueue_request) ---
     @on_at_message(priority=70)
     async def handle_at(self, bot: WechatAPIClient, message: dict):
-        """处理@消息 (Gemini+TTS版) - Calls _handle_request"""
+        """处理@消息 (Gemini+TTS版) - Calls _enqueue_request"""
         if not self.enabled or not self.group_at_enabled:
             return True # Already checked by detect_at_trigger, but safe fallback
             
@@ -711,13 +1106,17 @@ class OpenManus(PluginBase):
         if command_handled:
             return False  # 命令已处理，不需要继续
         
+        # 简单请求走本地快速路径
+        if await self._try_fast_path(bot, message, content):
+            return False
+        
         # Call the core handler with the message content as the query
-        logger.debug(f"handle_at 调用 _handle_request, query: {content}")
-        return await self._handle_request(bot, message, content)
+        logger.debug(f"handle_at 提交请求到会话队列, query: {content}")
+        return await self._enqueue_request(bot, message, content)
 
     @on_text_message(priority=70)
     async def handle_text(self, bot: WechatAPIClient, message: dict):
-        """处理私聊或群聊中的触发词消息 (Gemini+TTS版) - Calls _handle_request"""
+        """处理私聊或群聊中的触发词消息 (Gemini+TTS版) - Calls _enqueue_request"""
         if not self.enabled:
             return True # Pass to others if disabled
 
@@ -754,6 +1153,10 @@ class OpenManus(PluginBase):
         if command_handled:
             return False  # 命令已处理，不需要继续
 
+        # 简单请求走本地快速路径
+        if await self._try_fast_path(bot, message, query):
+            return False
+
         # 检查是否是绘图命令
         if query.lower().startswith("绘制") and self.enable_drawing:
             draw_handled = await self._handle_drawing_command(bot, message, query[2:].strip())
@@ -761,8 +1164,8 @@ class OpenManus(PluginBase):
                 return False  # 绘图命令已处理，不需要继续
 
         # Call the core handler with the extracted query
-        logger.debug(f"handle_text 调用 _handle_request, query: {query}")
-        return await self._handle_request(bot, message, query)
+        logger.debug(f"handle_text 提交请求到会话队列, query: {query}")
+        return await self._enqueue_request(bot, message, query)
 
     # 检查和处理消息中的ModelScope图片链接
     @on_text_message(priority=50)
@@ -865,17 +1268,7 @@ class OpenManus(PluginBase):
                 
             # 发送图片 - 直接使用图片内容而非文件路径
             try:
-                if hasattr(bot, 'send_image_message'):
-                    logger.info(f"【图片处理】使用send_image_message方法发送图片")
-                    await bot.send_image_message(target_id, image=image_data)  # 直接传递图片内容
-                    logger.info(f"【图片处理】成功发送图片到: {target_id}")
-                elif hasattr(bot, 'SendImageMessage'):
-                    logger.info(f"【图片处理】使用SendImageMessage方法发送图片")
-                    await bot.SendImageMessage(target_id, image=image_data)  # 直接传递图片内容
-                    logger.info(f"【图片处理】成功发送图片到: {target_id}")
-                else:
-                    logger.error("【图片处理】API不支持发送图片消息")
-                    return
+                await send_image(bot, target_id, image_data)
             except Exception as e:
                 logger.exception(f"【图片处理】发送图片异常: {e}")
                 
@@ -920,6 +1313,39 @@ class OpenManus(PluginBase):
         
         return basic_help + usage_help
 
+    async def _try_fast_path(self, bot: WechatAPIClient, message: dict, query: str) -> bool:
+        """尝试用本地快速路径直接回答，无法处理时返回False由代理处理
+        
+        Args:
+            bot: WechatAPIClient实例
+            message: 消息字典
+            query: 用户请求（已去掉触发词）
+            
+        Returns:
+            bool: 是否已回答
+        """
+        if not self.fast_path:
+            return False
+        try:
+            answer = await self.fast_path.answer(query)
+        except Exception as e:
+            logger.error(f"快速路径处理出错，交给代理处理: {e}")
+            return False
+        if answer is None:
+            return False
+        
+        is_group = message.get("IsGroup", False)
+        user_id = message.get("SenderWxid", message.get("sender_id", ""))
+        target_id = message.get("FromWxid") if is_group else user_id
+        at_list = [user_id] if is_group and user_id else []
+        await bot.send_at_message(target_id, answer, at_list)
+        
+        # 保存到会话记忆，后续追问可以引用结果
+        if self.enable_memory and self.gemini_client:
+            self.gemini_client.add_to_chat_history(target_id, "user", query)
+            self.gemini_client.add_to_chat_history(target_id, "assistant", answer)
+        return True
+
     async def _handle_commands(self, bot: WechatAPIClient, message: dict, content: str):
         """处理内置命令，如清除记忆等"""
         user_id = message.get("sender_id", message.get("SenderWxid", ""))
@@ -928,10 +1354,20 @@ class OpenManus(PluginBase):
         at_list = [user_id] if room_id and user_id else []
         session_id = target_id  # 使用同样的会话ID规则
         
+        # 取消该用户正在处理和排队中的请求
+        if content.strip().rstrip("!！。.~～") in self.cancel_commands:
+            cancelled = self.session_queue.cancel(session_id, user_id)
+            reply = "已取消您正在处理的请求。" if cancelled else "您当前没有正在处理的请求。"
+            await bot.send_at_message(target_id, reply, at_list)
+            return True  # 命令已处理
+        
         # 处理清除记忆/对话命令
         if content.strip().lower() in ["清除记忆", "清除对话", "忘记对话", "清除上下文"]:
             if self.gemini_client:
                 self.gemini_client.clear_chat_history(session_id)
+                if self.answer_cache:
+                    self.answer_cache.clear(session_id)
+                code_kernels.release(session_id)
                 await bot.send_at_message(
                     target_id,
                     "已清除与您的对话记忆，开始新的对话。",
@@ -1017,19 +1453,21 @@ class OpenManus(PluginBase):
                 try:
                     # 使用MiniMax TTS
                     if self.minimax_tts_enabled and self.minimax_tts_client:
-                        audio_data = await self.minimax_tts_client.text_to_speech(
-                            text=segment_text,
-                            voice_id=self.minimax_tts_voice_id,
-                            model=self.minimax_tts_model,
-                            format="mp3", # 固定使用mp3格式获取
-                            speed=self.minimax_tts_speed,
-                            vol=self.minimax_tts_vol,
-                            pitch=self.minimax_tts_pitch,
-                            sample_rate=self.minimax_tts_sample_rate,
-                            bitrate=self.minimax_tts_bitrate,
-                            language_boost=self.minimax_tts_language_boost,
-                            emotion=self.minimax_tts_emotion
-                        )
+                        with tracer.span("tts.synthesize", provider="minimax", chars=len(segment_text), attempt=retry + 1) as tts_span:
+                            audio_data = await self.minimax_tts_client.text_to_speech(
+                                text=segment_text,
+                                voice_id=self.minimax_tts_voice_id,
+                                model=self.minimax_tts_model,
+                                format="mp3", # 固定使用mp3格式获取
+                                speed=self.minimax_tts_speed,
+                                vol=self.minimax_tts_vol,
+                                pitch=self.minimax_tts_pitch,
+                                sample_rate=self.minimax_tts_sample_rate,
+                                bitrate=self.minimax_tts_bitrate,
+                                language_boost=self.minimax_tts_language_boost,
+                                emotion=self.minimax_tts_emotion
+                            )
+                            tts_span.set_attribute("audio_bytes", len(audio_data) if audio_data else 0)
                         if audio_data:
                             tts_method_used = "MiniMax TTS"
                             audio_format = "mp3" # 强制指定mp3格式
@@ -1037,10 +1475,12 @@ class OpenManus(PluginBase):
                             
                     # 如果MiniMax失败，使用Fish Audio TTS
                     if not audio_data and self.tts_enabled and self.tts_client:
-                        audio_data = await self.tts_client.text_to_speech(
-                            text=segment_text,
-                            format="mp3" # 固定使用mp3格式获取
-                        )
+                        with tracer.span("tts.synthesize", provider="fish", chars=len(segment_text), attempt=retry + 1) as tts_span:
+                            audio_data = await self.tts_client.text_to_speech(
+                                text=segment_text,
+                                format="mp3" # 固定使用mp3格式获取
+                            )
+                            tts_span.set_attribute("audio_bytes", len(audio_data) if audio_data else 0)
                         if audio_data:
                             tts_method_used = "Fish Audio TTS"
                             audio_format = "mp3" # 强制指定mp3格式
@@ -1167,6 +1607,7 @@ class OpenManus(PluginBase):
         max_retries = 3
         success = False
         method_used = None
+        send_span = tracer.start_span("wechat.send_voice", segment=chunk_index, format=audio_format)
         
         # 尝试重试发送语音，最多3次
         for retry in range(max_retries):
@@ -1208,6 +1649,10 @@ class OpenManus(PluginBase):
                 if retry < max_retries - 1:
                     await asyncio.sleep(2)  # 重试前等待
         
+        send_span.set_attributes(success=success, attempts=retry + 1)
+        if not success:
+            send_span.set_error("语音发送失败")
+        send_span.end()
         return success
 
     async def _handle_drawing_command(self, bot: WechatAPIClient, message: dict, prompt: str) -> bool:
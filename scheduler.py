@@ -0,0 +1,157 @@
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, List, Any
+
+from loguru import logger
+
+# 默认优先级，数值越小越优先
+DEFAULT_PRIORITY_CLASSES = {"admin": 0, "private": 1, "group": 2}
+# 默认排队时间SLO（毫秒）
+DEFAULT_SLO_MS = {"admin": 1000, "private": 3000, "group": 10000}
+
+class Ticket:
+    """调度器发放的执行许可，release() 可重复调用"""
+
+    def __init__(self, scheduler: "FairScheduler", session_id: str, priority_class: str, wait_ms: float):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.priority_class = priority_class
+        self.wait_ms = wait_ms
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler._release()
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future, session_id: str, priority_class: str):
+        self.future = future
+        self.session_id = session_id
+        self.priority_class = priority_class
+        self.enqueued_at = time.monotonic()
+
+class FairScheduler:
+    """代理运行的全局调度器
+
+    - 全局并发上限：同时运行的代理数
+    - 优先级：不同优先级之间严格按优先级放行
+    - 加权公平排队：同一优先级内按会话的虚拟完成时间放行，
+      刷屏的群只会拉长自己的排队时间，不会饿死其它会话
+    - SLO：按优先级记录排队时间分位数和超标次数
+    """
+
+    def __init__(self, max_concurrency: int = 4, priority_classes: Dict[str, int] = None,
+                 slo_ms: Dict[str, float] = None, weights: Dict[str, float] = None,
+                 window: int = 1000):
+        """初始化调度器
+
+        Args:
+            max_concurrency: 全局同时运行的最大代理数
+            priority_classes: 优先级类别 -> 优先级（越小越优先）
+            slo_ms: 优先级类别 -> 排队时间目标（毫秒）
+            weights: 会话ID -> 权重（默认1，权重越大分到的份额越多）
+            window: 计算分位数使用的最近样本数
+        """
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.priority_classes = dict(priority_classes or DEFAULT_PRIORITY_CLASSES)
+        self.slo_ms = dict(slo_ms or DEFAULT_SLO_MS)
+        self.weights = dict(weights or {})
+        self.active = 0
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._session_finish: Dict[str, float] = {}
+        self._waits: Dict[str, deque] = {}
+        self._window = window
+        self.stats = {"granted": 0, "cancelled": 0, "slo_violations": 0}
+
+    def _tag(self, session_id: str) -> float:
+        """计算请求的虚拟完成时间（每次运行的代价按1计）"""
+        weight = max(float(self.weights.get(session_id, 1.0)), 0.01)
+        start = max(self._virtual_time, self._session_finish.get(session_id, 0.0))
+        finish = start + 1.0 / weight
+        self._session_finish[session_id] = finish
+        return finish
+
+    async def acquire(self, session_id: str, priority_class: str = "group") -> Ticket:
+        """等待执行许可
+
+        Args:
+            session_id: 会话ID（群ID或私聊用户ID）
+            priority_class: 优先级类别
+
+        Returns:
+            Ticket: 执行许可，使用完毕后必须 release()
+        """
+        priority = self.priority_classes.get(priority_class, max(self.priority_classes.values(), default=0))
+        tag = self._tag(session_id)
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), session_id, priority_class)
+        heapq.heappush(self._heap, (priority, tag, next(self._seq), waiter))
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已获得许可但调用方被取消，归还许可
+                self._release()
+            else:
+                waiter.future.cancel()
+            self.stats["cancelled"] += 1
+            raise
+
+        wait_ms = (time.monotonic() - waiter.enqueued_at) * 1000
+        self._record_wait(priority_class, wait_ms)
+        return Ticket(self, session_id, priority_class, wait_ms)
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_concurrency and self._heap:
+            _, tag, _, waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue
+            self._virtual_time = max(self._virtual_time, tag - 1.0 / max(float(self.weights.get(waiter.session_id, 1.0)), 0.01))
+            self.active += 1
+            self.stats["granted"] += 1
+            waiter.future.set_result(None)
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+        # 没有排队和运行中的请求时重置虚拟时间，防止浮点数无限增长
+        if self.active == 0 and not self._heap:
+            self._virtual_time = 0.0
+            self._session_finish.clear()
+
+    def _record_wait(self, priority_class: str, wait_ms: float) -> None:
+        waits = self._waits.setdefault(priority_class, deque(maxlen=self._window))
+        waits.append(wait_ms)
+        target = self.slo_ms.get(priority_class)
+        if target is not None and wait_ms > target:
+            self.stats["slo_violations"] += 1
+            logger.warning(f"调度排队时间超出SLO: {priority_class} 等待 {wait_ms:.0f}ms > {target}ms "
+                           f"(运行中 {self.active}/{self.max_concurrency}, 排队 {len(self._heap)})")
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, _, waiter in self._heap if not waiter.future.done())
+
+    def metrics(self) -> Dict[str, Any]:
+        """按优先级的排队时间分位数和SLO达成情况"""
+        classes = {}
+        for priority_class, waits in self._waits.items():
+            ordered = sorted(waits)
+            target = self.slo_ms.get(priority_class)
+            classes[priority_class] = {
+                "samples": len(ordered),
+                "p50_ms": round(ordered[int(len(ordered) * 0.5)], 2),
+                "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 2),
+                "p99_ms": round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)], 2),
+                "slo_ms": target,
+                "slo_met": round(sum(1 for w in ordered if target is None or w <= target) / len(ordered), 4),
+            }
+        return {"active": self.active, "max_concurrency": self.max_concurrency, "queued": self.queued,
+                **self.stats, "classes": classes}
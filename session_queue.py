@@ -0,0 +1,251 @@
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Any, Callable, Awaitable, Optional
+
+from loguru import logger
+
+SUPERSEDE_NONE = "none"            # 新消息排队，等待当前请求完成
+SUPERSEDE_SAME_USER = "same_user"  # 同一用户的新消息取代其未完成的请求
+
+class QueuedRequest:
+    """排队中的一条用户消息"""
+
+    def __init__(self, bot: Any, message: dict, query: str):
+        self.bot = bot
+        self.message = message
+        self.query = query
+        self.sender = message.get("SenderWxid", message.get("sender_id", ""))
+        self.enqueued_at = time.monotonic()
+
+class RunningRequest:
+    """会话中正在处理的请求，包装为可取消的任务"""
+
+    def __init__(self, sender: str, task: asyncio.Task):
+        self.sender = sender
+        self.task = task
+        self.started_at = time.monotonic()
+        self.cancelling = False
+
+class SessionQueue:
+    """一个会话的排队消息
+
+    deque 支持查看队头（合并同一发送者的连续消息）和按发送者删除（取消），
+    Event 在有新消息时唤醒工作协程。
+    """
+
+    def __init__(self):
+        self.items: Deque[QueuedRequest] = deque()
+        self.ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, request: QueuedRequest) -> None:
+        self.items.append(request)
+        self.ready.set()
+
+    async def get(self, timeout: float) -> Optional[QueuedRequest]:
+        """取出队头消息，等待 timeout 秒后仍没有消息时返回None"""
+        deadline = time.monotonic() + timeout
+        while not self.items:
+            self.ready.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        return self.items.popleft()
+
+    def remove(self, sender: Optional[str] = None) -> int:
+        """删除某个发送者（为None时所有发送者）的排队消息，返回删除数"""
+        kept = [item for item in self.items if sender is not None and item.sender != sender]
+        removed = len(self.items) - len(kept)
+        if removed:
+            self.items = deque(kept)
+        return removed
+
+def merge_queries(queries: List[str]) -> str:
+    """把同一用户连续发送的多条消息合并为一次请求"""
+    if len(queries) == 1:
+        return queries[0]
+    lines = "\n".join(f"{index}. {query}" for index, query in enumerate(queries, 1))
+    return f"用户连续发送了以下 {len(queries)} 条消息，请结合起来一并回答:\n{lines}"
+
+class SessionQueueManager:
+    """按会话排队处理请求
+
+    每个活跃会话一个有界队列和一个工作协程，同一会话的请求按顺序处理；
+    工作协程取任务时会把队列中同一发送者的连续消息合并为一次代理运行；
+    每次运行包装为独立任务，可以按 (会话, 发送者) 取消，取消会沿调用链
+    传到Gemini请求、工具执行和TTS；
+    会话空闲超过 idle_timeout 后工作协程退出并移除，字典不会无限增长。
+    """
+
+    def __init__(self, handler: Callable[..., Awaitable[Any]], max_queue: int = 5,
+                 max_coalesce: int = 5, idle_timeout: float = 300,
+                 supersede: str = SUPERSEDE_NONE, supersede_window: float = 0):
+        """初始化
+
+        Args:
+            handler: 请求处理函数，签名为 handler(bot, message, query, queued_ms=...)
+            max_queue: 每个会话最多排队的消息数
+            max_coalesce: 一次最多合并的消息数
+            idle_timeout: 会话空闲多少秒后回收工作协程
+            supersede: 取代策略，"none" 新消息排队等待；"same_user" 同一用户的新消息
+                取消其正在处理和排队中的请求
+            supersede_window: 只取代开始处理不超过该秒数的请求，<=0 表示不限制
+        """
+        if supersede not in (SUPERSEDE_NONE, SUPERSEDE_SAME_USER):
+            raise ValueError(f"未知的取代策略: {supersede}")
+        self.handler = handler
+        self.max_queue = max_queue
+        self.max_coalesce = max(max_coalesce, 1)
+        self.idle_timeout = idle_timeout
+        self.supersede = supersede
+        self.supersede_window = supersede_window
+        self._queues: Dict[str, SessionQueue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._running: Dict[str, RunningRequest] = {}
+        self.stats = {"enqueued": 0, "runs": 0, "coalesced": 0, "rejected": 0, "reaped": 0,
+                      "cancelled": 0, "superseded": 0, "dropped": 0,
+                      "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def is_busy(self, session_id: str) -> bool:
+        """会话当前是否正在处理请求（包括已取消、正在清理的请求）"""
+        return session_id in self._running
+
+    def depth(self, session_id: str) -> int:
+        """会话中排队的消息数"""
+        queue = self._queues.get(session_id)
+        return len(queue) if queue else 0
+
+    def cancel(self, session_id: str, sender: Optional[str] = None, max_age: float = 0) -> int:
+        """取消会话中某个发送者正在处理和排队中的请求
+
+        Args:
+            session_id: 会话ID
+            sender: 发送者ID，为None时取消会话中所有请求
+            max_age: 只取消开始处理不超过该秒数的运行中请求，<=0 表示不限制（排队中的总会被移除）
+
+        Returns:
+            int: 被取消的请求数（运行中 + 排队中）
+        """
+        cancelled = 0
+        queue = self._queues.get(session_id)
+        if queue is not None:
+            dropped = queue.remove(sender)
+            self.stats["dropped"] += dropped
+            cancelled += dropped
+
+        running = self._running.get(session_id)
+        if (running is not None and not running.cancelling and (sender is None or running.sender == sender)
+                and (max_age <= 0 or time.monotonic() - running.started_at <= max_age)):
+            # 被取消的请求仍占用会话，直到其清理（保存录制、释放内核等）完成后才开始下一次运行
+            running.task.cancel()
+            running.cancelling = True
+            self.stats["cancelled"] += 1
+            cancelled += 1
+        if cancelled:
+            logger.info(f"会话 {session_id} 已取消 {sender or '所有用户'} 的 {cancelled} 个请求")
+        return cancelled
+
+    def submit(self, session_id: str, bot: Any, message: dict, query: str) -> Optional[int]:
+        """提交请求
+
+        Args:
+            session_id: 会话ID
+            bot: WechatAPIClient实例
+            message: 消息字典
+            query: 用户请求
+
+        Returns:
+            Optional[int]: 提交后前面还有多少个请求（包括正在处理或正在取消的请求，0 表示将立即处理）；
+            队列已满时返回None
+        """
+        request = QueuedRequest(bot, message, query)
+        if self.supersede == SUPERSEDE_SAME_USER and request.sender:
+            superseded = self.cancel(session_id, request.sender, max_age=self.supersede_window)
+            self.stats["superseded"] += superseded
+
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = SessionQueue()
+            self._queues[session_id] = queue
+        if self.max_queue > 0 and len(queue) >= self.max_queue:
+            self.stats["rejected"] += 1
+            logger.warning(f"会话 {session_id} 排队已满 ({self.max_queue})，拒绝新消息")
+            return None
+        queue.put(request)
+        self.stats["enqueued"] += 1
+
+        worker = self._workers.get(session_id)
+        if worker is None or worker.done():
+            self._workers[session_id] = asyncio.create_task(self._worker(session_id, queue))
+        return len(queue) - (0 if self.is_busy(session_id) else 1)
+
+    def _take_batch(self, first: QueuedRequest, queue: SessionQueue) -> List[QueuedRequest]:
+        """取出队列头部与第一条消息同一发送者的连续消息"""
+        batch = [first]
+        while len(batch) < self.max_coalesce and queue.items and queue.items[0].sender == first.sender:
+            batch.append(queue.items.popleft())
+        return batch
+
+    async def _worker(self, session_id: str, queue: SessionQueue) -> None:
+        try:
+            while True:
+                first = await queue.get(self.idle_timeout)
+                if first is None:
+                    break
+
+                batch = self._take_batch(first, queue)
+                now = time.monotonic()
+                wait_ms = max((now - item.enqueued_at) * 1000 for item in batch)
+                self.stats["runs"] += 1
+                self.stats["coalesced"] += len(batch) - 1
+                self.stats["wait_ms_total"] += sum((now - item.enqueued_at) * 1000 for item in batch)
+                self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+                if len(batch) > 1:
+                    logger.info(f"会话 {session_id} 合并了 {len(batch)} 条排队消息")
+
+                last = batch[-1]
+                task = asyncio.create_task(self.handler(last.bot, last.message, merge_queries([item.query for item in batch]),
+                                                        queued_ms=round(wait_ms, 2)))
+                running = RunningRequest(last.sender, task)
+                self._running[session_id] = running
+                try:
+                    # 用wait而不是直接await，区分请求被取消和工作协程自身被取消
+                    await asyncio.wait({task})
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    if self._running.get(session_id) is running:
+                        del self._running[session_id]
+                if task.cancelled():
+                    logger.info(f"会话 {session_id} 的请求已取消，耗时 {time.monotonic() - running.started_at:.1f}秒")
+                elif task.exception() is not None:
+                    logger.opt(exception=task.exception()).error(f"会话 {session_id} 处理请求时发生未捕获的异常")
+        finally:
+            # 回收空闲会话
+            if self._workers.get(session_id) is asyncio.current_task():
+                del self._workers[session_id]
+                if not queue.items and self._queues.get(session_id) is queue:
+                    del self._queues[session_id]
+                self.stats["reaped"] += 1
+                logger.debug(f"会话 {session_id} 空闲，已回收工作协程")
+
+    def metrics(self) -> Dict[str, Any]:
+        """队列指标"""
+        depths = [len(queue) for queue in self._queues.values()]
+        waited = max(self.stats["enqueued"] - self.stats["rejected"], 1)
+        return {
+            "active_sessions": len(self._workers),
+            "busy_sessions": len(self._running),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            **{key: value for key, value in self.stats.items() if key != "wait_ms_total"},
+            "wait_ms_avg": round(self.stats["wait_ms_total"] / waited, 2),
+        }
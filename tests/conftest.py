@@ -0,0 +1,18 @@
+"""
+测试配置
+
+插件在机器人中以 plugins.OpenManus 包的形式加载（模块之间使用相对导入），而包的 __init__
+会导入依赖机器人框架的 main。这里把插件目录注册为不执行 __init__ 的 OpenManus 包，
+测试直接导入各子模块，例如 from OpenManus.answer_cache import AnswerCache。
+"""
+
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "OpenManus" not in sys.modules:
+    package = types.ModuleType("OpenManus")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["OpenManus"] = package
@@ -0,0 +1,53 @@
+import time
+
+from OpenManus.answer_cache import AnswerCache, SCOPE_GLOBAL
+
+QUESTION = "光合作用的原理是什么"
+
+def test_store_then_lookup_hits():
+    cache = AnswerCache()
+    assert cache.store(QUESTION, "答案", "room", True)
+    hit = cache.lookup("光合作用的原理是什么？", "room", True)
+    assert hit is not None and hit.answer == "答案"
+    assert cache.lookup(QUESTION, "other-room", True) is None
+
+def test_store_same_question_twice_then_lookup_and_clear():
+    cache = AnswerCache(scope=SCOPE_GLOBAL)
+    assert cache.store(QUESTION, "旧答案", "room", True)
+    assert cache.store(QUESTION, "新答案", "room", True)
+    assert cache.metrics()["entries"] == 1
+    assert cache.lookup(QUESTION, "room", True).answer == "新答案"
+    cache.clear()
+    assert cache.metrics()["entries"] == 0
+    assert cache.lookup(QUESTION, "room", True) is None
+
+def test_entities_must_match():
+    cache = AnswerCache()
+    cache.store("北京有哪些著名景点", "北京的景点", "room", True)
+    assert cache.lookup("南京有哪些著名景点", "room", True) is None
+
+def test_expired_entries_are_removed():
+    cache = AnswerCache(ttl_by_type={"general": 0.01})
+    cache.store(QUESTION, "答案", "room", True)
+    time.sleep(0.02)
+    assert cache.lookup(QUESTION, "room", True) is None
+    assert cache.stats["expired"] == 1
+    assert cache.metrics()["scopes"] == 0
+
+def test_clear_single_session_and_eviction():
+    cache = AnswerCache(max_entries=2)
+    cache.store(QUESTION, "a", "room-a", True)
+    cache.store(QUESTION, "b", "room-b", True)
+    cache.clear("room-a")
+    assert cache.lookup(QUESTION, "room-a", True) is None
+    assert cache.lookup(QUESTION, "room-b", True).answer == "b"
+    cache.store("地球到月球有多远", "c", "room-b", True)
+    cache.store("水的沸点是多少度", "d", "room-b", True)
+    assert cache.metrics()["entries"] == 2
+    assert cache.stats["evictions"] == 1
+
+def test_uncacheable_queries_are_skipped():
+    cache = AnswerCache()
+    assert not cache.store("现在几点了", "12点", "room", True)
+    assert not cache.store("我的手机号是13800000000", "好的", "room", True)
+    assert cache.stats["stores"] == 0
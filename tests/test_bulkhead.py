@@ -0,0 +1,51 @@
+import time
+import asyncio
+import threading
+
+from OpenManus.agent.bulkhead import ToolBulkhead, EXECUTOR_THREAD
+
+class SyncTool:
+    name = "sync"
+
+    def execute(self, seconds: float = 0.2):
+        time.sleep(seconds)
+        return {"thread": threading.current_thread().name}
+
+class AsyncTool:
+    name = "async"
+
+    async def execute(self):
+        return {"thread": threading.current_thread().name}
+
+def test_thread_executor_runs_sync_execute_in_pool():
+    bulkhead = ToolBulkhead("sync", max_concurrency=2, timeout=5, executor=EXECUTOR_THREAD)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await bulkhead.call(SyncTool(), seconds=0.2)
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(main())
+    assert result["thread"].startswith("tool-sync")
+    # 同步调用期间事件循环没有被阻塞
+    assert ticks >= 5
+
+def test_thread_executor_times_out_sync_execute():
+    bulkhead = ToolBulkhead("sync", max_concurrency=1, timeout=0.05, executor=EXECUTOR_THREAD)
+    result = asyncio.run(bulkhead.call(SyncTool(), seconds=0.3))
+    assert "超时" in result["error"]
+    assert bulkhead.stats["timeouts"] == 1
+
+def test_thread_executor_awaits_coroutine_execute_on_loop():
+    bulkhead = ToolBulkhead("async", max_concurrency=1, timeout=5, executor=EXECUTOR_THREAD)
+    result = asyncio.run(bulkhead.call(AsyncTool()))
+    assert result["thread"] == threading.main_thread().name
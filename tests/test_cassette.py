@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from OpenManus.api_client import GeminiClient
+from OpenManus.agent.cassette import Cassette, CassetteMiss, use_cassette
+from OpenManus.agent.mcp import MCPAgent, Tool
+from OpenManus.benchmarks.replay_bench import ReplayTool
+
+class FakeGemini(GeminiClient):
+    def __init__(self):
+        pass
+
+class EchoTool(Tool):
+    def __init__(self):
+        super().__init__("echo", "原样返回", {"text": {"type": "string"}})
+
+    async def execute(self, text: str) -> dict:
+        return {"text": text}
+
+class BrokenTool(Tool):
+    def __init__(self):
+        super().__init__("broken", "总是失败", {})
+
+    async def execute(self) -> dict:
+        raise RuntimeError("boom")
+
+def make_agent(*tools):
+    agent = MCPAgent(FakeGemini(), model="test-model")
+    agent.register_tools(list(tools))
+    return agent
+
+def test_replayed_tool_result():
+    agent = make_agent(EchoTool())
+    recording = Cassette("record")
+
+    async def record():
+        with use_cassette(recording):
+            return await agent.execute_tool("echo", text="录制")
+
+    assert asyncio.run(record()) == {"text": "录制"}
+
+    replay = Cassette("replay", interactions=recording.interactions, latency="zero")
+
+    async def replay_call():
+        with use_cassette(replay):
+            return await agent.execute_tool("echo", text="录制")
+
+    assert asyncio.run(replay_call()) == {"text": "录制"}
+    assert replay.stats["misses"] == 0
+
+def test_cassette_miss_is_not_turned_into_tool_error():
+    agent = make_agent(EchoTool())
+    replay = Cassette("replay", latency="zero")
+
+    async def replay_call():
+        with use_cassette(replay):
+            return await agent.execute_tool("echo", text="没有录制")
+
+    with pytest.raises(CassetteMiss):
+        asyncio.run(replay_call())
+
+def test_replay_tool_execution_propagates():
+    agent = make_agent(ReplayTool({"name": "echo", "parameters": {"text": {"type": "string"}}}))
+    with pytest.raises(CassetteMiss):
+        asyncio.run(agent.execute_tool("echo", text="x"))
+
+def test_other_tool_errors_are_returned_to_model():
+    agent = make_agent(BrokenTool())
+    result = asyncio.run(agent.execute_tool("broken"))
+    assert "boom" in result["error"]
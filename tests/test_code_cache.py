@@ -0,0 +1,66 @@
+import pytest
+
+from OpenManus.tools.code_cache import CodeCache, is_deterministic, normalize_code, code_hash
+
+@pytest.mark.parametrize("code", [
+    "print(sum(range(10)))",
+    "import math\nprint(math.sqrt(2))",
+    "import numpy as np\nprint(np.arange(5).mean())",
+    "from numpy import linalg\nprint(linalg.norm([3, 4]))",
+    "import pandas as pd\nprint(pd.Timestamp('2024-01-01') + pd.Timedelta(days=1))",
+    "print('today')",
+    "result = sorted({'b': 1, 'a': 2})",
+])
+def test_deterministic_code(code):
+    assert is_deterministic(code)
+
+@pytest.mark.parametrize("code", [
+    "import random\nprint(random.random())",
+    "import numpy.random\nprint(numpy.random.rand())",
+    "from numpy.random import default_rng",
+    "from numpy.random import Generator",
+    "from numpy import random",
+    "import os.path",
+    "from math import *",
+    "from numpy import *\nprint(rand())",
+    "import numpy as np\nprint(np.random.rand(3))",
+    "import pandas as pd\nprint(pd.Timestamp('now'))",
+    "import pandas as pd\nprint(pd.Timestamp(ts_input='today'))",
+    "import pandas as pd\nprint(pd.to_datetime('today'))",
+    "import pandas as pd\nprint(pd.date_range(end='now', periods=3))",
+    "import numpy as np\nprint(np.datetime64('now'))",
+    "import pandas as pd\nprint(pd.Timestamp.now())",
+    "print({1, 2, 3})",
+    "print(open('data.txt').read())",
+    "import numpy as np\nprint(np.loadtxt('data.txt'))",
+    "import numpy as np\nprint(np.load('data.npy'))",
+    "import numpy as np\nprint(np.fromfile('data.bin'))",
+    "import numpy as np\nprint(np.genfromtxt('data.csv'))",
+    "from numpy import loadtxt",
+    "import pandas as pd\nprint(pd.read_parquet('data.parquet'))",
+    "import pandas as pd\nprint(pd.read_table('data.tsv'))",
+    "import pandas as pd\nprint(pd.read_pickle('data.pkl'))",
+    "import numpy as np\nnp.savetxt('out.txt', np.arange(3))",
+    "import numpy as np\nnp.arange(3).tofile('out.bin')",
+    "import pandas as pd\npd.DataFrame({'a': [1]}).to_parquet('out.parquet')",
+    "import matplotlib.pyplot as plt\nplt.plot([1, 2])\nplt.savefig('out.png')",
+    "async def main():\n    pass",
+    "print(",
+])
+def test_nondeterministic_code(code):
+    assert not is_deterministic(code)
+
+def test_normalize_code_ignores_indentation_and_line_endings():
+    assert normalize_code("    x = 1  \r\n    print(x)\r\n\r\n") == "x = 1\nprint(x)"
+    assert code_hash(normalize_code("  print(1)")) == code_hash(normalize_code("print(1)\n"))
+
+def test_cache_stores_only_deterministic_results():
+    cache = CodeCache()
+    code = normalize_code("print(1 + 1)")
+    key = code_hash(code)
+    assert cache.lookup(key, code, 1000) is None
+    assert cache.store(key, code, 1000, {"stdout": "2\n"})
+    assert cache.lookup(key, code, 1000) == {"stdout": "2\n"}
+
+    clock = normalize_code("import pandas as pd\nprint(pd.Timestamp('now'))")
+    assert not cache.store(code_hash(clock), clock, 1000, {"stdout": "2024-01-01\n"})
@@ -0,0 +1,102 @@
+import os
+import asyncio
+import multiprocessing
+
+import pytest
+
+from OpenManus.tools.code_sandbox import SandboxPool
+from OpenManus.tools.sandbox_worker import WORKER_RUN_NAME
+
+pytestmark = pytest.mark.skipif("forkserver" not in multiprocessing.get_all_start_methods(),
+                                reason="需要 forkserver 启动方式")
+
+def run_pool(scenario, **options):
+    """在 size=1 的 forkserver 进程池上运行 scenario(pool)，结束后关闭进程池"""
+    pool = SandboxPool(size=1, start_method="forkserver", **options)
+
+    async def main():
+        try:
+            return await scenario(pool)
+        finally:
+            pool.close()
+
+    return asyncio.run(main())
+
+PID = "result = os.getpid()"
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_worker_does_not_import_plugin_package():
+    async def scenario(pool):
+        # 除按路径运行的入口文件外，工作进程中不应有任何从插件目录导入的模块
+        return await pool.run("import matplotlib\n"
+                              f"result = [sorted(name for name, module in list(sys.modules.items())"
+                              f" if name != {WORKER_RUN_NAME!r} and (getattr(module, '__file__', None) or '').startswith({PLUGIN_DIR!r})),"
+                              " matplotlib.get_backend().lower()]", timeout=30)
+
+    reply = run_pool(scenario)
+    assert reply["error"] is None
+    assert reply["result"] == [[], "agg"]
+
+def test_timeout_replaces_worker():
+    async def scenario(pool):
+        first = await pool.run(PID, timeout=30)
+        timed_out = await pool.run("while True: pass", timeout=0.5)
+        second = await pool.run(PID, timeout=30)
+        return first, timed_out, second, pool.metrics()
+
+    first, timed_out, second, metrics = run_pool(scenario)
+    assert "超时" in timed_out["error"]
+    assert first["result"] != second["result"]
+    assert metrics["timeouts"] == 1
+    assert metrics["spawned"] == 2
+    assert metrics["alive"] == 1
+
+def test_crash_replaces_worker():
+    async def scenario(pool):
+        crashed = await pool.run("os._exit(3)", timeout=30)
+        after = await pool.run("result = 1 + 1", timeout=30)
+        return crashed, after, pool.metrics()
+
+    crashed, after, metrics = run_pool(scenario)
+    assert "退出码 3" in crashed["error"]
+    assert after["result"] == 2
+    assert metrics["crashes"] == 1
+    assert metrics["spawned"] == 2
+
+def test_cancel_replaces_worker():
+    async def scenario(pool):
+        first = await pool.run(PID, timeout=30)
+        task = asyncio.create_task(pool.run("time.sleep(30)", timeout=60))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        second = await pool.run(PID, timeout=30)
+        return first, second, pool.metrics()
+
+    first, second, metrics = run_pool(scenario)
+    assert first["result"] != second["result"]
+    assert metrics["cancelled"] == 1
+    assert metrics["spawned"] == 2
+
+def test_worker_is_recycled_after_max_jobs():
+    async def scenario(pool):
+        return [(await pool.run(PID, timeout=30))["result"] for _ in range(3)], pool.metrics()
+
+    pids, metrics = run_pool(scenario, max_jobs_per_worker=2)
+    assert pids[0] == pids[1] != pids[2]
+    assert metrics["recycled"] == 1
+    assert metrics["spawned"] == 2
+
+def test_code_error_keeps_worker():
+    async def scenario(pool):
+        first = await pool.run(PID, timeout=30)
+        failed = await pool.run("1 / 0", timeout=30)
+        second = await pool.run(PID, timeout=30)
+        return first, failed, second, pool.metrics()
+
+    first, failed, second, metrics = run_pool(scenario)
+    assert "ZeroDivisionError" in failed["error"]
+    assert first["result"] == second["result"]
+    assert metrics["errors"] == 1
+    assert metrics["spawned"] == 1
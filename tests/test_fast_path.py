@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from OpenManus.fast_path import FastPathRouter
+from OpenManus.tools.calculator_tool import CalculatorTool, estimate_digits, MAX_RESULT_DIGITS
+from OpenManus.tools.datetime_tool import DateTimeTool
+
+@pytest.fixture
+def router():
+    return FastPathRouter(calculator=CalculatorTool(), datetime_tool=DateTimeTool())
+
+@pytest.mark.parametrize("query, expected", [
+    ("计算 (245+37)*1.5", ("calculator", {"expression": "(245+37)*1.5"})),
+    ("3^2 等于多少", ("calculator", {"expression": "3**2"})),
+    ("12×3", ("calculator", {"expression": "12*3"})),
+    ("现在几点", ("time", {})),
+    ("明天星期几", ("date", {"days": 1})),
+])
+def test_match(router, query, expected):
+    assert router.match(query) == expected
+
+@pytest.mark.parametrize("query", ["3/4", "2024-05-01", "138 0013 8000", "今天天气怎么样", "计算 2^20000", "9^9^9"])
+def test_no_match(router, query):
+    assert router.match(query) is None
+
+def test_explicit_division_still_matches(router):
+    assert router.match("计算 3/4") == ("calculator", {"expression": "3/4"})
+
+def test_answer_calculation(router):
+    assert asyncio.run(router.answer("计算 (245+37)*1.5")) == "(245+37)*1.5 = 423"
+    assert router.stats["hits"] == 1
+
+def test_large_results_fall_back(router):
+    assert asyncio.run(router.answer("计算 2^20000")) is None
+    assert asyncio.run(router.answer("9^9^9")) is None
+    assert router.stats["hits"] == 0
+
+def test_tool_errors_fall_back(router):
+    assert asyncio.run(router.answer("计算 1/0")) is None
+    assert router.stats["fallbacks"] == 1
+
+def test_unexpected_errors_fall_back(router, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("boom")
+    monkeypatch.setattr("OpenManus.fast_path._format_number", broken)
+    assert asyncio.run(router.answer("1+1")) is None
+    assert router.stats["fallbacks"] == 1
+
+def test_calculator_rejects_huge_powers():
+    assert estimate_digits("2**3000") < MAX_RESULT_DIGITS < estimate_digits("2**20000")
+    assert estimate_digits("9**9**9") > MAX_RESULT_DIGITS
+    result = asyncio.run(CalculatorTool().execute(expression="9**9**9"))
+    assert "error" in result
@@ -0,0 +1,37 @@
+import asyncio
+
+from OpenManus.api_client import GeminiClient
+from OpenManus.agent.mcp import MCPAgent
+
+class FakeGemini(GeminiClient):
+    def __init__(self):
+        pass
+
+    async def chat_completion(self, **kwargs):
+        yield {"candidates": [{"content": {"parts": [{"text": "回答"}]}}]}
+
+def make_agent():
+    return MCPAgent(FakeGemini(), model="test-model")
+
+QUESTION = {"role": "user", "content": "问题"}
+FINAL_PROMPT = {"role": "user", "content": "请生成最终回答"}
+
+def test_final_prompt_is_removed_from_history():
+    agent = make_agent()
+    answer = asyncio.run(agent._complete_final_answer([QUESTION, FINAL_PROMPT], "system"))
+    assert answer == "回答"
+    assert agent.conversation_history == [QUESTION, {"role": "assistant", "content": "回答"}]
+
+def test_user_question_is_kept_without_final_prompt():
+    agent = make_agent()
+    asyncio.run(agent._complete_final_answer([QUESTION], "system", has_final_prompt=False))
+    assert agent.conversation_history == [QUESTION, {"role": "assistant", "content": "回答"}]
+
+def test_streamed_answer_keeps_user_question():
+    agent = make_agent()
+
+    async def consume():
+        return [chunk async for chunk in agent._stream_final_answer([QUESTION], "system", has_final_prompt=False)]
+
+    assert asyncio.run(consume()) == ["回答"]
+    assert agent.conversation_history == [QUESTION, {"role": "assistant", "content": "回答"}]
@@ -0,0 +1,139 @@
+import types
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from OpenManus.tools import ohlcv_store as store_module
+from OpenManus.tools.ohlcv_store import OHLCVStore
+
+CST = timezone(timedelta(hours=8))
+DATES = pd.bdate_range("2024-01-01", "2024-12-31")
+CLOSES = 10 + np.arange(len(DATES)) * 0.1
+
+class StubStore(OHLCVStore):
+    """用内存中的行情代替 akshare，记录每次下载的区间"""
+
+    def __init__(self, root):
+        super().__init__(root=str(root), history_days=60)
+        self.factor = 1.0
+        self.downloads = []
+        self.fail = False
+
+    def _download(self, market, symbol, start, end):
+        self.downloads.append((start.date(), end.date()))
+        if self.fail:
+            raise ConnectionError("network down")
+        mask = (DATES.date >= start.date()) & (DATES.date <= end.date())
+        close = CLOSES[mask] * self.factor
+        return pd.DataFrame({"日期": DATES[mask].strftime("%Y-%m-%d"), "开盘": close, "最高": close + 0.5,
+                             "最低": close - 0.5, "收盘": close, "成交量": 1000.0, "成交额": close * 1000})
+
+@pytest.fixture
+def clock(monkeypatch):
+    """把 "最近收盘时间" 和同步时间戳固定在指定交易日收盘后"""
+    state = {}
+
+    def set_day(day: str):
+        closed_at = datetime.fromisoformat(day).replace(hour=15, tzinfo=CST)
+        state["closed_at"] = closed_at
+        state["now"] = closed_at.timestamp() + 3600
+
+    monkeypatch.setattr(store_module, "last_close", lambda market: state["closed_at"])
+    monkeypatch.setattr(store_module, "time", types.SimpleNamespace(time=lambda: state["now"]))
+    return set_day
+
+def expected_closes(through: str, days: int, factor: float = 1.0) -> np.ndarray:
+    mask = DATES.date <= datetime.fromisoformat(through).date()
+    return CLOSES[mask][-days:] * factor
+
+def test_first_request_downloads_then_serves_locally(tmp_path, clock):
+    store = StubStore(tmp_path)
+    clock("2024-06-03")
+    first = store.history("A", "600519", 30)
+    assert len(first["close"]) == 30
+    np.testing.assert_allclose(first["close"], expected_closes("2024-06-03", 30))
+    assert first["date"][-1] == "2024-06-03"
+
+    second = store.history("A", "600519", 30)
+    np.testing.assert_array_equal(second["close"], first["close"])
+    assert len(store.downloads) == 1
+    assert store.stats["full"] == 1 and store.stats["local"] == 1
+
+def test_incremental_append_downloads_only_new_days(tmp_path, clock):
+    store = StubStore(tmp_path)
+    clock("2024-06-03")
+    store.history("A", "600519", 30)
+    rows = store._read_meta(store._path("A", "600519"))["rows"]
+
+    clock("2024-06-06")
+    columns = store.history("A", "600519", 30)
+    # 从最后一个已保存的交易日开始下载，只追加之后的3天
+    assert store.downloads[-1] == (datetime(2024, 6, 3).date(), datetime(2024, 6, 6).date())
+    assert store.stats["incremental"] == 1 and store.stats["full"] == 1
+    assert store._read_meta(store._path("A", "600519"))["rows"] == rows + 3
+    np.testing.assert_allclose(columns["close"], expected_closes("2024-06-06", 30))
+    assert list(columns["date"][-3:]) == ["2024-06-04", "2024-06-05", "2024-06-06"]
+
+def test_store_drops_days_before_window_after_doubling(tmp_path, clock):
+    store = StubStore(tmp_path)
+    path = store._path("A", "600519")
+    clock("2024-06-03")
+    store.history("A", "600519", 30)
+    first_rows = store._read_meta(path)["rows"]
+    assert first_rows <= 2 * store.history_days
+
+    # 约4个月后增量追加，行数超过 history_days 的两倍，丢弃查询窗口之前的交易日
+    clock("2024-09-30")
+    columns = store.history("A", "600519", 30)
+    meta = store._read_meta(path)
+    window_start = (datetime(2024, 9, 30) - timedelta(days=105)).date()
+    assert store.stats["incremental"] == 1 and store.stats["full"] == 1
+    assert meta["start"] == window_start.isoformat()
+    assert meta["rows"] == ((DATES.date >= window_start) & (DATES.date <= datetime(2024, 9, 30).date())).sum()
+    assert store.stats["rows_trimmed"] == store.stats["rows_appended"] - meta["rows"] > 0
+    np.testing.assert_allclose(columns["close"], expected_closes("2024-09-30", 30))
+
+    # 重写后的数据仍被视为覆盖查询窗口：读取不再下载，之后继续增量追加
+    downloads = len(store.downloads)
+    store.history("A", "600519", 60)
+    assert len(store.downloads) == downloads
+    clock("2024-10-01")
+    columns = store.history("A", "600519", 60)
+    assert store.stats["incremental"] == 2 and store.stats["full"] == 1
+    np.testing.assert_allclose(columns["close"], expected_closes("2024-10-01", 60))
+
+def test_adjusted_price_change_triggers_full_refetch(tmp_path, clock):
+    store = StubStore(tmp_path)
+    clock("2024-06-03")
+    store.history("A", "600519", 30)
+
+    # 除权后前复权价格整体变化，重叠的最后一天收盘价不再一致
+    store.factor = 0.5
+    clock("2024-06-06")
+    columns = store.history("A", "600519", 30)
+    assert store.stats["adjust_resets"] == 1
+    assert store.stats["full"] == 2
+    np.testing.assert_allclose(columns["close"], expected_closes("2024-06-06", 30, factor=0.5))
+
+def test_failed_update_serves_stale_data_and_backs_off(tmp_path, clock):
+    store = StubStore(tmp_path)
+    clock("2024-06-03")
+    store.history("A", "600519", 30)
+
+    store.fail = True
+    clock("2024-06-04")
+    stale = store.history("A", "600519", 30)
+    assert stale["date"][-1] == "2024-06-03"
+    assert store.stats["failures"] == 1
+    store.history("A", "600519", 30)
+    # retry_after 内不再重试下载
+    assert len(store.downloads) == 2
+
+def test_unknown_market_and_failed_first_download(tmp_path, clock):
+    store = StubStore(tmp_path)
+    clock("2024-06-03")
+    assert store.history("JP", "7203", 30) is None
+    store.fail = True
+    assert store.history("A", "000001", 30) is None
@@ -0,0 +1,82 @@
+import json
+import asyncio
+
+import pytest
+
+from OpenManus.agent.planner import PlanError, parse_plan, execute_plan
+
+TOOLS = ["weather", "search"]
+
+def plan(*nodes):
+    return json.dumps({"nodes": list(nodes)}, ensure_ascii=False)
+
+def test_parse_plan_levels():
+    levels = parse_plan("```json\n" + plan(
+        {"id": "a", "tool": "weather", "args": {"city": "北京"}},
+        {"id": "b", "tool": "weather", "args": {"city": "上海"}},
+        {"id": "c", "tool": "search", "args": {"query": "${a.temperature} 穿衣"}},
+    ) + "\n```", TOOLS, 5)
+    assert [[node["id"] for node in level] for level in levels] == [["a", "b"], ["c"]]
+    assert levels[1][0]["depends_on"] == ["a"]
+
+def test_empty_plan():
+    assert parse_plan(plan(), TOOLS, 5) == []
+
+@pytest.mark.parametrize("text", [
+    "没有计划",
+    "{not json}",
+    json.dumps({"steps": []}),
+    plan({"id": "a", "tool": "weather", "args": "北京"}),
+    plan({"id": "a", "tool": "weather", "args": ["北京"]}),
+    plan({"id": "a", "tool": "stock", "args": {}}),
+    plan({"id": "a", "tool": "weather"}, {"id": "a", "tool": "search"}),
+    plan({"id": "a", "tool": "weather", "depends_on": ["missing"]}),
+    plan({"id": "a", "tool": "weather", "depends_on": ["b"]}, {"id": "b", "tool": "search", "depends_on": ["a"]}),
+    plan({"tool": "weather"}),
+    plan(*({"id": f"n{i}", "tool": "search"} for i in range(6))),
+])
+def test_parse_plan_rejects_bad_plans(text):
+    with pytest.raises(PlanError):
+        parse_plan(text, TOOLS, 5)
+
+def test_parse_plan_only_allows_declared_tools():
+    text = plan({"id": "a", "tool": "search", "args": {}})
+    assert parse_plan(text, ["search"], 5)
+    with pytest.raises(PlanError):
+        parse_plan(text, ["weather"], 5)
+
+def test_execute_plan_passes_results_and_skips_failed_dependents():
+    levels = parse_plan(plan(
+        {"id": "a", "tool": "weather", "args": {"city": "北京"}},
+        {"id": "b", "tool": "search", "args": {"query": "${a.temperature}度"}},
+        {"id": "c", "tool": "weather", "args": {"city": "火星"}},
+        {"id": "d", "tool": "search", "args": {"query": "${c}"}},
+    ), TOOLS, 5)
+
+    async def execute(name, **kwargs):
+        if kwargs.get("city") == "火星":
+            return {"error": "未知城市"}
+        return {"temperature": 20} if name == "weather" else {"results": [kwargs["query"]]}
+
+    executed = {item["node"]["id"]: item for item in asyncio.run(execute_plan(levels, execute))}
+    assert executed["b"]["args"] == {"query": "20度"}
+    assert "已跳过" in executed["d"]["result"]["error"]
+
+def test_run_planned_falls_back_when_execution_fails(monkeypatch):
+    from OpenManus.api_client import GeminiClient
+    from OpenManus.agent.mcp import MCPAgent, Tool
+
+    class FakeGemini(GeminiClient):
+        def __init__(self):
+            pass
+
+        async def chat_completion(self, **kwargs):
+            yield {"text": plan({"id": "a", "tool": "weather", "args": {"city": "北京"}})}
+
+    async def broken(levels, execute_fn):
+        raise RuntimeError("boom")
+
+    agent = MCPAgent(FakeGemini(), model="test-model", plan_and_execute=True)
+    agent.register_tool(Tool("weather", "天气", {"city": {"type": "string"}}))
+    monkeypatch.setattr("OpenManus.agent.mcp.execute_plan", broken)
+    assert asyncio.run(agent._run_planned("北京天气")) is None
@@ -0,0 +1,105 @@
+import asyncio
+
+from OpenManus.scheduler import FairScheduler
+
+async def grant_order(scheduler, requests):
+    """占住唯一的许可，让 requests 全部排队后再放行，返回放行顺序"""
+    order = []
+    holder = await scheduler.acquire("holder", "admin")
+
+    async def run(session_id, priority_class):
+        ticket = await scheduler.acquire(session_id, priority_class)
+        order.append(session_id)
+        ticket.release()
+
+    tasks = [asyncio.create_task(run(session_id, priority_class)) for session_id, priority_class in requests]
+    await asyncio.sleep(0)
+    assert scheduler.queued == len(requests)
+    holder.release()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_flooding_session_does_not_starve_quiet_one():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [("flood", "group")] * 5 + [("quiet", "group")]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order.index("quiet") == 1
+    assert order.count("flood") == 5
+
+def test_weighted_session_gets_larger_share():
+    scheduler = FairScheduler(max_concurrency=1, weights={"heavy": 2})
+    requests = [("heavy", "group")] * 4 + [("light", "group")] * 2
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order == ["heavy", "heavy", "light", "heavy", "heavy", "light"]
+
+def test_strict_priority_between_classes():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [("group-a", "group"), ("group-b", "group"), ("user", "private"), ("boss", "admin")]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order == ["boss", "user", "group-a", "group-b"]
+
+def test_unknown_class_gets_lowest_priority():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [("other", "unknown"), ("user", "private")]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order == ["user", "other"]
+
+def test_concurrency_cap_is_respected():
+    scheduler = FairScheduler(max_concurrency=2)
+    running = []
+    peak = []
+
+    async def run(session_id):
+        ticket = await scheduler.acquire(session_id)
+        running.append(session_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(session_id)
+        ticket.release()
+
+    async def main():
+        await asyncio.gather(*(run(f"s{i % 3}") for i in range(7)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert scheduler.active == 0
+    assert scheduler.stats["granted"] == 7
+
+def test_double_release_is_harmless():
+    scheduler = FairScheduler(max_concurrency=1)
+
+    async def main():
+        ticket = await scheduler.acquire("a")
+        waiters = [asyncio.create_task(scheduler.acquire(session_id)) for session_id in ("b", "c")]
+        await asyncio.sleep(0)
+        ticket.release()
+        ticket.release()
+        await asyncio.sleep(0)
+        # 重复释放不会多放行一个请求
+        assert scheduler.active == 1
+        assert [task.done() for task in waiters] == [True, False]
+        second = waiters[0].result()
+        second.release()
+        third = await waiters[1]
+        third.release()
+        third.release()
+        assert scheduler.active == 0
+
+    asyncio.run(main())
+
+def test_cancelled_waiter_is_skipped():
+    scheduler = FairScheduler(max_concurrency=1)
+
+    async def main():
+        ticket = await scheduler.acquire("a")
+        cancelled = asyncio.create_task(scheduler.acquire("b"))
+        waiting = asyncio.create_task(scheduler.acquire("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        ticket.release()
+        (await waiting).release()
+        assert scheduler.active == 0
+        assert scheduler.stats["cancelled"] == 1
+
+    asyncio.run(main())
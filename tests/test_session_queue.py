@@ -0,0 +1,180 @@
+import asyncio
+
+from OpenManus.session_queue import SessionQueueManager, SUPERSEDE_SAME_USER
+
+def message(sender: str) -> dict:
+    return {"SenderWxid": sender}
+
+class Recorder:
+    """记录每次运行的处理函数；release 之前运行一直阻塞"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.cleaned = asyncio.Event()
+        self.cancelled = []
+
+    async def __call__(self, bot, msg, query, queued_ms=0):
+        self.calls.append((msg["SenderWxid"], query))
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(query)
+            raise
+        finally:
+            self.cleaned.set()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_coalesces_consecutive_messages_from_same_sender():
+    async def main():
+        handler = Recorder()
+        manager = SessionQueueManager(handler, max_queue=10, max_coalesce=3)
+        assert manager.submit("room", None, message("a"), "q1") == 0
+        await handler.started.wait()
+        # 第一条正在处理时排队的消息
+        for sender, query in [("a", "q2"), ("a", "q3"), ("a", "q4"), ("a", "q5"), ("b", "q6"), ("a", "q7")]:
+            manager.submit("room", None, message(sender), query)
+        handler.release.set()
+        while manager.depth("room") or manager.is_busy("room"):
+            await asyncio.sleep(0.01)
+        return handler.calls, manager.stats
+
+    calls, stats = asyncio.run(main())
+    assert [sender for sender, _ in calls] == ["a", "a", "a", "b", "a"]
+    assert calls[0][1] == "q1"
+    assert "1. q2" in calls[1][1] and "3. q4" in calls[1][1] and "q5" not in calls[1][1]
+    assert calls[2][1] == "q5"
+    assert calls[3][1] == "q6"
+    assert stats["coalesced"] == 2 and stats["runs"] == 5
+
+def test_rejects_when_queue_is_full():
+    async def main():
+        handler = Recorder()
+        manager = SessionQueueManager(handler, max_queue=2)
+        manager.submit("room", None, message("a"), "running")
+        await handler.started.wait()
+        positions = [manager.submit("room", None, message("b"), f"q{i}") for i in range(3)]
+        handler.release.set()
+        return positions, manager.stats["rejected"], manager.depth("room")
+
+    positions, rejected, depth = asyncio.run(main())
+    assert positions == [1, 2, None]
+    assert rejected == 1 and depth == 2
+
+def test_idle_sessions_are_reaped():
+    async def main():
+        handler = Recorder()
+        handler.release.set()
+        manager = SessionQueueManager(handler, idle_timeout=0.05)
+        manager.submit("room", None, message("a"), "q")
+        await asyncio.sleep(0.2)
+        metrics = manager.metrics()
+        # 回收后再次提交会重新创建工作协程
+        manager.submit("room", None, message("a"), "again")
+        await asyncio.sleep(0.01)
+        return metrics, handler.calls
+
+    metrics, calls = asyncio.run(main())
+    assert metrics["active_sessions"] == 0 and metrics["reaped"] == 1
+    assert [query for _, query in calls] == ["q", "again"]
+
+def test_cancel_sender_drops_only_that_senders_requests():
+    async def main():
+        handler = Recorder()
+        manager = SessionQueueManager(handler, max_coalesce=1)
+        manager.submit("room", None, message("a"), "a1")
+        await handler.started.wait()
+        manager.submit("room", None, message("b"), "b1")
+        manager.submit("room", None, message("a"), "a2")
+        cancelled = manager.cancel("room", "a")
+        await handler.cleaned.wait()
+        handler.release.set()
+        await settle()
+        return cancelled, handler, manager
+
+    cancelled, handler, manager = asyncio.run(main())
+    assert cancelled == 2
+    assert handler.cancelled == ["a1"]
+    assert [query for _, query in handler.calls] == ["a1", "b1"]
+    assert manager.stats["dropped"] == 1 and manager.stats["cancelled"] == 1
+
+def test_cancel_without_sender_clears_session():
+    async def main():
+        handler = Recorder()
+        manager = SessionQueueManager(handler)
+        manager.submit("room", None, message("a"), "a1")
+        await handler.started.wait()
+        manager.submit("room", None, message("b"), "b1")
+        manager.submit("room", None, message("c"), "c1")
+        cancelled = manager.cancel("room")
+        await settle()
+        return cancelled, handler, manager
+
+    cancelled, handler, manager = asyncio.run(main())
+    assert cancelled == 3
+    assert handler.cancelled == ["a1"]
+    assert manager.depth("room") == 0
+    assert manager.cancel("room") == 0
+    assert manager.cancel("unknown-room", "a") == 0
+
+class SlowCleanup(Recorder):
+    """被取消后清理需要一段时间（如保存录制、释放内核）"""
+
+    async def __call__(self, bot, msg, query, queued_ms=0):
+        try:
+            await super().__call__(bot, msg, query, queued_ms)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.05)
+            raise
+
+def test_supersede_cancels_running_and_queued_requests_of_same_user():
+    async def main():
+        handler = SlowCleanup()
+        manager = SessionQueueManager(handler, max_coalesce=1, supersede=SUPERSEDE_SAME_USER)
+        manager.submit("room", None, message("a"), "a1")
+        await handler.started.wait()
+        manager.submit("room", None, message("b"), "b1")
+        manager.submit("room", None, message("a"), "a2")
+        position = manager.submit("room", None, message("a"), "a3")
+        # 被取消的 a1 还在清理，会话仍然占用
+        busy_during_cleanup = manager.is_busy("room")
+        await asyncio.sleep(0.01)
+        calls_during_cleanup = list(handler.calls)
+        handler.release.set()
+        while manager.depth("room") or manager.is_busy("room"):
+            await asyncio.sleep(0.01)
+        return position, busy_during_cleanup, calls_during_cleanup, handler, manager.stats
+
+    position, busy, calls_during_cleanup, handler, stats = asyncio.run(main())
+    # a1 被取消（清理中），a2 被移除，b1 保留；a3 前面还有 a1 和 b1
+    assert position == 2
+    assert busy
+    assert calls_during_cleanup == [("a", "a1")]
+    assert handler.cancelled == ["a1"]
+    assert [query for _, query in handler.calls] == ["a1", "b1", "a3"]
+    assert stats["superseded"] == 2 and stats["cancelled"] == 1 and stats["dropped"] == 1
+
+def test_cancel_command_counts_a_cancelling_request_once():
+    async def main():
+        handler = SlowCleanup()
+        manager = SessionQueueManager(handler)
+        manager.submit("room", None, message("a"), "a1")
+        await handler.started.wait()
+        manager.submit("room", None, message("b"), "b1")
+        first = manager.cancel("room", "a")
+        second = manager.cancel("room", "a")
+        position = manager.submit("room", None, message("c"), "c1")
+        handler.release.set()
+        while manager.depth("room") or manager.is_busy("room"):
+            await asyncio.sleep(0.01)
+        return first, second, position, handler
+
+    first, second, position, handler = asyncio.run(main())
+    assert (first, second) == (1, 0)
+    assert position == 2
+    assert [query for _, query in handler.calls] == ["a1", "b1", "c1"]
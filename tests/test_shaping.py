@@ -0,0 +1,22 @@
+from OpenManus.agent.shaping import shape_tool_result
+
+CODE_RESULT = {
+    "result": None,
+    "stdout": "done\n",
+    "stderr": "",
+    "images": [{"image_id": "img-1"}],
+    "message": "已生成 1 张图表，回答后会自动发送给用户，回答中不需要描述图片链接",
+    "execution_time_ms": 12,
+}
+
+def test_code_result_keeps_images_and_message():
+    for budget in (0, 800):
+        shaped = shape_tool_result("code", CODE_RESULT, budget)
+        assert shaped["images"] == [{"image_id": "img-1"}]
+        assert shaped["message"] == CODE_RESULT["message"]
+        assert shaped["stdout"] == "done\n"
+        assert "execution_time_ms" not in shaped
+
+def test_code_result_without_images():
+    shaped = shape_tool_result("code", {"stdout": "1"}, 800)
+    assert "images" not in shaped and "message" not in shaped
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from OpenManus.tools.stock_screener import screen, parse_filters, resolve_field
+
+def make_snapshot(rows: int = 200, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    change = rng.normal(0, 3, rows)
+    change[::17] = np.nan
+    return pd.DataFrame({
+        "代码": [f"{600000 + i}" for i in range(rows)],
+        "名称": [f"股票{i}" for i in range(rows)],
+        "最新价": np.round(rng.uniform(2, 200, rows), 2),
+        "涨跌幅": change,
+        "换手率": np.round(rng.uniform(0, 20, rows), 2),
+        "总市值": rng.uniform(1e9, 1e12, rows),
+        "市盈率": rng.uniform(-50, 100, rows),
+    })
+
+def reference(df, column, ascending, limit, mask=None):
+    """完整排序得到的期望结果"""
+    rows = df if mask is None else df[mask]
+    rows = rows[rows[column].notna()]
+    return rows.sort_values(column, ascending=ascending, kind="stable")["代码"].tolist()[:limit]
+
+@pytest.mark.parametrize("ascending", [False, True])
+def test_top_k_matches_full_sort(ascending):
+    df = make_snapshot()
+    rows, matched = screen(df, "change", ascending, 10)
+    assert rows["代码"].tolist() == reference(df, "涨跌幅", ascending, 10)
+    assert matched == df["涨跌幅"].notna().sum()
+
+def test_limit_larger_than_candidates_returns_all_sorted():
+    df = make_snapshot(rows=8)
+    rows, matched = screen(df, "price", False, 50)
+    assert matched == 8
+    assert rows["最新价"].tolist() == sorted(df["最新价"], reverse=True)
+
+def test_missing_values_are_excluded():
+    df = pd.DataFrame({"代码": ["1", "2", "3", "4"], "涨跌幅": [5.0, np.nan, "-", 1.0],
+                       "换手率": [np.nan, 9.0, 9.0, 9.0]})
+    rows, matched = screen(df, "change", False, 10)
+    # 停牌股票的涨跌幅为空或 "-"，不参与排序
+    assert rows["代码"].tolist() == ["1", "4"]
+    assert matched == 2
+    # 筛选字段为空的股票不满足条件
+    rows, matched = screen(df, "change", False, 10, parse_filters("turnover>1"))
+    assert rows["代码"].tolist() == ["4"]
+    assert matched == 1
+
+def test_filters_and_codes_restrict_candidates():
+    df = make_snapshot()
+    conditions = parse_filters("turnover>=5, price<100")
+    codes = df["代码"].iloc[:100].tolist()
+    rows, matched = screen(df, "change", False, 5, conditions, codes)
+    mask = (df["换手率"] >= 5) & (df["最新价"] < 100) & df["代码"].isin(codes)
+    assert rows["代码"].tolist() == reference(df, "涨跌幅", False, 5, mask)
+    assert matched == (mask & df["涨跌幅"].notna()).sum()
+
+def test_parse_filters_units_and_separators():
+    assert parse_filters("market_cap>100亿，amount>=5万; change<-2.5 and pe<=1e2") == [
+        ("market_cap", ">", 1e10), ("amount", ">=", 5e4), ("change", "<", -2.5), ("pe", "<=", 100.0)]
+    assert parse_filters("") == []
+    assert parse_filters(" , ") == []
+
+def test_chinese_column_names_in_filters():
+    df = make_snapshot()
+    conditions = parse_filters("涨跌幅>=1, 总市值>1000亿")
+    assert conditions == [("涨跌幅", ">=", 1.0), ("总市值", ">", 1e11)]
+    rows, _ = screen(df, "换手率", False, 10, conditions)
+    mask = (df["涨跌幅"] >= 1) & (df["总市值"] > 1e11)
+    assert rows["代码"].tolist() == reference(df, "换手率", False, 10, mask)
+
+def test_field_aliases_fall_back_across_markets():
+    df = make_snapshot()
+    # 没有 "市盈率-动态" 列的市场（港股、美股）使用 "市盈率"
+    assert resolve_field(df, "pe") == "市盈率"
+    assert resolve_field(df, "涨跌幅") == "涨跌幅"
+    assert resolve_field(df, "pb") is None
+
+def test_unknown_fields_and_bad_conditions_raise():
+    df = make_snapshot()
+    with pytest.raises(ValueError, match="没有字段: pb"):
+        screen(df, "pb")
+    with pytest.raises(ValueError, match="没有字段: foo"):
+        screen(df, "change", conditions=parse_filters("foo>1"))
+    for text in ("change>>3", "turnover 5", "price>abc"):
+        with pytest.raises(ValueError, match="无法解析筛选条件"):
+            parse_filters(text)
@@ -0,0 +1,158 @@
+import time
+import types
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+from OpenManus.tools import stock_snapshot as snapshot_module
+from OpenManus.tools.stock_snapshot import SnapshotService, market_status, last_close
+
+CST = timezone(timedelta(hours=8))
+EST = timezone(timedelta(hours=-5))
+
+def cst(text: str) -> datetime:
+    return datetime.fromisoformat(text).replace(tzinfo=CST)
+
+class StubService(SnapshotService):
+    """用内存中的行情代替 akshare，记录下载次数"""
+
+    def __init__(self):
+        super().__init__(open_ttl=30, closed_ttl=1800, retry_after=10)
+        self.downloads = 0
+        self.fail = False
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def _download(self, market):
+        self.downloads += 1
+        self.started.set()
+        self.proceed.wait(5)
+        if self.fail:
+            raise ConnectionError("network down")
+        return pd.DataFrame({"代码": ["600519", "000001"], "名称": ["贵州茅台", "平安银行"],
+                             "最新价": [1700.0 + self.downloads, 10.0]})
+
+@pytest.fixture
+def clock(monkeypatch):
+    """把市场时间和快照时间戳固定在指定的北京时间"""
+    state = {}
+
+    def set_time(text: str):
+        state["market_now"] = cst(text)
+        state["now"] = state["market_now"].timestamp()
+
+    monkeypatch.setattr(snapshot_module, "_market_now", lambda market: state["market_now"])
+    monkeypatch.setattr(snapshot_module, "time", types.SimpleNamespace(time=lambda: state["now"]))
+    return set_time
+
+def test_market_status_within_and_between_sessions():
+    assert market_status("A", cst("2024-06-03 10:00")) == (True, 0.0)
+    # 午间休市，距下午开盘1小时
+    assert market_status("A", cst("2024-06-03 12:00")) == (False, 3600.0)
+    # 开盘前
+    assert market_status("A", cst("2024-06-03 09:00")) == (False, 900.0)
+    # 收盘时刻不再属于交易时段，下一次开盘是次日
+    assert market_status("A", cst("2024-06-03 15:00")) == (False, 18.25 * 3600)
+    assert market_status("HK", cst("2024-06-03 16:05")) == (True, 0.0)
+    assert market_status("US", datetime(2024, 6, 3, 15, 59, tzinfo=EST)) == (True, 0.0)
+
+def test_market_status_skips_weekend():
+    # 周五收盘后到周一开盘
+    assert market_status("A", cst("2024-05-31 15:30")) == (False, (2 * 24 + 17.75) * 3600)
+    assert market_status("A", cst("2024-06-01 12:00")) == (False, (24 + 21.25) * 3600)
+
+def test_last_close():
+    assert last_close("A", cst("2024-06-03 15:30")) == cst("2024-06-03 15:00")
+    # 交易时段内和开盘前，最近的收盘是上一个交易日
+    assert last_close("A", cst("2024-06-04 10:00")) == cst("2024-06-03 15:00")
+    # 周末和周一开盘前取周五收盘
+    assert last_close("A", cst("2024-06-02 12:00")) == cst("2024-05-31 15:00")
+    assert last_close("A", cst("2024-06-03 08:00")) == cst("2024-05-31 15:00")
+    assert last_close("HK", cst("2024-06-03 17:00")) == cst("2024-06-03 16:10")
+
+def test_trading_hours_snapshot_expires_quickly(clock):
+    service = StubService()
+    clock("2024-06-03 10:00:00")
+    first = service.get("A")
+    assert first.expires_at - first.fetched_at == 30
+    assert first.row("600519")["名称"] == "贵州茅台"
+
+    clock("2024-06-03 10:00:20")
+    assert service.get("A") is first
+    clock("2024-06-03 10:00:31")
+    assert service.get("A") is not first
+    assert service.downloads == 2
+    assert service.stats["hits"] == 1 and service.stats["fetches"] == 2
+
+def test_closed_market_ttl_is_capped_by_next_open(clock):
+    service = StubService()
+    clock("2024-06-03 15:30")
+    snapshot = service.get("A")
+    assert snapshot.expires_at - snapshot.fetched_at == 1800
+
+    # 距开盘只剩15分钟时，快照在开盘时过期
+    clock("2024-06-04 09:00")
+    snapshot = service.get("A")
+    assert snapshot.expires_at - snapshot.fetched_at == 900
+
+def test_weekend_snapshot_uses_closed_ttl(clock):
+    service = StubService()
+    clock("2024-06-01 12:00")
+    snapshot = service.get("A")
+    assert snapshot.expires_at - snapshot.fetched_at == 1800
+    clock("2024-06-01 12:29")
+    assert service.get("A") is snapshot
+    assert service.downloads == 1
+
+def test_concurrent_requests_share_one_download(clock):
+    service = StubService()
+    clock("2024-06-03 10:00")
+    service.proceed.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.get("A"))) for _ in range(2)]
+    threads[0].start()
+    assert service.started.wait(5)
+    threads[1].start()
+    # 第二个请求在锁上等待第一个请求的下载
+    deadline = time.monotonic() + 5
+    while service.stats["coalesced"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    service.proceed.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert service.downloads == 1
+    assert results[0] is results[1]
+    assert service.stats["coalesced"] == 1
+    assert service.stats["hits"] == 1 and service.stats["fetches"] == 1
+
+def test_failed_refresh_serves_stale_snapshot_then_retries(clock):
+    service = StubService()
+    clock("2024-06-03 10:00:00")
+    first = service.get("A")
+
+    service.fail = True
+    clock("2024-06-03 10:01:00")
+    assert service.get("A") is first
+    assert service.stats["failures"] == 1
+
+    # retry_after 内直接使用旧快照，不再下载
+    clock("2024-06-03 10:01:05")
+    assert service.get("A") is first
+    assert service.downloads == 2 and service.stats["stale"] == 1
+
+    service.fail = False
+    clock("2024-06-03 10:01:11")
+    assert service.get("A") is not first
+    assert service.downloads == 3
+
+def test_unsupported_market_and_failed_first_download(clock):
+    service = StubService()
+    clock("2024-06-03 10:00")
+    assert service.get("JP") is None
+    service.fail = True
+    assert service.get("A") is None
+    assert service.lookup("A", "600519") is None
@@ -0,0 +1,118 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from OpenManus.tools import stock_tool as stock_module
+from OpenManus.tools.stock_tool import StockTool, MAX_COMPARE_CODES
+
+# 市场 -> 代码 -> 名称
+LISTINGS = {
+    "A": {"600519": "贵州茅台", "000858": "五粮液", **{f"60000{i}": f"测试{i}" for i in range(10)},
+          **{f"60001{i}": f"测试1{i}" for i in range(5)}},
+    "HK": {"00700": "腾讯控股", "00005": "汇丰控股"},
+    "US": {"AAPL": "苹果", "BRK.B": "伯克希尔B"},
+}
+
+class StubSnapshots:
+    """代替共享的行情快照，记录按名称查找的市场"""
+
+    def __init__(self):
+        self.finds = []
+
+    def lookup(self, market, code):
+        name = LISTINGS.get(market, {}).get(code)
+        if name is None:
+            return None
+        if name == "汇丰控股":
+            raise ConnectionError("快照行损坏")
+        return {"代码": code, "名称": name, "最新价": 10.0, "涨跌幅": 1.5, "成交量": 1000.0, "成交额": 10000.0,
+                "最高": 10.5, "最低": 9.5, "今开": 9.8, "开盘": 9.8, "昨收": 9.85}
+
+    def find(self, market, name):
+        self.finds.append(market)
+        return next((code for code, listed in LISTINGS.get(market, {}).items() if listed == name), None)
+
+class StubStore:
+    """代替本地日线存储，记录每次读取的股票"""
+
+    def __init__(self):
+        self.requests = []
+
+    def history(self, market, symbol, days):
+        self.requests.append((market, symbol))
+        if symbol not in LISTINGS.get(market, {}):
+            return {}
+        close = np.linspace(10, 12, days)
+        return {"date": np.array([f"2024-06-{day:02d}" for day in range(1, days + 1)]), "open": close,
+                "high": close + 0.5, "low": close - 0.5, "close": close,
+                "volume": np.full(days, 1000.0), "amount": close * 1000}
+
+@pytest.fixture
+def tool(monkeypatch):
+    snapshots, store = StubSnapshots(), StubStore()
+    monkeypatch.setattr(stock_module, "stock_snapshots", snapshots)
+    monkeypatch.setattr(stock_module, "ohlcv_store", store)
+    tool = StockTool()
+    tool.snapshots, tool.store = snapshots, store
+    return tool
+
+def compare(tool, items, market="A", days=20):
+    return asyncio.run(tool._compare_stocks(items, market, days))
+
+def table_codes(result):
+    return [line.split(" | ")[0].lstrip("| ") for line in result["table"].splitlines()[2:]]
+
+@pytest.mark.parametrize("item, expected", [
+    ("HK:700", ("00700", "HK")),
+    ("hk:00700.HK", ("00700", "HK")),
+    ("00700.HK", ("00700", "HK")),
+    ("700", ("00700", "HK")),
+    ("5", ("00005", "HK")),
+    ("sh600519", ("600519", "A")),
+    ("600519", ("600519", "A")),
+    ("BRK.B", ("BRK.B", "US")),
+    ("aapl", ("AAPL", "US")),
+])
+def test_resolve_symbol_infers_market_from_code_format(tool, item, expected):
+    assert tool._resolve_symbol(item, "A") == expected
+    # 可以从格式推断的代码不需要下载快照按名称查找
+    assert tool.snapshots.finds == []
+
+def test_resolve_symbol_keeps_fund_market_for_six_digit_codes(tool):
+    assert tool._resolve_symbol("510300", "ETF") == ("510300", "ETF")
+    assert tool._resolve_symbol("600519", "HK") == ("600519", "A")
+
+def test_resolve_symbol_looks_up_names(tool):
+    assert tool._resolve_symbol("贵州茅台", "A") == ("600519", "A")
+    # 先查默认市场，再依次查其它市场
+    assert tool._resolve_symbol("腾讯控股", "A") == ("00700", "HK")
+    assert tool.snapshots.finds == ["A", "A", "HK"]
+    assert tool._resolve_symbol("苹果", "US") == ("AAPL", "US")
+    assert tool._resolve_symbol("不存在", "A") == (None, "A")
+
+def test_compare_deduplicates_entries_for_the_same_symbol(tool):
+    result = compare(tool, ["00700.HK", "HK:700", "700", "sh600519", "600519", "600519", "贵州茅台"])
+    assert result["count"] == 2
+    assert table_codes(result) == ["00700", "600519"]
+    assert result["errors"] == []
+    assert "| 00700 | 腾讯控股 | HK |" in result["table"]
+
+def test_compare_ignores_codes_beyond_limit(tool):
+    codes = [f"60000{i}" for i in range(10)] + ["600010", "600011"]
+    result = compare(tool, codes)
+    assert result["count"] == MAX_COMPARE_CODES
+    assert result["errors"] == [f"一次最多比较{MAX_COMPARE_CODES}只股票，已忽略: 600010, 600011"]
+    assert ("A", "600010") not in tool.store.requests
+
+def test_compare_reports_errors_per_symbol(tool):
+    result = compare(tool, ["600519", "不存在的股票", "00005", "999999"])
+    # 失败的股票只出现在 errors 中，其它股票照常返回；00005 的快照行损坏但有日线，仍然列出
+    assert table_codes(result) == ["600519", "00005"]
+    assert result["errors"] == ["不存在的股票: 未找到该股票", "999999: 没有行情数据"]
+
+def test_compare_reports_broken_quote_without_history(tool, monkeypatch):
+    monkeypatch.setattr(tool.store, "history", lambda market, symbol, days: {})
+    result = compare(tool, ["00005", "00700"])
+    assert table_codes(result) == ["00700"]
+    assert result["errors"] == ["00005: 快照行损坏"]
@@ -0,0 +1,41 @@
+import json
+import asyncio
+import threading
+
+from OpenManus.agent.tracing import Tracer
+
+def test_jsonl_is_written_off_the_event_loop_in_order(tmp_path, monkeypatch):
+    path = tmp_path / "traces" / "traces.jsonl"
+    tracer = Tracer()
+    tracer.configure(jsonl_path=str(path))
+    writers = []
+    append_line = Tracer._append_line
+
+    def recording_append(path, line):
+        writers.append(threading.current_thread().name)
+        append_line(path, line)
+
+    monkeypatch.setattr(tracer, "_append_line", recording_append)
+
+    async def main():
+        for i in range(5):
+            with tracer.span("request", index=i):
+                with tracer.span("tool.execute", tool="echo"):
+                    await asyncio.sleep(0)
+
+    asyncio.run(main())
+    tracer._writer.shutdown(wait=True)
+
+    traces = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [trace["attributes"]["index"] for trace in traces] == list(range(5))
+    assert [span["name"] for span in traces[0]["spans"]] == ["request", "tool.execute"]
+    assert writers and all(name.startswith("trace-writer") for name in writers)
+
+def test_jsonl_is_written_directly_without_event_loop(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer()
+    tracer.configure(jsonl_path=str(path))
+    with tracer.span("request"):
+        pass
+    assert json.loads(path.read_text(encoding="utf-8"))["name"] == "request"
+    assert tracer._writer is None
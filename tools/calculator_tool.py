@@ -1,3 +1,4 @@
+import ast
 import math
 import re
 from typing import Dict, Any
@@ -5,8 +6,49 @@ from loguru import logger
 
 from ..agent.mcp import Tool
 
+# 结果最多允许的十进制位数；大整数乘方（如 9**9**9）会长时间占用事件循环，计算前拒绝
+MAX_RESULT_DIGITS = 1000
+
+def estimate_digits(expression: str) -> float:
+    """估算表达式结果绝对值的十进制位数上限（不实际计算）
+
+    Args:
+        expression: 数学表达式
+
+    Returns:
+        float: 位数上限；无法解析时返回0，交给 eval 报错
+    """
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, ValueError):
+        return 0.0
+    return _magnitude(tree.body)
+
+def _magnitude(node) -> float:
+    """log10(|值|) 的上限"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return math.log10(max(abs(node.value), 1))
+    if isinstance(node, ast.UnaryOp):
+        return _magnitude(node.operand)
+    if isinstance(node, ast.Call):
+        return max((_magnitude(arg) for arg in node.args), default=0.0)
+    if isinstance(node, ast.BinOp):
+        left = _magnitude(node.left)
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            return max(left, _magnitude(node.right)) + math.log10(2)
+        if isinstance(node.op, ast.Mult):
+            return left + _magnitude(node.right)
+        if isinstance(node.op, ast.Pow):
+            exponent = _magnitude(node.right)
+            if exponent > 6:
+                return math.inf
+            return left * 10 ** exponent
+        return left
+    return 1.0
+
 class CalculatorTool(Tool):
     """计算器工具，用于执行数学计算"""
+    keywords = ("计算", "算", "等于", "乘", "除以", "平方", "开方", "次方", "sqrt", "sin", "cos", "log")
     
     def __init__(self):
         """初始化计算器工具"""
@@ -35,6 +77,11 @@ class CalculatorTool(Tool):
         # 安全检查：去除所有非数学表达式内容
         # 允许数字、小数点、运算符、括号和部分函数名
         sanitized = re.sub(r'[^0-9.+\-*/().sinexpsqrtalogcp ]', '', expression)
+        if estimate_digits(sanitized) > MAX_RESULT_DIGITS:
+            return {
+                "error": f"计算错误: 结果超过 {MAX_RESULT_DIGITS} 位，无法计算",
+                "expression": expression
+            }
         
         try:
             # 定义安全的数学函数
@@ -0,0 +1,178 @@
+import ast
+import json
+import hashlib
+import textwrap
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from loguru import logger
+
+# 结果随时间、随机数、环境或外部资源变化的模块/名称/属性，出现时不缓存结果
+_NONDETERMINISTIC_MODULES = {
+    "random", "time", "datetime", "os", "sys", "socket", "subprocess", "requests", "urllib", "http",
+    "secrets", "uuid", "threading", "multiprocessing", "asyncio", "pathlib", "shutil", "tempfile", "glob",
+}
+_NONDETERMINISTIC_NAMES = _NONDETERMINISTIC_MODULES | {
+    "open", "input", "id", "hash", "globals", "locals", "vars", "exec", "eval", "compile", "__import__",
+    "breakpoint", "set", "frozenset",
+}
+_NONDETERMINISTIC_ATTRIBUTES = {
+    "random", "now", "today", "utcnow", "time", "time_ns", "perf_counter", "monotonic", "process_time",
+    "urandom", "uuid1", "uuid4", "shuffle", "choice", "choices", "sample", "rand", "randn", "randint",
+    "default_rng", "getpid", "environ", "getenv", "open", "fromfile", "tofile", "genfromtxt", "fromregex",
+    "memmap",
+}
+# 文件读写（pd.read_parquet、np.loadtxt、np.savetxt、plt.savefig、df.to_csv 等）按名称前缀识别：
+# 读取的内容可能已被其它任务改写，写入在命中缓存时会被跳过
+_FILE_IO_PREFIXES = ("read_", "load", "save", "to_")
+
+def _nondeterministic_attribute(name: str) -> bool:
+    return name in _NONDETERMINISTIC_ATTRIBUTES or name.startswith(_FILE_IO_PREFIXES)
+# 接受 "now"/"today" 等相对时间字符串的构造函数，如 pd.Timestamp("now")、np.datetime64("today")
+_TIME_PARSERS = {"Timestamp", "datetime64", "to_datetime", "Period", "date_range", "bdate_range", "period_range"}
+_RELATIVE_TIME_STRINGS = {"now", "today", "yesterday", "tomorrow"}
+
+def _reads_clock(node: ast.Call) -> bool:
+    """是否为以相对时间字符串为参数的时间构造调用"""
+    func = node.func
+    name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+    if name not in _TIME_PARSERS:
+        return False
+    values = list(node.args) + [keyword.value for keyword in node.keywords]
+    return any(isinstance(value, ast.Constant) and isinstance(value.value, str)
+               and value.value.strip().lower() in _RELATIVE_TIME_STRINGS for value in values)
+
+def normalize_code(code: str) -> str:
+    """归一化代码：统一换行、去掉行尾空白、公共缩进和首尾空行，语义相同的代码得到相同文本"""
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    return textwrap.dedent("\n".join(lines)).strip("\n")
+
+def code_hash(normalized: str) -> str:
+    """归一化代码的内容哈希"""
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+def is_deterministic(code: str) -> bool:
+    """静态检查代码的输出是否只由代码本身决定
+
+    不使用随机数、时间、环境/文件/网络、异步代码，也不依赖集合的迭代顺序（字符串哈希随进程变化）。
+    子模块（如 numpy.random）按每一级名称检查；无法解析的代码和 import * 视为不确定。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            if any(part in _NONDETERMINISTIC_MODULES for module in modules for part in module.split(".")):
+                return False
+            if isinstance(node, ast.ImportFrom) and any(alias.name == "*" or _nondeterministic_attribute(alias.name)
+                                                        for alias in node.names):
+                return False
+        elif isinstance(node, ast.Name) and node.id in _NONDETERMINISTIC_NAMES:
+            return False
+        elif isinstance(node, ast.Attribute) and _nondeterministic_attribute(node.attr):
+            return False
+        elif isinstance(node, ast.Call) and _reads_clock(node):
+            return False
+        elif isinstance(node, (ast.AsyncFunctionDef, ast.Await, ast.AsyncFor, ast.AsyncWith,
+                               ast.Set, ast.SetComp, ast.Global, ast.Nonlocal)):
+            return False
+    return True
+
+class CodeCache:
+    """代码工具的内容寻址缓存
+
+    以归一化代码的哈希为键：确定性代码片段（静态检查）直接复用之前的 stdout/result，
+    按最近最少使用淘汰；编译缓存位于工作进程中（见 code_sandbox），这里只统计其命中率。
+    """
+
+    def __init__(self, max_entries: int = 256, max_result_chars: int = 100000, enable_results: bool = True):
+        self.configure(max_entries=max_entries, max_result_chars=max_result_chars, enable_results=enable_results)
+        self._results: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # 哈希 -> 是否确定，避免重复解析同一段代码
+        self._verdicts: "OrderedDict[str, bool]" = OrderedDict()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "uncacheable": 0, "stores": 0, "evictions": 0,
+                      "compiles": 0, "compile_hits": 0}
+
+    def configure(self, max_entries: int = 256, max_result_chars: int = 100000, enable_results: bool = True) -> None:
+        """设置缓存参数
+
+        Args:
+            max_entries: 最多缓存的结果数
+            max_result_chars: 结果（JSON序列化后）超过该长度时不缓存
+            enable_results: 是否缓存确定性代码的执行结果
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self.max_result_chars = max_result_chars
+        self.enable_results = enable_results
+
+    def cacheable(self, key: str, normalized: str) -> bool:
+        """代码片段的结果能否缓存"""
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            verdict = is_deterministic(normalized)
+            self._verdicts[key] = verdict
+            while len(self._verdicts) > self.max_entries * 4:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def lookup(self, key: str, normalized: str, max_output: int) -> Optional[Dict[str, Any]]:
+        """查找确定性代码片段的缓存结果
+
+        Returns:
+            Optional[Dict]: 缓存的执行结果；未命中或不可缓存时返回None
+        """
+        if not self.enable_results:
+            return None
+        if not self.cacheable(key, normalized):
+            self.stats["uncacheable"] += 1
+            return None
+        self.stats["lookups"] += 1
+        reply = self._results.get((key, max_output))
+        if reply is None:
+            self.stats["misses"] += 1
+            return None
+        self._results.move_to_end((key, max_output))
+        self.stats["hits"] += 1
+        return dict(reply)
+
+    def store(self, key: str, normalized: str, max_output: int, reply: Dict[str, Any]) -> bool:
+        """缓存成功执行的确定性代码片段的结果"""
+        if not self.enable_results or reply.get("error") or not self.cacheable(key, normalized):
+            return False
+        try:
+            if len(json.dumps(reply.get("result"), ensure_ascii=False)) > self.max_result_chars:
+                return False
+        except (TypeError, ValueError):
+            return False
+        self._results[(key, max_output)] = dict(reply)
+        self._results.move_to_end((key, max_output))
+        self.stats["stores"] += 1
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+            self.stats["evictions"] += 1
+        return True
+
+    def record_compile(self, cached: bool) -> None:
+        """记录工作进程编译缓存是否命中"""
+        self.stats["compiles"] += 1
+        if cached:
+            self.stats["compile_hits"] += 1
+
+    def clear(self) -> None:
+        self._results.clear()
+        self._verdicts.clear()
+        logger.debug("代码结果缓存已清空")
+
+    def metrics(self) -> Dict[str, Any]:
+        """缓存命中率"""
+        return {
+            "entries": len(self._results),
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / max(self.stats["lookups"], 1), 4),
+            "compile_hit_rate": round(self.stats["compile_hits"] / max(self.stats["compiles"], 1), 4),
+        }
+
+# 进程内共享的代码缓存（相同的代码片段常在重试或不同用户之间重复出现）
+code_cache = CodeCache()
@@ -0,0 +1,207 @@
+import time
+import atexit
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable
+
+from loguru import logger
+
+from .code_sandbox import Worker, spawn_worker, wait_reply, error_reply, default_start_method, threadsafe_output
+
+KERNEL_SCOPE_OFF = "off"          # 不使用内核，每次执行都是新的命名空间
+KERNEL_SCOPE_RUN = "run"          # 一次代理运行内共享命名空间
+KERNEL_SCOPE_SESSION = "session"  # 同一会话（群/私聊）的多次运行共享命名空间
+
+class Kernel:
+    """一个会话内核：独占的工作进程和其中保留的命名空间"""
+
+    def __init__(self, key: str, worker: Worker):
+        self.key = key
+        self.worker = worker
+        self.lock = asyncio.Lock()
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.calls = 0
+
+class KernelManager:
+    """按会话保留状态的代码执行内核
+
+    每个内核是一个独立的工作进程，命名空间在多次执行之间保留，代理可以只发送增量代码。
+    空闲超过 idle_timeout 的内核会被回收；内核总数达到上限时回收最久未使用的空闲内核；
+    每个内核的内存有上限。执行超时、被取消或进程崩溃时内核被结束，之前的变量随之丢失。
+    """
+
+    def __init__(self, max_kernels: int = 4, idle_timeout: float = 600, memory_mb: int = 1024,
+                 cpu_seconds: float = 10, start_method: Optional[str] = None, start_timeout: float = 60):
+        self.configure(max_kernels=max_kernels, idle_timeout=idle_timeout, memory_mb=memory_mb,
+                       cpu_seconds=cpu_seconds, start_method=start_method, start_timeout=start_timeout)
+        self._kernels: Dict[str, Kernel] = {}
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.stats = {"calls": 0, "started": 0, "reused": 0, "resets": 0, "evicted_idle": 0,
+                      "evicted_lru": 0, "rejected": 0, "timeouts": 0, "crashes": 0, "cancelled": 0}
+
+    def configure(self, max_kernels: int = 4, idle_timeout: float = 600, memory_mb: int = 1024,
+                  cpu_seconds: float = 10, start_method: Optional[str] = None, start_timeout: float = 60) -> None:
+        """设置内核参数，需在第一次执行前调用
+
+        Args:
+            max_kernels: 同时存在的最大内核数
+            idle_timeout: 内核空闲多少秒后回收
+            memory_mb: 每个内核可使用的内存（MB，相对启动时），<=0 不限制
+            cpu_seconds: 单次执行的CPU时间上限（秒），<=0 不限制
+            start_method: 进程启动方式，默认见 default_start_method
+            start_timeout: 等待新内核完成预导入的最长时间（秒）
+        """
+        self.max_kernels = max(int(max_kernels), 1)
+        self.idle_timeout = idle_timeout
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.start_method = start_method or default_start_method()
+        self.start_timeout = start_timeout
+
+    def _ensure_started(self) -> None:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_kernels + 1, thread_name_prefix="code-kernel")
+
+    async def _reap_loop(self) -> None:
+        while self._kernels:
+            await asyncio.sleep(min(max(self.idle_timeout / 2, 1), 60))
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for key, kernel in list(self._kernels.items()):
+            if not kernel.lock.locked() and now - kernel.last_used > self.idle_timeout:
+                logger.info(f"回收空闲代码内核: {key} (执行 {kernel.calls} 次)")
+                self.release(key)
+                self.stats["evicted_idle"] += 1
+
+    async def _acquire(self, key: str) -> Optional[Kernel]:
+        """取得会话的内核，不存在时启动新内核；数量已满且没有可回收的内核时返回None"""
+        kernel = self._kernels.get(key)
+        if kernel:
+            self.stats["reused"] += 1
+            return kernel
+        self._evict_idle()
+        if len(self._kernels) >= self.max_kernels:
+            idle = [kernel for kernel in self._kernels.values() if not kernel.lock.locked()]
+            if not idle:
+                return None
+            oldest = min(idle, key=lambda kernel: kernel.last_used)
+            logger.info(f"代码内核数已满，回收最久未使用的内核: {oldest.key}")
+            self.release(oldest.key)
+            self.stats["evicted_lru"] += 1
+        loop = asyncio.get_running_loop()
+        worker = await loop.run_in_executor(self._threads, spawn_worker, self.start_method, self.start_timeout,
+                                            2 ** 31, True, self.memory_mb)
+        # 启动期间可能有同一会话的并发调用已经创建了内核
+        if key in self._kernels:
+            worker.kill()
+            return self._kernels[key]
+        kernel = Kernel(key, worker)
+        self._kernels[key] = kernel
+        self.stats["started"] += 1
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+        logger.info(f"启动代码内核: {key} (共 {len(self._kernels)}/{self.max_kernels})")
+        return kernel
+
+    async def run(self, key: str, code: str, timeout: float, max_output: int = 0,
+                  on_output: Optional[Callable[[str, str], Any]] = None, code_hash: Optional[str] = None,
+                  render: bool = False) -> Dict[str, Any]:
+        """在会话内核中执行代码，变量在多次执行之间保留
+
+        Args:
+            key: 内核键（会话ID或单次运行的ID）
+            code: Python代码
+            timeout: 墙钟超时（秒）
+            max_output: stdout/stderr 各保留的字符数（开头和末尾各一半），0 表示使用默认值
+            on_output: 增量输出回调 (流名称, 文本)，可以是协程函数
+            code_hash: 代码的内容哈希，指定时内核进程复用编译结果
+            render: 是否把代码绘制的 matplotlib 图表保存为PNG，通过 "images" 返回
+
+        Returns:
+            Dict: {"result", "stdout", "stderr", "stdout_dropped", "stderr_dropped", "compile_cached",
+                   "images", "error"}
+        """
+        self._ensure_started()
+        self.stats["calls"] += 1
+        while True:
+            kernel = await self._acquire(key)
+            if kernel is None:
+                self.stats["rejected"] += 1
+                return error_reply("代码内核数已满，请稍后再试")
+            async with kernel.lock:
+                # 等待期间内核可能已被结束（超时或回收），重新获取
+                if self._kernels.get(key) is kernel:
+                    return await self._execute(kernel, code, timeout, max_output, on_output, code_hash, render)
+
+    async def _execute(self, kernel: Kernel, code: str, timeout: float, max_output: int,
+                       on_output: Optional[Callable[[str, str], Any]], code_hash: Optional[str],
+                       render: bool) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        job = {"code": code, "cpu_seconds": self.cpu_seconds, "max_output": max_output,
+               "stream": on_output is not None, "code_hash": code_hash, "render": render}
+        try:
+            kernel.worker.conn.send(job)
+            reply = await loop.run_in_executor(self._threads, wait_reply, kernel.worker.conn, timeout,
+                                               threadsafe_output(on_output))
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            self.release(kernel.key)
+            return error_reply(f"代码执行超时 (>{timeout}秒)，内核已重启，之前定义的变量已丢失")
+        except (EOFError, OSError):
+            error = kernel.worker.exit_error(self.cpu_seconds)
+            self.stats["crashes"] += 1
+            self.release(kernel.key)
+            logger.warning(f"代码内核 {kernel.key} {error}")
+            return error_reply(f"{error}，内核已重启，之前定义的变量已丢失")
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            self.release(kernel.key)
+            raise
+        kernel.calls += 1
+        kernel.last_used = time.monotonic()
+        return reply
+
+    async def reset(self, key: str) -> bool:
+        """清空内核的命名空间（保留进程和已导入的模块）
+
+        Returns:
+            bool: 内核是否存在
+        """
+        kernel = self._kernels.get(key)
+        if kernel is None:
+            return False
+        async with kernel.lock:
+            loop = asyncio.get_running_loop()
+            try:
+                kernel.worker.conn.send("reset")
+                await loop.run_in_executor(self._threads, wait_reply, kernel.worker.conn, self.start_timeout)
+            except (TimeoutError, EOFError, OSError):
+                self.release(key)
+            kernel.last_used = time.monotonic()
+        self.stats["resets"] += 1
+        return True
+
+    def release(self, key: str) -> None:
+        """结束内核进程（如单次运行结束、清除记忆时）"""
+        kernel = self._kernels.pop(key, None)
+        if kernel:
+            kernel.worker.kill()
+
+    def metrics(self) -> Dict[str, Any]:
+        """内核指标"""
+        return {"kernels": len(self._kernels), "max_kernels": self.max_kernels, **self.stats}
+
+    def close(self) -> None:
+        """结束所有内核"""
+        for key in list(self._kernels):
+            self.release(key)
+        if self._threads:
+            self._threads.shutdown(wait=False)
+
+# 进程内共享的会话内核管理器
+code_kernels = KernelManager()
+atexit.register(code_kernels.close)
@@ -0,0 +1,279 @@
+import os
+import time
+import runpy
+import signal
+import atexit
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+from loguru import logger
+
+from .sandbox_worker import WORKER_RUN_NAME
+
+# 工作进程的入口文件，按路径运行，工作进程和 forkserver 服务进程都不导入插件包
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+# forkserver 服务进程预先导入的耗时最长的第三方库，工作进程从它 fork 后直接继承；
+# 只导入 matplotlib 而不导入 pyplot，后端在工作进程中设置
+FORKSERVER_PRELOAD = ["numpy", "pandas", "matplotlib"]
+
+class Worker:
+    """父进程持有的工作进程句柄"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        self.conn.close()
+
+    def exit_error(self, cpu_seconds: float) -> str:
+        """进程意外退出（CPU超限被内核结束、崩溃）时的错误说明"""
+        self.process.join(timeout=1)
+        exitcode = self.process.exitcode
+        if exitcode is not None and exitcode == -getattr(signal, "SIGXCPU", 0):
+            return f"代码执行超出CPU时间限制 ({cpu_seconds}秒)"
+        return f"代码执行进程异常退出 (退出码 {exitcode})"
+
+def default_start_method() -> str:
+    """POSIX 上用 forkserver，其它平台用 spawn
+
+    不直接从机器人进程 fork：机器人进程有事件循环和多个线程池，fork 时其它线程持有的锁会
+    留在子进程中导致死锁，预导入（matplotlib 后端等全局设置）也会影响机器人进程。
+    forkserver 是单线程的服务进程，预导入 FORKSERVER_PRELOAD 后由它 fork 出工作进程。
+    """
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def spawn_worker(start_method: str, start_timeout: float, max_jobs: int,
+                 persistent: bool = False, memory_mb: int = 0) -> Worker:
+    """启动一个工作进程并等待其完成预导入（阻塞，应在线程中调用）
+
+    预导入只在工作进程（以及 forkserver 服务进程）中进行，机器人进程不导入这些模块。
+    工作进程用 runpy 按路径运行 WORKER_SCRIPT：若以本模块中的函数为入口，子进程需要按模块名
+    导入它，会先执行插件包的 __init__（导入 main.py、机器人框架并创建插件实例）。
+    """
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        # 服务进程启动后再设置不生效，因此每次设置相同的列表即可
+        context.set_forkserver_preload(FORKSERVER_PRELOAD)
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=runpy.run_path, args=(WORKER_SCRIPT,),
+                              kwargs={"init_globals": {"WORKER_ARGS": (child_conn, max_jobs, persistent, memory_mb)},
+                                      "run_name": WORKER_RUN_NAME},
+                              name="code-sandbox", daemon=True)
+    process.start()
+    child_conn.close()
+    worker = Worker(process, parent_conn)
+    if not parent_conn.poll(start_timeout) or parent_conn.recv() != "ready":
+        worker.kill()
+        raise RuntimeError("代码执行进程启动超时")
+    return worker
+
+def wait_reply(conn, timeout: float, on_output: Optional[Callable[[str, str], None]] = None):
+    """等待工作进程的回复（阻塞），超时抛出 TimeoutError，进程退出时抛出 EOFError
+
+    执行期间收到的增量输出交给 on_output(流名称, 文本)，超时从开始等待时计算。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not conn.poll(remaining):
+            raise TimeoutError()
+        message = conn.recv()
+        if isinstance(message, tuple) and message and message[0] == "output":
+            if on_output:
+                on_output(message[1], message[2])
+            continue
+        return message
+
+def threadsafe_output(callback: Optional[Callable[[str, str], Any]]) -> Optional[Callable[[str, str], None]]:
+    """把增量输出回调包装为可在等待线程中调用的函数，回调在事件循环中执行（可以是协程函数）"""
+    if callback is None:
+        return None
+    loop = asyncio.get_running_loop()
+
+    def dispatch(stream: str, text: str) -> None:
+        try:
+            outcome = callback(stream, text)
+            if asyncio.iscoroutine(outcome):
+                asyncio.ensure_future(outcome)
+        except Exception as e:
+            logger.warning(f"转发代码输出失败: {e}")
+
+    return lambda stream, text: loop.call_soon_threadsafe(dispatch, stream, text)
+
+def error_reply(error: str) -> Dict[str, Any]:
+    return {"result": None, "stdout": "", "stderr": "", "stdout_dropped": 0, "stderr_dropped": 0,
+            "compile_cached": False, "images": [], "error": error}
+
+class SandboxPool:
+    """预启动的代码执行进程池
+
+    每个工作进程预先导入 numpy/pandas/math 等模块，任务在工作进程中执行，
+    不占用事件循环，也不替换主进程的 sys.stdout。每个任务有CPU时间和内存上限；
+    墙钟超时、被取消或进程崩溃时直接结束该进程并补充新进程。
+    """
+
+    def __init__(self, size: int = 2, cpu_seconds: float = 10, memory_mb: int = 512,
+                 max_jobs_per_worker: int = 100, start_method: Optional[str] = None,
+                 start_timeout: float = 60):
+        self.configure(size=size, cpu_seconds=cpu_seconds, memory_mb=memory_mb,
+                       max_jobs_per_worker=max_jobs_per_worker, start_method=start_method,
+                       start_timeout=start_timeout)
+        self._idle: Optional[asyncio.Queue] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._workers: List[Worker] = []
+        self._closed = False
+        self.stats = {"jobs": 0, "errors": 0, "timeouts": 0, "crashes": 0, "cancelled": 0,
+                      "spawned": 0, "recycled": 0, "wait_ms_total": 0.0, "run_ms_total": 0.0}
+
+    def configure(self, size: int = 2, cpu_seconds: float = 10, memory_mb: int = 512,
+                  max_jobs_per_worker: int = 100, start_method: Optional[str] = None,
+                  start_timeout: float = 60) -> None:
+        """设置进程池参数，需在第一次执行前调用
+
+        Args:
+            size: 工作进程数
+            cpu_seconds: 单个任务的CPU时间上限（秒），<=0 不限制
+            memory_mb: 单个任务可额外使用的内存（MB），<=0 不限制
+            max_jobs_per_worker: 每个进程执行多少个任务后替换，防止状态和内存累积
+            start_method: 进程启动方式，默认见 default_start_method
+            start_timeout: 等待新进程完成预导入的最长时间（秒）
+        """
+        self.size = max(int(size), 1)
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_jobs_per_worker = max(int(max_jobs_per_worker), 1)
+        self.start_method = start_method or default_start_method()
+        self.start_timeout = start_timeout
+
+    def _spawn(self) -> Worker:
+        return spawn_worker(self.start_method, self.start_timeout, self.max_jobs_per_worker)
+
+    async def _add_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        delay = 1.0
+        while not self._closed:
+            try:
+                worker = await loop.run_in_executor(self._threads, self._spawn)
+                break
+            except Exception as e:
+                logger.error(f"启动代码执行进程失败: {e}，{delay:.0f}秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        else:
+            return
+        self.stats["spawned"] += 1
+        self._workers.append(worker)
+        self._idle.put_nowait(worker)
+
+    def _replace(self, worker: Worker) -> None:
+        """结束进程并在后台补充新进程"""
+        worker.kill()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if not self._closed:
+            asyncio.create_task(self._add_worker())
+
+    def _ensure_started(self) -> None:
+        if self._idle is None:
+            # 后进先出：优先复用最近使用的进程，其编译缓存更可能命中
+            self._idle = asyncio.LifoQueue()
+            self._threads = ThreadPoolExecutor(max_workers=self.size * 2, thread_name_prefix="code-sandbox")
+            for _ in range(self.size):
+                asyncio.create_task(self._add_worker())
+            logger.info(f"代码执行进程池启动: {self.size} 个进程 ({self.start_method})")
+
+    async def run(self, code: str, timeout: float, max_output: int = 0,
+                  on_output: Optional[Callable[[str, str], Any]] = None, code_hash: Optional[str] = None,
+                  render: bool = False) -> Dict[str, Any]:
+        """在工作进程中执行代码
+
+        Args:
+            code: Python代码
+            timeout: 墙钟超时（秒，不含等待空闲进程的时间）
+            max_output: stdout/stderr 各保留的字符数（开头和末尾各一半），0 表示使用默认值
+            on_output: 增量输出回调 (流名称, 文本)，可以是协程函数
+            code_hash: 代码的内容哈希，指定时工作进程复用编译结果
+            render: 是否把代码绘制的 matplotlib 图表保存为PNG，通过 "images" 返回
+
+        Returns:
+            Dict: {"result", "stdout", "stderr", "stdout_dropped", "stderr_dropped", "compile_cached",
+                   "images", "error"}
+        """
+        if self._closed:
+            raise RuntimeError("代码执行进程池已关闭")
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        queued_at = time.monotonic()
+        worker = await self._idle.get()
+        started_at = time.monotonic()
+        self.stats["wait_ms_total"] += (started_at - queued_at) * 1000
+        self.stats["jobs"] += 1
+        job = {"code": code, "cpu_seconds": self.cpu_seconds, "memory_mb": self.memory_mb,
+               "max_output": max_output, "stream": on_output is not None, "code_hash": code_hash,
+               "render": render}
+        try:
+            worker.conn.send(job)
+            reply = await loop.run_in_executor(self._threads, wait_reply, worker.conn, timeout,
+                                               threadsafe_output(on_output))
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            self._replace(worker)
+            return error_reply(f"代码执行超时 (>{timeout}秒)")
+        except (EOFError, OSError):
+            # 进程被内核结束（CPU超限、内存不足被杀）或崩溃
+            error = worker.exit_error(self.cpu_seconds)
+            self.stats["crashes"] += 1
+            self._replace(worker)
+            logger.warning(f"{error}: {code[:50]}...")
+            return error_reply(error)
+        except asyncio.CancelledError:
+            # 任务仍在进程中运行，无法中断，直接替换进程
+            self.stats["cancelled"] += 1
+            self._replace(worker)
+            raise
+        finally:
+            self.stats["run_ms_total"] += (time.monotonic() - started_at) * 1000
+
+        if reply.get("error"):
+            self.stats["errors"] += 1
+        worker.jobs += 1
+        if worker.jobs >= self.max_jobs_per_worker:
+            self.stats["recycled"] += 1
+            self._replace(worker)
+        else:
+            self._idle.put_nowait(worker)
+        return reply
+
+    def metrics(self) -> Dict[str, Any]:
+        """进程池指标"""
+        jobs = max(self.stats["jobs"], 1)
+        return {
+            "size": self.size,
+            "alive": len(self._workers),
+            "idle": self._idle.qsize() if self._idle else 0,
+            **{key: value for key, value in self.stats.items() if not key.endswith("_total")},
+            "wait_ms_avg": round(self.stats["wait_ms_total"] / jobs, 2),
+            "run_ms_avg": round(self.stats["run_ms_total"] / jobs, 2),
+        }
+
+    def close(self) -> None:
+        """结束所有工作进程"""
+        self._closed = True
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+        if self._threads:
+            self._threads.shutdown(wait=False)
+
+# 进程内共享的代码执行进程池（每个请求都会新建 CodeTool，进程池只有一个）
+sandbox_pool = SandboxPool()
+atexit.register(sandbox_pool.close)
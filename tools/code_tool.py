@@ -1,29 +1,41 @@
-import sys
-import io
-import traceback
-import asyncio
 import textwrap
-import builtins
+import asyncio
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 from loguru import logger
 
 from ..agent.mcp import Tool
+from ..agent.tracing import tracer
+from .code_sandbox import sandbox_pool
+from .code_kernels import code_kernels
+from .code_cache import code_cache, code_hash, normalize_code
+from .image_store import image_store
 
 class CodeTool(Tool):
     """代码工具，用于执行和生成代码"""
+    max_concurrency = 2
+    keywords = ("代码", "python", "编程", "程序", "脚本", "运行", "函数", "执行", "图表", "折线图", "柱状图", "饼图", "可视化")
     
-    def __init__(self, timeout: int = 10, max_output_length: int = 2000, enable_exec: bool = True):
+    def __init__(self, timeout: int = 10, max_output_length: int = 2000, enable_exec: bool = True,
+                 kernel_key: Optional[str] = None, on_output: Optional[Callable[[str, str], Any]] = None):
         """初始化代码工具
         
+        代码在预启动的工作进程中执行（见 code_sandbox），超时会直接结束工作进程。
+        指定 kernel_key 时改为在该键的会话内核中执行（见 code_kernels），变量在多次执行之间保留。
+        
         Args:
             timeout: 代码执行超时时间(秒)
-            max_output_length: 最大输出长度
+            max_output_length: stdout/stderr 各保留的最大长度（超出时保留开头和末尾）
             enable_exec: 是否允许执行代码
+            kernel_key: 会话内核的键，为None时每次执行使用新的命名空间
+            on_output: 增量输出回调 (流名称, 文本)，执行期间收到代码打印的内容
         """
+        description = "执行或生成Python代码；mode=chart 时运行 matplotlib 绘图代码（plt 已导入），生成的图表会直接发送给用户"
+        if kernel_key:
+            description += "。多次执行共享同一个解释器，之前定义的变量和函数可以直接使用，只需发送新增的代码"
         super().__init__(
             name="code",
-            description="执行或生成Python代码",
+            description=description,
             parameters={
                 "code": {
                     "type": "string",
@@ -31,7 +43,8 @@ class CodeTool(Tool):
                 },
                 "mode": {
                     "type": "string",
-                    "description": "执行模式: execute(执行代码) 或 generate(生成代码)",
+                    "description": "执行模式: execute(执行代码)、chart(执行绘图代码并发送图表) 或 generate(生成代码)"
+                                   + ("，reset(清空之前定义的变量)" if kernel_key else ""),
                     "default": "execute"
                 },
                 "description": {
@@ -41,16 +54,20 @@ class CodeTool(Tool):
                 }
             }
         )
-        self.timeout = timeout
+        self.exec_timeout = timeout
+        # 隔离舱超时略长于代码执行超时，由代码自身的超时先生效
+        self.timeout = timeout + 5
         self.max_output_length = max_output_length
         self.enable_exec = enable_exec
+        self.kernel_key = kernel_key
+        self.on_output = on_output
         
     async def execute(self, code: str, mode: str = "execute", description: str = "") -> Dict[str, Any]:
         """执行代码工具
         
         Args:
             code: 要执行的Python代码
-            mode: 执行模式: execute(执行代码) 或 generate(生成代码)
+            mode: 执行模式: execute(执行代码)、chart(执行绘图代码并保存图表)、generate(生成代码) 或 reset(清空会话内核)
             description: 代码的功能描述，用于生成代码时
             
         Returns:
@@ -58,6 +75,10 @@ class CodeTool(Tool):
         """
         if mode == "generate":
             return await self._generate_code(description)
+        elif mode == "reset":
+            if self.kernel_key and await code_kernels.reset(self.kernel_key):
+                return {"message": "已清空之前定义的变量"}
+            return {"message": "当前没有需要清空的变量"}
         else:
             if not self.enable_exec:
                 return {
@@ -67,13 +88,14 @@ class CodeTool(Tool):
                     "stdout": "",
                     "stderr": ""
                 }
-            return await self._execute_code(code)
+            return await self._execute_code(code, render=(mode == "chart"))
     
-    async def _execute_code(self, code: str) -> Dict[str, Any]:
-        """执行Python代码
+    async def _execute_code(self, code: str, render: bool = False) -> Dict[str, Any]:
+        """在代码执行进程池（或会话内核）中执行Python代码
         
         Args:
             code: 要执行的Python代码
+            render: 是否把代码绘制的图表保存为PNG；图片存入 image_store，结果中只返回图片ID
             
         Returns:
             Dict: 执行结果
@@ -81,72 +103,64 @@ class CodeTool(Tool):
         logger.info(f"执行代码: {code[:100]}...")
         
         # 预处理代码，检查是否包含input函数
-        code = self._preprocess_code(code)
-        
-        # 创建输出缓冲区
-        stdout_capture = io.StringIO()
-        stderr_capture = io.StringIO()
-        stdin_simulation = io.StringIO("50\n模拟用户输入\n" * 10)  # 预填充一些模拟输入
-        
-        # 保存原始stdout/stderr/stdin
-        original_stdout = sys.stdout
-        original_stderr = sys.stderr
-        original_stdin = sys.stdin
-        
-        # 重定向输出和输入到缓冲区
-        sys.stdout = stdout_capture
-        sys.stderr = stderr_capture
-        sys.stdin = stdin_simulation
-        
-        result = None
-        error = None
-        
-        try:
-            # 使用asyncio.wait_for实现超时机制
-            code_obj = compile(code, "<string>", "exec")
-            
-            # 创建安全的执行环境
-            safe_globals = self._create_safe_globals()
-            
-            # 创建局部作用域
-            local_vars = {}
-            
-            # 执行代码，带超时控制
-            await asyncio.wait_for(self._run_code(code_obj, safe_globals, local_vars), timeout=self.timeout)
-            
-            # 获取可能的返回值
-            if "result" in local_vars:
-                result = local_vars["result"]
-                
-        except asyncio.TimeoutError:
-            error = f"代码执行超时 (>{self.timeout}秒)"
-            logger.warning(f"代码执行超时: {code[:50]}...")
-        except Exception as e:
-            error = f"执行出错: {str(e)}\n{traceback.format_exc()}"
-            logger.error(f"代码执行错误: {e}")
-        finally:
-            # 恢复原始stdout/stderr/stdin
-            sys.stdout = original_stdout
-            sys.stderr = original_stderr
-            sys.stdin = original_stdin
-        
-        # 获取输出
-        stdout = stdout_capture.getvalue()
-        stderr = stderr_capture.getvalue()
-        
-        # 截断过长的输出
-        if len(stdout) > self.max_output_length:
-            stdout = stdout[:self.max_output_length] + "... (输出已截断)"
-        
-        if len(stderr) > self.max_output_length:
-            stderr = stderr[:self.max_output_length] + "... (输出已截断)"
-        
-        return {
-            "result": result,
-            "stdout": stdout,
-            "stderr": stderr,
-            "error": error
+        code = normalize_code(self._preprocess_code(code))
+        key = code_hash(code)
+        # 绘图结果单独缓存（同一段代码的文本结果和图表结果互不影响）
+        cache_key = f"{key}:chart" if render else key
+        
+        # 确定性代码片段直接复用之前的执行结果（会话内核的结果依赖之前的状态，不复用）
+        execution = None if self.kernel_key else code_cache.lookup(cache_key, code, self.max_output_length)
+        if execution is not None and not all(image_id in image_store for image_id in execution["image_ids"]):
+            # 图片已被淘汰，重新绘制
+            execution = None
+        span = tracer.current_span()
+        if execution is not None:
+            logger.info(f"代码结果缓存命中: {key}")
+            if span is not None:
+                span.set_attributes(code_cache="hit")
+            if self.on_output:
+                await self._replay_output(execution)
+        else:
+            # 输出在工作进程中按开头+末尾截断，内存占用与打印量无关
+            if self.kernel_key:
+                execution = await code_kernels.run(self.kernel_key, code, timeout=self.exec_timeout,
+                                                   max_output=self.max_output_length, on_output=self.on_output,
+                                                   code_hash=key, render=render)
+            else:
+                execution = await sandbox_pool.run(code, timeout=self.exec_timeout,
+                                                   max_output=self.max_output_length, on_output=self.on_output,
+                                                   code_hash=key, render=render)
+            # 图片按内容寻址保存，执行结果中只保留图片ID
+            execution["image_ids"] = [image_store.put(image) for image in execution.pop("images", [])]
+            if not self.kernel_key:
+                code_cache.store(cache_key, code, self.max_output_length, execution)
+            code_cache.record_compile(execution["compile_cached"])
+            if span is not None:
+                span.set_attributes(code_cache="miss", compile_cached=execution["compile_cached"])
+        if execution["error"]:
+            logger.warning(f"代码执行错误: {execution['error'].splitlines()[0]}")
+        if execution["stdout_dropped"] or execution["stderr_dropped"]:
+            logger.info(f"代码输出过长，省略了 stdout {execution['stdout_dropped']} / "
+                        f"stderr {execution['stderr_dropped']} 个字符")
+        
+        result = {
+            "result": execution["result"],
+            "stdout": execution["stdout"],
+            "stderr": execution["stderr"],
+            "error": execution["error"]
         }
+        if execution["image_ids"]:
+            result["images"] = [{"image_id": image_id} for image_id in execution["image_ids"]]
+            result["message"] = f"已生成 {len(execution['image_ids'])} 张图表，回答后会自动发送给用户，回答中不需要描述图片链接"
+        return result
+    
+    async def _replay_output(self, execution: Dict[str, Any]) -> None:
+        """缓存命中时把缓存的输出一次性交给增量输出回调"""
+        for stream in ("stdout", "stderr"):
+            if execution[stream]:
+                outcome = self.on_output(stream, execution[stream])
+                if asyncio.iscoroutine(outcome):
+                    await outcome
     
     def _preprocess_code(self, code: str) -> str:
         """预处理代码，替换input函数等交互操作"""
@@ -162,49 +176,6 @@ class CodeTool(Tool):
         
         return input_pattern.sub(input_replacer, code)
         
-    def _create_safe_globals(self) -> Dict:
-        """创建安全的执行环境，预导入常用模块"""
-        safe_modules = {
-            # 标准库
-            "random": __import__("random"),
-            "math": __import__("math"),
-            "datetime": __import__("datetime"),
-            "time": __import__("time"),
-            "json": __import__("json"),
-            "re": __import__("re"),
-            "os": __import__("os"),
-            "sys": __import__("sys"),
-            "io": __import__("io"),
-            "collections": __import__("collections"),
-            "itertools": __import__("itertools"),
-        }
-        
-        # 创建安全的内置函数
-        safe_builtins = dict(__builtins__)
-        
-        # 模拟input函数
-        def safe_input(prompt=""):
-            print(prompt, end="")
-            return "模拟用户输入"
-            
-        safe_builtins["input"] = safe_input
-        
-        # 合并为全局环境
-        globals_dict = {"__builtins__": safe_builtins}
-        globals_dict.update(safe_modules)
-        
-        return globals_dict
-    
-    async def _run_code(self, code_obj, globals_dict, local_vars):
-        """在事件循环中执行代码对象"""
-        # 这里可以使用exec直接执行
-        # 但要注意安全性，可以添加更多限制
-        exec(code_obj, globals_dict, local_vars)
-        
-        # 支持await异步代码
-        if "main" in local_vars and asyncio.iscoroutinefunction(local_vars["main"]):
-            await local_vars["main"]()
-    
     async def _generate_code(self, description: str) -> Dict[str, Any]:
         """生成Python代码
         
@@ -8,6 +8,7 @@ from ..agent.mcp import Tool
 
 class DateTimeTool(Tool):
     """日期时间工具，用于获取当前日期时间或执行日期计算"""
+    keywords = ("几点", "时间", "日期", "几号", "星期", "周几", "礼拜", "天后", "天前", "倒计时")
     
     def __init__(self):
         """初始化日期时间工具"""
@@ -9,9 +9,13 @@ from typing import Dict, Any, Optional
 from loguru import logger
 
 from ..agent.mcp import Tool
+from .image_store import send_image
 
 class ModelScopeDrawingTool(Tool):
     """使用ModelScope模型生成图像的工具"""
+    # 轮询等待可能持续数分钟，限制并发避免占满请求
+    max_concurrency = 2
+    keywords = ("画", "绘制", "图片", "图像", "插画", "头像", "壁纸", "照片")
 
     def __init__(self, api_base: str = "https://www.modelscope.cn/api/v1/muse/predict",
                  cookies: str = None, csrf_token: str = None, max_wait_time: int = 60):
@@ -244,6 +248,9 @@ class ModelScopeDrawingTool(Tool):
         self.temp_dir = "temp_images"
         os.makedirs(self.temp_dir, exist_ok=True)
 
+        # 隔离舱超时：轮询等待时间再加上提交任务和下载的时间
+        self.timeout = self.max_wait_time + 60
+
     def _update_tool_definition(self):
         """更新工具定义，包含自定义LoRA模型"""
         # 获取所有可用的模型名称，包括预设模型和自定义LoRA模型
@@ -627,26 +634,9 @@ class ModelScopeDrawingTool(Tool):
                     image_data = f.read()
 
                 logger.info(f"准备发送图片，大小: {len(image_data)} 字节")
-                success = False
-                used_method = "unknown"  # 使用新变量避免警告
-
-                # 检查是否有send_image_message方法
-                if hasattr(bot, 'send_image_message'):
-                    used_method = 'send_image_message'
-                    # 直接传递图片数据而非路径
-                    await bot.send_image_message(target_id, image=image_data)
-                    success = True
-                elif hasattr(bot, 'SendImageMessage'):
-                    used_method = 'SendImageMessage'
-                    # 直接传递图片数据而非路径
-                    await bot.SendImageMessage(target_id, image=image_data)
-                    success = True
-
-                # 记录使用的方法
-                if success:
-                    logger.debug(f"使用方法 {used_method} 发送图片成功")
-                else:
-                    logger.error("API不支持发送图片消息")
+                # 直接传递图片数据而非路径
+                success = await send_image(bot, target_id, image_data)
+                if not success:
                     await bot.send_text_message(target_id, f"图片已生成，请访问链接查看: {image_url}")
 
                 # 清理临时文件
@@ -8,6 +8,11 @@ from ..agent.mcp import Tool
 
 class FirecrawlTool(Tool):
     """Firecrawl 工具，用于网站爬取、搜索和数据提取"""
+    # FirecrawlApp 是同步客户端（crawl 会轮询等待），在专属线程池中执行
+    executor = "thread"
+    max_concurrency = 2
+    timeout = 180
+    keywords = ("网页", "网站", "爬取", "抓取", "链接", "http", "url", "页面")
     
     def __init__(self, api_key: Optional[str] = None):
         """初始化 Firecrawl 工具
@@ -103,7 +108,7 @@ class FirecrawlTool(Tool):
                         logger.error(f"JSON 模式解析失败: {extract_schema}")
                         return {"error": "JSON 模式格式不正确"}
                 
-                result = self.client.scrape_url(url, params=params)
+                result = await self.run_blocking(self.client.scrape_url, url, params=params)
                 return {"result": result, "url": url}
             
             elif action == "crawl":
@@ -125,7 +130,7 @@ class FirecrawlTool(Tool):
                         return {"error": "JSON 模式格式不正确"}
                 
                 # 执行爬取
-                result = self.client.crawl_url(url, params=params, poll_interval=10)
+                result = await self.run_blocking(self.client.crawl_url, url, params=params, poll_interval=10)
                 return {"result": result, "url": url}
             
             elif action == "search":
@@ -147,7 +152,7 @@ class FirecrawlTool(Tool):
                         return {"error": "JSON 模式格式不正确"}
                 
                 # 执行搜索
-                result = self.client.search(params)
+                result = await self.run_blocking(self.client.search, params)
                 return {"result": result, "query": query}
             
             else:
@@ -0,0 +1,89 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from loguru import logger
+
+class ImageStore:
+    """内容寻址的图片缓存
+
+    以图片内容的哈希作为ID，相同的图片只保存一份。工具结果中只返回图片ID（按引用传递），
+    图片数据留在进程内，由插件在回复用户时取出发送。超出容量时按最近最少使用淘汰。
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 32 * 1024 * 1024):
+        """初始化
+
+        Args:
+            max_entries: 最多保存的图片数
+            max_bytes: 图片总大小上限（字节）
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self.stats = {"puts": 0, "duplicates": 0, "gets": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def image_id(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()[:16]
+
+    def put(self, data: bytes) -> str:
+        """保存图片
+
+        Returns:
+            str: 图片ID
+        """
+        image_id = self.image_id(data)
+        self.stats["puts"] += 1
+        if image_id in self._images:
+            self.stats["duplicates"] += 1
+            self._images.move_to_end(image_id)
+            return image_id
+        self._images[image_id] = data
+        self._bytes += len(data)
+        while len(self._images) > 1 and (len(self._images) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.stats["evictions"] += 1
+        return image_id
+
+    def get(self, image_id: str) -> Optional[bytes]:
+        """取出图片，不存在（或已淘汰）时返回None"""
+        self.stats["gets"] += 1
+        data = self._images.get(image_id)
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+        self._images.move_to_end(image_id)
+        return data
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self._images
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"entries": len(self._images), "bytes": self._bytes, **self.stats}
+
+async def send_image(bot, target_id: str, image_data: bytes) -> bool:
+    """通过微信发送图片数据，兼容不同版本的客户端方法名
+
+    Args:
+        bot: WechatAPIClient实例
+        target_id: 目标ID（群ID或用户ID）
+        image_data: 图片内容
+
+    Returns:
+        bool: 客户端是否支持发送图片
+    """
+    if hasattr(bot, 'send_image_message'):
+        await bot.send_image_message(target_id, image=image_data)
+    elif hasattr(bot, 'SendImageMessage'):
+        await bot.SendImageMessage(target_id, image=image_data)
+    else:
+        logger.error("API不支持发送图片消息")
+        return False
+    logger.info(f"已发送图片到: {target_id} ({len(image_data)} 字节)")
+    return True
+
+# 进程内共享的图片缓存
+image_store = ImageStore()
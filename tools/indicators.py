@@ -0,0 +1,237 @@
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+try:
+    from scipy.signal import lfilter
+except ImportError:  # scipy不可用时按时间逐步递推（仍对所有股票同时计算）
+    lfilter = None
+
+# 所有指标函数的输入为一维 (天数,) 或二维 (股票数, 天数) 数组，沿最后一维（时间）计算，
+# 返回与输入形状相同的数组。数据不足一个周期的位置填充0，与原先按列表计算的结果一致。
+
+def _as_array(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+def _recurrence(values: np.ndarray, alpha: float, seed: np.ndarray) -> np.ndarray:
+    """y[t] = (1 - alpha) * y[t-1] + alpha * x[t]，y[-1] = seed；二维输入每行独立"""
+    decay = 1.0 - alpha
+    if values.shape[-1] == 0:
+        return values.copy()
+    if lfilter is not None:
+        output, _ = lfilter([alpha], [1.0, -decay], values, axis=-1, zi=(decay * seed)[..., None])
+        return output
+    output = np.empty_like(values)
+    previous = seed
+    for t in range(values.shape[-1]):
+        previous = decay * previous + alpha * values[..., t]
+        output[..., t] = previous
+    return output
+
+def sma(values, window: int) -> np.ndarray:
+    """简单移动平均（累加和相减，O(n)）
+
+    Args:
+        values: 价格数组
+        window: 窗口大小
+
+    Returns:
+        np.ndarray: 移动平均，前 window-1 个位置为0
+    """
+    data = _as_array(values)
+    result = np.zeros_like(data)
+    length = data.shape[-1]
+    if window <= 0 or length < window:
+        return result
+    cumsum = np.cumsum(data, axis=-1)
+    result[..., window - 1] = cumsum[..., window - 1]
+    result[..., window:] = cumsum[..., window:] - cumsum[..., :-window]
+    result[..., window - 1:] /= window
+    return result
+
+def ema(values, period: int) -> np.ndarray:
+    """指数移动平均，以前 period 个值的均值作为起点，乘数 2/(period+1)
+
+    Returns:
+        np.ndarray: EMA，前 period-1 个位置为0
+    """
+    data = _as_array(values)
+    result = np.zeros_like(data)
+    if period <= 0 or data.shape[-1] < period:
+        return result
+    seed = data[..., :period].mean(axis=-1)
+    result[..., period - 1] = seed
+    result[..., period:] = _recurrence(data[..., period:], 2.0 / (period + 1), seed)
+    return result
+
+def rsi(values, period: int = 14) -> np.ndarray:
+    """相对强弱指标（Wilder平滑）
+
+    Returns:
+        np.ndarray: RSI，前 period 个位置为0；平均跌幅为0时为100
+    """
+    data = _as_array(values)
+    result = np.zeros_like(data)
+    if period <= 0 or data.shape[-1] <= period:
+        return result
+    deltas = np.diff(data, axis=-1)
+    gains = np.where(deltas > 0, deltas, 0.0)
+    losses = np.where(deltas < 0, -deltas, 0.0)
+    alpha = 1.0 / period
+    avg_gain = np.concatenate([gains[..., :period].mean(axis=-1)[..., None],
+                               _recurrence(gains[..., period:], alpha, gains[..., :period].mean(axis=-1))], axis=-1)
+    avg_loss = np.concatenate([losses[..., :period].mean(axis=-1)[..., None],
+                               _recurrence(losses[..., period:], alpha, losses[..., :period].mean(axis=-1))], axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values_rsi = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+    result[..., period:] = values_rsi
+    return result
+
+def macd(values, fast_period: int = 12, slow_period: int = 26,
+         signal_period: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MACD指标
+
+    Returns:
+        Tuple: (MACD线, 信号线, 柱状图)；数据不超过慢线周期时全为0
+    """
+    data = _as_array(values)
+    if data.shape[-1] <= slow_period:
+        zeros = np.zeros_like(data)
+        return zeros, zeros.copy(), zeros.copy()
+    macd_line = ema(data, fast_period) - ema(data, slow_period)
+    signal_line = ema(macd_line, signal_period)
+    return macd_line, signal_line, macd_line - signal_line
+
+def bollinger(values, window: int = 20, num_std: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """布林带（总体标准差，按累加和/平方累加和计算）
+
+    Returns:
+        Tuple: (上轨, 中轨, 下轨)，前 window-1 个位置为0
+    """
+    data = _as_array(values)
+    middle = sma(data, window)
+    if window <= 0 or data.shape[-1] < window:
+        return middle.copy(), middle, middle.copy()
+    # 先减去每行均值，减小平方累加和的舍入误差
+    centered = data - data.mean(axis=-1, keepdims=True)
+    mean = sma(centered, window)
+    variance = np.maximum(sma(centered * centered, window) - mean * mean, 0.0)
+    std = np.sqrt(variance)
+    std[..., :window - 1] = 0.0
+    upper = middle + num_std * std
+    lower = middle - num_std * std
+    upper[..., :window - 1] = 0.0
+    lower[..., :window - 1] = 0.0
+    return upper, middle, lower
+
+def _rolling(values: np.ndarray, window: int, reducer) -> np.ndarray:
+    """滚动最大/最小值，开头不足一个窗口时使用已有的数据"""
+    padding = [(0, 0)] * (values.ndim - 1) + [(window - 1, 0)]
+    padded = np.pad(values, padding, mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=-1)
+    return reducer(windows, axis=-1)
+
+def kdj(high, low, close, period: int = 9, k_period: int = 3,
+        d_period: int = 3) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """随机指标KDJ，K、D以50为初值按 1/k_period、1/d_period 平滑
+
+    Returns:
+        Tuple: (K, D, J)
+    """
+    high, low, close = _as_array(high), _as_array(low), _as_array(close)
+    if close.shape[-1] == 0:
+        return close.copy(), close.copy(), close.copy()
+    lowest = _rolling(low, period, np.min)
+    highest = _rolling(high, period, np.max)
+    spread = highest - lowest
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsv = np.where(spread > 0, (close - lowest) / spread * 100.0, 50.0)
+    seed = np.full(close.shape[:-1], 50.0)
+    k = _recurrence(rsv, 1.0 / k_period, seed)
+    d = _recurrence(k, 1.0 / d_period, seed)
+    return k, d, 3.0 * k - 2.0 * d
+
+def trend(price: float, sma5: float, sma10: float, sma20: float) -> str:
+    """根据收盘价与5/10/20日均线的关系判断趋势"""
+    short_up = price > sma5
+    mid_up = sma5 > sma10
+    long_up = sma10 > sma20
+    if short_up and mid_up and long_up:
+        return "强势上涨"
+    if not short_up and not mid_up and not long_up:
+        return "强势下跌"
+    if short_up and mid_up:
+        return "中短期上涨"
+    if not short_up and not mid_up:
+        return "中短期下跌"
+    return "短期反弹" if short_up else "短期调整"
+
+def summarize(close, high=None, low=None) -> List[Dict[str, Any]]:
+    """一次计算多只股票的全部指标，返回每只股票的最新值
+
+    Args:
+        close: 收盘价，形状 (天数,) 或 (股票数, 天数)，各股票天数相同
+        high: 最高价，与 close 形状相同；缺少最高/最低价时不计算KDJ
+        low: 最低价
+
+    Returns:
+        List[Dict]: 每只股票一个指标字典
+    """
+    close = np.atleast_2d(_as_array(close))
+    length = close.shape[-1]
+    if length == 0:
+        return [{} for _ in range(close.shape[0])]
+    sma5, sma10, sma20 = sma(close, 5), sma(close, 10), sma(close, 20)
+    rsi14 = rsi(close, 14)
+    macd_line, signal_line, histogram = macd(close)
+    upper, middle, lower = bollinger(close, 20)
+    kdj_values = None
+    if high is not None and low is not None:
+        kdj_values = kdj(np.atleast_2d(_as_array(high)), np.atleast_2d(_as_array(low)), close)
+
+    summaries = []
+    for row in range(close.shape[0]):
+        summary = {
+            "current_price": float(close[row, -1]),
+            "sma5": float(sma5[row, -1]),
+            "sma10": float(sma10[row, -1]),
+            "sma20": float(sma20[row, -1]),
+            "rsi": float(rsi14[row, -1]),
+            "macd": float(macd_line[row, -1]),
+            "macd_signal": float(signal_line[row, -1]),
+            "macd_histogram": float(histogram[row, -1]),
+            "boll_upper": float(upper[row, -1]),
+            "boll_middle": float(middle[row, -1]),
+            "boll_lower": float(lower[row, -1]),
+        }
+        if kdj_values is not None:
+            summary.update({"kdj_k": float(kdj_values[0][row, -1]), "kdj_d": float(kdj_values[1][row, -1]),
+                            "kdj_j": float(kdj_values[2][row, -1])})
+        summary["trend"] = (trend(summary["current_price"], summary["sma5"], summary["sma10"], summary["sma20"])
+                            if length >= 20 else "无法确定")
+        summaries.append(summary)
+    return summaries
+
+def summarize_batch(series: Sequence[Dict[str, np.ndarray]]) -> List[Dict[str, Any]]:
+    """对天数不同的多只股票计算指标：按 (天数, 是否有最高/最低价) 分组，每组一次二维计算
+
+    Args:
+        series: 每只股票的列数组（close，可选 high/low）
+
+    Returns:
+        List[Dict]: 与输入顺序一致的指标字典，没有收盘价的股票为空字典
+    """
+    results: List[Optional[Dict[str, Any]]] = [{} for _ in series]
+    groups: Dict[Tuple[int, bool], List[int]] = {}
+    for position, columns in enumerate(series):
+        close = columns.get("close")
+        if close is None or len(close) == 0:
+            continue
+        has_range = "high" in columns and "low" in columns
+        groups.setdefault((len(close), has_range), []).append(position)
+    for (_, has_range), positions in groups.items():
+        close = np.stack([series[position]["close"] for position in positions])
+        high = np.stack([series[position]["high"] for position in positions]) if has_range else None
+        low = np.stack([series[position]["low"] for position in positions]) if has_range else None
+        for position, summary in zip(positions, summarize(close, high, low)):
+            results[position] = summary
+    return results
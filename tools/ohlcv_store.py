@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .stock_snapshot import last_close
+
+# 市场 -> akshare 日线行情接口（东方财富）
+HIST_FUNCTIONS = {"A": "stock_zh_a_hist", "HK": "stock_hk_hist", "US": "stock_us_hist"}
+
+# 列名 -> 磁盘上的定长类型；每列一个文件，按日期递增顺序追加
+COLUMNS = {
+    "date": "<M8[D]",
+    "open": "<f8",
+    "high": "<f8",
+    "low": "<f8",
+    "close": "<f8",
+    "volume": "<f8",
+    "amount": "<f8",
+}
+SOURCE_COLUMNS = {"日期": "date", "开盘": "open", "最高": "high", "最低": "low", "收盘": "close",
+                  "成交量": "volume", "成交额": "amount"}
+
+# 复权价格在除权后会整体变化：增量更新时重叠的最后一天收盘价不一致则重新下载全部
+ADJUST_TOLERANCE = 1e-6
+
+def _calendar_days(trading_days: int) -> int:
+    """覆盖指定交易日数所需的自然日数（含周末和节假日的余量）"""
+    return int(trading_days * 1.5) + 15
+
+class OHLCVStore:
+    """按股票保存在本地的日线行情列式存储
+
+    每只股票一个目录，开高低收量额和日期各一个定长二进制列文件，另有 meta.json 记录行数、
+    复权方式和最后一次同步时间。读取时对列文件做内存映射，只取末尾 days 行；
+    同步时只下载最后一个已保存交易日之后的数据并追加到列文件末尾，行数超过 history_days 的
+    两倍时重写列文件，丢弃查询窗口之前的交易日。
+    最近一次收盘之后同步过的数据视为最新，此时读取不访问网络。
+    """
+
+    def __init__(self, root: str = "stock_data", history_days: int = 60, adjust: str = "qfq",
+                 retry_after: float = 60):
+        self.configure(root=root, history_days=history_days, adjust=adjust, retry_after=retry_after)
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._failed_at: Dict[Tuple[str, str], float] = {}
+        self._locks_guard = threading.Lock()
+        self.stats = {"requests": 0, "local": 0, "incremental": 0, "full": 0, "rows_appended": 0,
+                      "rows_trimmed": 0, "adjust_resets": 0, "failures": 0, "stale": 0, "sync_ms_total": 0.0}
+
+    def configure(self, root: str = "stock_data", history_days: int = 60, adjust: str = "qfq",
+                  retry_after: float = 60) -> None:
+        """设置存储参数
+
+        Args:
+            root: 数据目录
+            history_days: 保存的交易日数（首次下载至少这么多，增量追加到两倍后删除更早的数据）
+            adjust: 复权方式："qfq" 前复权，"hfq" 后复权，"" 不复权
+            retry_after: 更新失败后多少秒内不再重试，继续使用本地数据
+        """
+        self.root = root
+        self.history_days = max(int(history_days), 1)
+        self.adjust = adjust
+        self.retry_after = retry_after
+
+    def _lock(self, market: str, symbol: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault((market, symbol), threading.Lock())
+
+    def _path(self, market: str, symbol: str) -> str:
+        return os.path.join(self.root, market, symbol.replace("/", "_"))
+
+    def _read_meta(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("adjust") != self.adjust:
+            return None
+        # 列文件短于记录的行数（例如写入时进程退出）时视为损坏，重新下载
+        for column, dtype in COLUMNS.items():
+            try:
+                size = os.path.getsize(os.path.join(path, f"{column}.bin"))
+            except OSError:
+                return None
+            if size < meta.get("rows", 0) * np.dtype(dtype).itemsize:
+                return None
+        return meta
+
+    def _write_meta(self, path: str, meta: Dict[str, Any]) -> None:
+        temp_path = os.path.join(path, "meta.json.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(path, "meta.json"))
+
+    def _read_columns(self, path: str, rows: int, days: int) -> Dict[str, np.ndarray]:
+        """内存映射列文件，复制末尾 days 行"""
+        start = max(rows - days, 0)
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            if rows == 0:
+                columns[column] = np.empty(0, dtype=dtype)
+                continue
+            mapped = np.memmap(os.path.join(path, f"{column}.bin"), dtype=dtype, mode="r", shape=(rows,))
+            columns[column] = np.array(mapped[start:rows])
+            del mapped
+        return columns
+
+    def _append(self, path: str, meta: Dict[str, Any], frame: Dict[str, np.ndarray]) -> None:
+        """截断到已确认的行数后追加新行，最后更新 meta.json"""
+        rows = meta.get("rows", 0)
+        for column, dtype in COLUMNS.items():
+            with open(os.path.join(path, f"{column}.bin"), "r+b" if rows else "wb") as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(frame[column], dtype=dtype).tobytes())
+        meta["rows"] = rows + len(frame["date"])
+
+    def _trim(self, path: str, meta: Dict[str, Any], start: datetime) -> None:
+        """重写列文件，只保留 start 及之后的交易日"""
+        columns = self._read_columns(path, meta["rows"], meta["rows"])
+        keep = columns["date"] >= np.datetime64(start.date(), "D")
+        if keep.all():
+            return
+        meta.update(rows=0, start=start.strftime("%Y-%m-%d"))
+        # 与全量下载相同：先写入 rows=0 使旧数据失效，再重写列文件
+        self._write_meta(path, meta)
+        self._append(path, meta, {column: values[keep] for column, values in columns.items()})
+        self.stats["rows_trimmed"] += int((~keep).sum())
+
+    @staticmethod
+    def _normalize(df, through: datetime) -> Dict[str, np.ndarray]:
+        """akshare 日线 DataFrame -> 列数组，只保留已收盘的交易日"""
+        import pandas as pd
+
+        frame = {}
+        for source, column in SOURCE_COLUMNS.items():
+            if source not in df.columns:
+                frame[column] = np.full(len(df), np.nan)
+            elif column == "date":
+                frame[column] = pd.to_datetime(df[source]).values.astype("datetime64[D]")
+            else:
+                frame[column] = pd.to_numeric(df[source], errors="coerce").to_numpy(dtype=np.float64)
+        if frame["date"].dtype != np.dtype("datetime64[D]"):
+            frame["date"] = frame["date"].astype("datetime64[D]")
+        order = np.argsort(frame["date"], kind="stable")
+        keep = frame["date"][order] <= np.datetime64(through.date(), "D")
+        return {column: values[order][keep] for column, values in frame.items()}
+
+    def _download(self, market: str, symbol: str, start: datetime, end: datetime):
+        import akshare as ak
+        return getattr(ak, HIST_FUNCTIONS[market])(symbol=symbol, period="daily",
+                                                   start_date=start.strftime("%Y%m%d"),
+                                                   end_date=end.strftime("%Y%m%d"), adjust=self.adjust)
+
+    def _sync(self, market: str, symbol: str, path: str, meta: Optional[Dict[str, Any]],
+              closed_at: datetime, start: datetime) -> Dict[str, Any]:
+        """下载缺少的交易日并写入，返回新的 meta"""
+        last_date = None
+        if meta and meta.get("rows") and meta.get("start", "") <= start.strftime("%Y-%m-%d"):
+            last_date = self._read_columns(path, meta["rows"], 1)
+        if last_date is not None:
+            # 从最后一个已保存的交易日开始下载，重叠一天用于检查复权价格是否变化
+            stored_date, stored_close = last_date["date"][-1], last_date["close"][-1]
+            since = stored_date.astype("datetime64[s]").astype(datetime)
+            frame = self._normalize(self._download(market, symbol, since, closed_at), closed_at)
+            overlap = frame["date"] == stored_date
+            if overlap.any() and not np.isclose(frame["close"][overlap][-1], stored_close,
+                                                rtol=ADJUST_TOLERANCE, equal_nan=True):
+                logger.info(f"{market}:{symbol} 复权价格已变化，重新下载历史行情")
+                self.stats["adjust_resets"] += 1
+                return self._sync(market, symbol, path, None, closed_at, start)
+            newer = frame["date"] > stored_date
+            frame = {column: values[newer] for column, values in frame.items()}
+            self._append(path, meta, frame)
+            self.stats["incremental"] += 1
+            # 只追加不删除时文件会无限增长；超过两倍后一次性丢弃窗口之前的数据，重写的开销被均摊
+            if meta["rows"] > 2 * self.history_days:
+                self._trim(path, meta, start)
+        else:
+            frame = self._normalize(self._download(market, symbol, start, closed_at), closed_at)
+            os.makedirs(path, exist_ok=True)
+            meta = {"market": market, "symbol": symbol, "adjust": self.adjust, "rows": 0,
+                    "start": start.strftime("%Y-%m-%d")}
+            # 先写入 rows=0 使旧数据失效，再重写列文件
+            self._write_meta(path, meta)
+            self._append(path, meta, frame)
+            self.stats["full"] += 1
+        self.stats["rows_appended"] += len(frame["date"])
+        meta["synced_at"] = time.time()
+        self._write_meta(path, meta)
+        return meta
+
+    def history(self, market: str, symbol: str, days: int) -> Optional[Dict[str, np.ndarray]]:
+        """读取最近 days 个交易日的日线行情（阻塞，在工具线程池中调用）
+
+        Args:
+            market: 市场类型 A/HK/US
+            symbol: akshare 日线接口使用的代码（美股为 "105.AAPL" 形式）
+            days: 交易日数
+
+        Returns:
+            Optional[Dict[str, np.ndarray]]: 列 -> 数组（见 COLUMNS，date 为 "YYYY-MM-DD" 字符串）；
+            不支持的市场或下载失败且本地没有数据时返回None
+        """
+        if market not in HIST_FUNCTIONS:
+            return None
+        self.stats["requests"] += 1
+        days = max(int(days), 1)
+        path = self._path(market, symbol)
+        closed_at = last_close(market)
+        start = closed_at - timedelta(days=_calendar_days(max(days, self.history_days)))
+
+        with self._lock(market, symbol):
+            meta = self._read_meta(path)
+            fresh = (meta is not None and meta.get("synced_at", 0) >= closed_at.timestamp()
+                     and meta.get("start", "") <= start.strftime("%Y-%m-%d"))
+            retry_wait = time.time() - self._failed_at.get((market, symbol), 0) < self.retry_after
+            if fresh:
+                self.stats["local"] += 1
+            elif retry_wait and meta is not None and meta.get("rows"):
+                self.stats["stale"] += 1
+            else:
+                started = time.time()
+                try:
+                    meta = self._sync(market, symbol, path, meta, closed_at, start)
+                except ImportError:
+                    raise
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    self._failed_at[(market, symbol)] = time.time()
+                    if meta is None or not meta.get("rows"):
+                        logger.warning(f"下载{market}:{symbol}历史行情失败: {e}")
+                        return None
+                    self.stats["stale"] += 1
+                    logger.warning(f"更新{market}:{symbol}历史行情失败，使用本地数据: {e}")
+                self.stats["sync_ms_total"] += (time.time() - started) * 1000
+            columns = self._read_columns(path, meta["rows"], days)
+
+        columns["date"] = np.datetime_as_string(columns["date"], unit="D")
+        return columns
+
+    def metrics(self) -> Dict[str, Any]:
+        """存储指标"""
+        syncs = self.stats["incremental"] + self.stats["full"]
+        return {
+            **{key: value for key, value in self.stats.items() if not key.endswith("_total")},
+            "local_rate": round(self.stats["local"] / max(self.stats["requests"], 1), 4),
+            "sync_ms_avg": round(self.stats["sync_ms_total"] / max(syncs, 1), 2),
+        }
+
+# 进程内共享的日线行情存储
+ohlcv_store = OHLCVStore()
@@ -0,0 +1,318 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import builtins
+import traceback
+import importlib
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable
+
+try:
+    import resource
+except ImportError:  # Windows 没有 rlimit，只保留墙钟超时
+    resource = None
+
+# 代码执行工作进程的入口。本文件由 code_sandbox 按路径用 runpy 运行，不经过插件包导入，
+# 因此只能使用标准库和预导入的第三方库，不能使用相对导入（否则工作进程和 forkserver
+# 服务进程会执行插件包的 __init__，连带导入机器人框架并创建插件实例）。
+
+# runpy 运行本文件时使用的模块名，参数通过 WORKER_ARGS 全局变量传入
+WORKER_RUN_NAME = "__sandbox_worker__"
+
+# 工作进程启动时预导入的模块，任务中可直接使用（名称 -> 模块）
+PRELOAD_MODULES = {
+    "random": "random", "math": "math", "datetime": "datetime", "time": "time", "json": "json",
+    "re": "re", "os": "os", "sys": "sys", "io": "io", "collections": "collections",
+    "itertools": "itertools", "np": "numpy", "pd": "pandas", "plt": "matplotlib.pyplot",
+}
+# 图表中文字体候选，按顺序使用第一个可用的
+CJK_FONTS = ["SimHei", "Microsoft YaHei", "WenQuanYi Micro Hei", "Noto Sans CJK SC", "PingFang SC",
+             "Arial Unicode MS", "DejaVu Sans"]
+# 每次执行最多输出的图表数和单张图表的最大字节数
+MAX_FIGURES = 4
+MAX_FIGURE_BYTES = 5 * 1024 * 1024
+# 未指定时每个输出流保留的字符数
+DEFAULT_MAX_OUTPUT = 20000
+# 每个工作进程缓存的编译结果数
+COMPILE_CACHE_SIZE = 128
+# 代码读取标准输入时得到的模拟输入
+SIMULATED_STDIN = "50\n模拟用户输入\n" * 10
+
+def _import_preloads() -> Dict[str, Any]:
+    modules = {}
+    for alias, name in PRELOAD_MODULES.items():
+        try:
+            if name == "matplotlib.pyplot":
+                _configure_matplotlib()
+            modules[alias] = importlib.import_module(name)
+        except ImportError:
+            pass
+    return modules
+
+def _configure_matplotlib() -> None:
+    """使用无界面的 Agg 后端渲染，并设置中文字体"""
+    import matplotlib
+    matplotlib.use("Agg")
+    matplotlib.rcParams["font.sans-serif"] = CJK_FONTS
+    matplotlib.rcParams["axes.unicode_minus"] = False
+
+def _capture_figures(modules: Dict[str, Any], dpi: int) -> List[bytes]:
+    """把打开的 matplotlib 图表保存为PNG并关闭"""
+    plt = modules.get("plt")
+    if plt is None:
+        raise RuntimeError("未安装matplotlib，无法绘制图表")
+    images = []
+    for number in plt.get_fignums()[:MAX_FIGURES]:
+        buffer = io.BytesIO()
+        # 去掉版本信息元数据，相同的图表得到相同的字节（图片缓存按内容寻址）
+        plt.figure(number).savefig(buffer, format="png", dpi=dpi, bbox_inches="tight", metadata={"Software": None})
+        if buffer.tell() <= MAX_FIGURE_BYTES:
+            images.append(buffer.getvalue())
+    return images
+
+def _address_space_bytes() -> int:
+    """当前进程的虚拟内存大小，无法获取时返回0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _set_soft_limit(kind: int, soft: int) -> None:
+    _, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(kind, (soft, hard))
+
+def _apply_limits(cpu_seconds: float, memory_mb: int) -> None:
+    """为本次任务设置CPU时间和内存上限
+
+    CPU上限按本进程已用时间累加，超出时内核发送 SIGXCPU 结束进程；
+    内存上限为当前虚拟内存加上 memory_mb，超出时分配失败抛出 MemoryError。
+    """
+    if resource is None:
+        return
+    if cpu_seconds > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _set_soft_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1)
+    if memory_mb > 0:
+        _set_soft_limit(resource.RLIMIT_AS, _address_space_bytes() + memory_mb * 1024 * 1024)
+
+def _portable(value: Any) -> Any:
+    """把结果转换为可跨进程传递的JSON兼容值，其它对象使用repr"""
+    if hasattr(value, "tolist") and not isinstance(value, (str, bytes)):
+        try:
+            value = value.tolist()
+        except Exception:
+            pass
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return repr(value)
+
+def _safe_input(prompt=""):
+    print(prompt, end="")
+    return "模拟用户输入"
+
+def new_namespace(modules: Dict[str, Any]) -> Dict[str, Any]:
+    """创建执行代码的全局命名空间：预导入的模块和替换了 input 的内置函数"""
+    safe_builtins = dict(builtins.__dict__)
+    safe_builtins["input"] = _safe_input
+    return {"__builtins__": safe_builtins, "__name__": "__sandbox__", **modules}
+
+class BoundedCapture(io.TextIOBase):
+    """内存占用固定的输出捕获流
+
+    只保留开头 head_chars 个字符和末尾 tail_chars 个字符（环形缓冲），中间的输出丢弃并计数，
+    无论代码打印多少内容，占用的内存都不超过 head_chars + tail_chars。
+    可选的 on_write 回调会收到开头部分的增量输出，用于边执行边转发。
+    """
+
+    def __init__(self, head_chars: int, tail_chars: int, on_write: Optional[Callable[[str], None]] = None):
+        """初始化
+
+        Args:
+            head_chars: 保留的开头字符数
+            tail_chars: 保留的末尾字符数
+            on_write: 增量输出回调，只转发开头 head_chars 个字符
+        """
+        self.head_chars = max(int(head_chars), 0)
+        self.tail_chars = max(int(tail_chars), 0)
+        self.on_write = on_write
+        self._head: List[str] = []
+        self._head_len = 0
+        self._tail = ""
+        self.total = 0
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        length = len(text)
+        self.total += length
+        if self._head_len < self.head_chars:
+            head = text[:self.head_chars - self._head_len]
+            self._head.append(head)
+            self._head_len += len(head)
+            text = text[len(head):]
+            if self.on_write and head:
+                self.on_write(head)
+        if text and self.tail_chars:
+            if len(text) >= self.tail_chars:
+                self._tail = text[-self.tail_chars:]
+            else:
+                self._tail = (self._tail + text)[-self.tail_chars:]
+        return length
+
+    @property
+    def dropped(self) -> int:
+        """丢弃的字符数"""
+        return self.total - self._head_len - len(self._tail)
+
+    def getvalue(self) -> str:
+        """开头 + 省略说明 + 末尾"""
+        head = "".join(self._head)
+        if self.dropped:
+            return f"{head}\n... (省略 {self.dropped} 个字符) ...\n{self._tail}"
+        return head + self._tail
+
+class _OutputStreamer:
+    """把工作进程中的增量输出分批发送给父进程，避免每次 print 都写管道"""
+
+    def __init__(self, conn, stream: str, interval: float = 0.2, batch_chars: int = 1024):
+        self.conn = conn
+        self.stream = stream
+        self.interval = interval
+        self.batch_chars = batch_chars
+        self._pending: List[str] = []
+        self._pending_len = 0
+        self._last_flush = time.monotonic()
+
+    def __call__(self, text: str) -> None:
+        self._pending.append(text)
+        self._pending_len += len(text)
+        if self._pending_len >= self.batch_chars or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self.conn.send(("output", self.stream, "".join(self._pending)))
+            self._pending.clear()
+            self._pending_len = 0
+        self._last_flush = time.monotonic()
+
+# 工作进程内的编译缓存：代码哈希 -> 代码对象
+_compiled: "OrderedDict[str, Any]" = OrderedDict()
+
+def _compile(code: str, key: Optional[str]):
+    """编译代码，指定哈希时复用本进程之前编译的代码对象
+
+    Returns:
+        Tuple: (代码对象, 是否命中缓存)
+    """
+    if key and key in _compiled:
+        _compiled.move_to_end(key)
+        return _compiled[key], True
+    code_obj = compile(code, "<string>", "exec")
+    if key:
+        _compiled[key] = code_obj
+        while len(_compiled) > COMPILE_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return code_obj, False
+
+def _run_job(job: Dict[str, Any], namespace: Dict[str, Any], modules: Dict[str, Any], conn=None) -> Dict[str, Any]:
+    """在工作进程中执行一段代码，输出捕获到本进程自己的固定大小缓冲区
+
+    job["max_output"] 为每个流保留的字符数（开头和末尾各一半），job["stream"] 为真时
+    通过 conn 边执行边发送增量输出，job["render"] 为真时把代码绘制的图表保存为PNG返回。
+    """
+    limit = job.get("max_output", 0) or DEFAULT_MAX_OUTPUT
+    streamers = {}
+    if job.get("stream") and conn is not None:
+        streamers = {name: _OutputStreamer(conn, name) for name in ("stdout", "stderr")}
+    stdout_capture = BoundedCapture(limit - limit // 2, limit // 2, streamers.get("stdout"))
+    stderr_capture = BoundedCapture(limit - limit // 2, limit // 2, streamers.get("stderr"))
+    sys.stdout, sys.stderr = stdout_capture, stderr_capture
+    sys.stdin = io.StringIO(SIMULATED_STDIN)
+    result = None
+    error = None
+    compile_cached = False
+    images = []
+    try:
+        _apply_limits(job.get("cpu_seconds", 0), job.get("memory_mb", 0))
+        code_obj, compile_cached = _compile(job["code"], job.get("code_hash"))
+        exec(code_obj, namespace)
+        # 支持异步代码：定义了 async def main() 时运行它
+        main = namespace.get("main")
+        if asyncio.iscoroutinefunction(main):
+            asyncio.run(main())
+        # 取出 result，持久命名空间中下一次执行不会重复返回
+        if "result" in namespace:
+            result = _portable(namespace.pop("result"))
+        if job.get("render"):
+            images = _capture_figures(modules, job.get("dpi", 100))
+            if not images:
+                error = "代码没有绘制任何图表，请使用 matplotlib（plt）绘图"
+    except MemoryError:
+        error = "代码执行超出内存限制"
+    except BaseException as e:
+        error = f"执行出错: {str(e)}\n{traceback.format_exc()}"
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        if "plt" in modules:
+            modules["plt"].close("all")
+    for streamer in streamers.values():
+        streamer.flush()
+    return {
+        "result": result,
+        "stdout": stdout_capture.getvalue(),
+        "stderr": stderr_capture.getvalue(),
+        "stdout_dropped": stdout_capture.dropped,
+        "stderr_dropped": stderr_capture.dropped,
+        "compile_cached": compile_cached,
+        "images": images,
+        "error": error,
+    }
+
+def worker_main(conn, max_jobs: int, persistent: bool = False, memory_mb: int = 0) -> None:
+    """工作进程主循环：预导入模块后逐个执行父进程发来的任务
+
+    Args:
+        conn: 与父进程通信的管道
+        max_jobs: 执行多少个任务后退出
+        persistent: 是否在任务之间保留命名空间（会话内核），收到 "reset" 时清空
+        memory_mb: 整个进程的内存上限（相对启动时），用于命名空间会累积的内核
+    """
+    modules = _import_preloads()
+    if memory_mb > 0:
+        _apply_limits(0, memory_mb)
+    namespace = new_namespace(modules)
+    conn.send("ready")
+    for _ in range(max_jobs):
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        if job == "reset":
+            namespace = new_namespace(modules)
+            conn.send("ok")
+            continue
+        if not persistent:
+            namespace = new_namespace(modules)
+        conn.send(_run_job(job, namespace, modules, conn))
+
+if __name__ == WORKER_RUN_NAME:
+    # WORKER_ARGS 由 spawn_worker 通过 runpy 的 init_globals 传入
+    worker_main(*WORKER_ARGS)
@@ -7,6 +7,9 @@ from ..agent.mcp import Tool
 
 class SearchTool(Tool):
     """搜索工具，用于执行网络搜索"""
+    max_concurrency = 8
+    timeout = 20
+    keywords = ("搜索", "搜", "百度", "谷歌", "新闻", "最新", "是谁", "百科", "资料", "消息")
     
     def __init__(self, api_key: Optional[str] = None, 
                 search_url: str = "https://api.bing.microsoft.com/v7.0/search",
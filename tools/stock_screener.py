@@ -0,0 +1,190 @@
+import re
+import time
+import operator
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+from loguru import logger
+
+# 筛选/排序字段 -> 各市场快照中可能的列名（A股、港股、美股的列名不完全相同）
+SCREEN_FIELDS = {
+    "change": ("涨跌幅",),
+    "price": ("最新价",),
+    "turnover": ("换手率",),
+    "volume": ("成交量",),
+    "amount": ("成交额",),
+    "amplitude": ("振幅",),
+    "volume_ratio": ("量比",),
+    "market_cap": ("总市值",),
+    "float_cap": ("流通市值",),
+    "pe": ("市盈率-动态", "市盈率"),
+    "pb": ("市净率",),
+    "change_60d": ("60日涨跌幅",),
+    "change_ytd": ("年初至今涨跌幅",),
+}
+
+_OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+              "=": operator.eq, "==": operator.eq}
+_UNITS = {"": 1.0, "万": 1e4, "亿": 1e8}
+# 条件形如 "turnover>5"、"涨跌幅>=3"、"market_cap>100亿"
+_FILTER_PATTERN = re.compile(r"^\s*([\w\-]+)\s*(>=|<=|==|>|<|=)\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\s*(万|亿)?\s*$")
+
+# 板块类型 -> (板块列表接口, 成分股接口)，先匹配行业板块再匹配概念板块
+BOARD_FUNCTIONS = {
+    "industry": ("stock_board_industry_name_em", "stock_board_industry_cons_em"),
+    "concept": ("stock_board_concept_name_em", "stock_board_concept_cons_em"),
+}
+
+def resolve_field(df, field: str) -> Optional[str]:
+    """把字段名（英文别名或中文列名）解析为快照中的列名，不存在时返回None"""
+    if field in df.columns:
+        return field
+    return next((column for column in SCREEN_FIELDS.get(field, ()) if column in df.columns), None)
+
+def parse_filters(text: str) -> List[Tuple[str, str, float]]:
+    """解析筛选条件
+
+    Args:
+        text: 逗号分隔的条件，如 "change>3, turnover>=5, market_cap>100亿"
+
+    Returns:
+        List[Tuple[str, str, float]]: (字段, 运算符, 数值)
+
+    Raises:
+        ValueError: 条件格式不正确
+    """
+    conditions = []
+    for part in re.split(r"[,，;；、]|\s+and\s+", text or ""):
+        if not part.strip():
+            continue
+        match = _FILTER_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"无法解析筛选条件: {part.strip()}")
+        field, op, value, unit = match.groups()
+        conditions.append((field, op, float(value) * _UNITS[unit or ""]))
+    return conditions
+
+def screen(df, sort_by: str = "change", ascending: bool = False, limit: int = 10,
+           conditions: Optional[List[Tuple[str, str, float]]] = None, codes=None):
+    """在全市场快照上向量化筛选并取排序前 limit 只
+
+    Args:
+        df: 全市场行情快照
+        sort_by: 排序字段
+        ascending: 是否升序（取最小的 limit 只）
+        limit: 返回数量
+        conditions: 筛选条件（见 parse_filters）
+        codes: 只在这些代码中筛选（如板块成分股），None 表示全市场
+
+    Returns:
+        Tuple[DataFrame, int]: (排好序的结果行, 满足条件的股票总数)
+
+    Raises:
+        ValueError: 字段在该市场的快照中不存在
+    """
+    import pandas as pd
+
+    def numeric(field: str) -> np.ndarray:
+        column = resolve_field(df, field)
+        if column is None:
+            raise ValueError(f"该市场的行情数据中没有字段: {field}")
+        return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+
+    values = numeric(sort_by)
+    # 停牌等没有数据的股票不参与排序
+    mask = ~np.isnan(values)
+    if codes is not None:
+        mask &= df["代码"].astype(str).isin(codes).to_numpy()
+    for field, op, threshold in conditions or []:
+        with np.errstate(invalid="ignore"):
+            mask &= _OPERATORS[op](numeric(field), threshold)
+
+    candidates = np.flatnonzero(mask)
+    limit = max(int(limit), 1)
+    keys = values[candidates] if ascending else -values[candidates]
+    if len(candidates) > limit:
+        # 只对前 limit 名排序
+        partition = np.argpartition(keys, limit - 1)[:limit]
+        candidates, keys = candidates[partition], keys[partition]
+    order = candidates[np.argsort(keys, kind="stable")]
+    return df.iloc[order], int(mask.sum())
+
+class SectorIndex:
+    """A股板块（行业/概念）名称到成分股代码的缓存
+
+    成分股变化很慢，按 ttl 缓存；板块名称先精确匹配，再匹配包含关键字的最短板块名。
+    """
+
+    def __init__(self, ttl: float = 21600):
+        self.ttl = ttl
+        self._boards: Dict[str, Tuple[float, List[str]]] = {}
+        self._members: Dict[Tuple[str, str], Tuple[float, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "board_fetches": 0, "member_fetches": 0, "failures": 0}
+
+    def configure(self, ttl: float = 21600) -> None:
+        """设置成分股缓存有效期（秒）"""
+        self.ttl = ttl
+
+    def _board_names(self, ak, kind: str) -> List[str]:
+        cached = self._boards.get(kind)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[1]
+        df = getattr(ak, BOARD_FUNCTIONS[kind][0])()
+        names = df["板块名称"].astype(str).tolist()
+        self._boards[kind] = (time.time(), names)
+        self.stats["board_fetches"] += 1
+        return names
+
+    def _resolve(self, ak, sector: str) -> Optional[Tuple[str, str]]:
+        boards = {kind: self._board_names(ak, kind) for kind in BOARD_FUNCTIONS}
+        for kind, names in boards.items():
+            if sector in names:
+                return kind, sector
+        for kind, names in boards.items():
+            matched = [name for name in names if sector in name]
+            if matched:
+                return kind, min(matched, key=len)
+        return None
+
+    def members(self, sector: str) -> Optional[Tuple[str, np.ndarray]]:
+        """取得板块的成分股代码（阻塞，在工具线程池中调用）
+
+        Args:
+            sector: 板块名称或关键字，如 "半导体"
+
+        Returns:
+            Optional[Tuple[str, np.ndarray]]: (匹配到的板块名称, 成分股代码)；找不到板块时返回None
+
+        Raises:
+            ImportError: 未安装akshare
+            Exception: 下载板块列表或成分股失败
+        """
+        import akshare as ak
+
+        self.stats["lookups"] += 1
+        with self._lock:
+            try:
+                resolved = self._resolve(ak, sector)
+                if resolved is None:
+                    return None
+                cached = self._members.get(resolved)
+                if cached and time.time() - cached[0] < self.ttl:
+                    return resolved[1], cached[1]
+                df = getattr(ak, BOARD_FUNCTIONS[resolved[0]][1])(symbol=resolved[1])
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.warning(f"获取板块 {sector} 成分股失败: {e}")
+                raise
+            codes = df["代码"].astype(str).to_numpy()
+            self._members[resolved] = (time.time(), codes)
+            self.stats["member_fetches"] += 1
+            logger.info(f"板块 {resolved[1]} 成分股已更新: {len(codes)} 只")
+            return resolved[1], codes
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"boards": len(self._members), **self.stats}
+
+# 进程内共享的板块成分股缓存
+sector_index = SectorIndex()
@@ -0,0 +1,235 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, List, Tuple
+
+from loguru import logger
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+# 市场 -> akshare 全市场实时行情接口
+SPOT_FUNCTIONS = {"A": "stock_zh_a_spot_em", "HK": "stock_hk_spot_em", "US": "stock_us_spot_em"}
+
+# 市场 -> (时区, 时区不可用时的固定UTC偏移小时, 交易时段列表[(开始, 结束)])
+# 节假日按交易日处理，只会使缓存有效期变短，不影响正确性
+TRADING_SESSIONS = {
+    "A": ("Asia/Shanghai", 8, [((9, 15), (11, 30)), ((13, 0), (15, 0))]),
+    "HK": ("Asia/Hong_Kong", 8, [((9, 30), (12, 0)), ((13, 0), (16, 10))]),
+    "US": ("America/New_York", -5, [((9, 30), (16, 0))]),
+}
+
+def _market_now(market: str) -> datetime:
+    """市场所在时区的当前时间"""
+    zone_name, fallback_offset, _ = TRADING_SESSIONS[market]
+    tz = None
+    if ZoneInfo is not None:
+        try:
+            tz = ZoneInfo(zone_name)
+        except Exception:  # Windows 未安装 tzdata
+            tz = None
+    return datetime.now(tz or timezone(timedelta(hours=fallback_offset)))
+
+def _session_bounds(market: str, day: datetime) -> List[Tuple[datetime, datetime]]:
+    _, _, sessions = TRADING_SESSIONS[market]
+    return [(day.replace(hour=start[0], minute=start[1], second=0, microsecond=0),
+             day.replace(hour=end[0], minute=end[1], second=0, microsecond=0))
+            for start, end in sessions]
+
+def market_status(market: str, now: Optional[datetime] = None) -> Tuple[bool, float]:
+    """判断市场是否在交易时段
+
+    Args:
+        market: 市场类型 A/HK/US
+        now: 市场时区的当前时间，默认取当前时间
+
+    Returns:
+        Tuple[bool, float]: (是否交易中, 距下一次开盘的秒数；交易中为0)
+    """
+    now = now or _market_now(market)
+    for offset in range(8):
+        day = now + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for start, end in _session_bounds(market, day):
+            if offset == 0 and start <= now < end:
+                return True, 0.0
+            if start > now:
+                return False, (start - now).total_seconds()
+    return False, 86400.0
+
+def last_close(market: str, now: Optional[datetime] = None) -> datetime:
+    """最近一个已收盘交易日的收盘时间（市场时区），此前的日线数据不会再变化"""
+    now = now or _market_now(market)
+    for offset in range(8):
+        day = now - timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        close = _session_bounds(market, day)[-1][1]
+        if close <= now:
+            return close
+    return now
+
+class MarketSnapshot:
+    """一个市场的全市场行情快照，带 代码 -> 行号 索引"""
+
+    def __init__(self, market: str, df, fetched_at: float):
+        self.market = market
+        self.df = df
+        self.fetched_at = fetched_at
+        self.expires_at = fetched_at
+        codes = df["代码"].astype(str).tolist() if "代码" in df.columns else []
+        self.index: Dict[str, int] = {code: position for position, code in enumerate(codes)}
+        if market == "US":
+            # 美股代码形如 "105.AAPL"，同时按 "AAPL" 索引
+            for position, code in enumerate(codes):
+                self.index.setdefault(code.split(".", 1)[-1], position)
+
+    def row(self, code: str) -> Optional[Dict[str, Any]]:
+        """按代码取一行行情，不存在时返回None"""
+        position = self.index.get(str(code))
+        if position is None:
+            return None
+        return self.df.iloc[position].to_dict()
+
+    def find(self, name: str) -> Optional[str]:
+        """按名称查找代码：先精确匹配，再取名称包含关键字的第一只"""
+        if "名称" not in self.df.columns or "代码" not in self.df.columns:
+            return None
+        names = self.df["名称"].astype(str)
+        matched = self.df.loc[names == name, "代码"]
+        if matched.empty:
+            matched = self.df.loc[names.str.contains(name, regex=False), "代码"]
+        return str(matched.iloc[0]) if not matched.empty else None
+
+class SnapshotService:
+    """进程级的全市场行情快照缓存
+
+    每个市场的快照在有效期内共享：交易时段内有效期短（行情在变化），收盘后有效期长
+    （但不超过下一次开盘）。同一市场同时只有一个线程下载，其它并发请求等待并复用结果；
+    下载失败时在短时间内继续使用旧快照，避免反复请求。
+    """
+
+    def __init__(self, open_ttl: float = 30, closed_ttl: float = 1800, retry_after: float = 10):
+        self.configure(open_ttl=open_ttl, closed_ttl=closed_ttl, retry_after=retry_after)
+        self._snapshots: Dict[str, MarketSnapshot] = {}
+        self._locks = {market: threading.Lock() for market in SPOT_FUNCTIONS}
+        self._failed_at: Dict[str, float] = {}
+        self.stats = {"requests": 0, "hits": 0, "fetches": 0, "coalesced": 0, "failures": 0, "stale": 0,
+                      "fetch_ms_total": 0.0}
+
+    def configure(self, open_ttl: float = 30, closed_ttl: float = 1800, retry_after: float = 10) -> None:
+        """设置快照有效期
+
+        Args:
+            open_ttl: 交易时段内快照的有效期（秒）
+            closed_ttl: 非交易时段快照的有效期（秒），不超过距下一次开盘的时间
+            retry_after: 下载失败后多少秒内不再重试，继续使用旧快照
+        """
+        self.open_ttl = open_ttl
+        self.closed_ttl = closed_ttl
+        self.retry_after = retry_after
+
+    def ttl(self, market: str) -> float:
+        """当前时刻新快照的有效期"""
+        trading, until_open = market_status(market)
+        if trading:
+            return self.open_ttl
+        return max(min(self.closed_ttl, until_open), self.open_ttl)
+
+    def _fresh(self, market: str) -> Optional[MarketSnapshot]:
+        snapshot = self._snapshots.get(market)
+        if snapshot and time.time() < snapshot.expires_at:
+            return snapshot
+        return None
+
+    def get(self, market: str) -> Optional[MarketSnapshot]:
+        """取得市场快照（阻塞，在工具线程池中调用）
+
+        Args:
+            market: 市场类型 A/HK/US
+
+        Returns:
+            Optional[MarketSnapshot]: 快照；不支持的市场或下载失败且没有旧快照时返回None
+        """
+        if market not in SPOT_FUNCTIONS:
+            return None
+        self.stats["requests"] += 1
+        snapshot = self._fresh(market)
+        if snapshot:
+            self.stats["hits"] += 1
+            return snapshot
+
+        lock = self._locks[market]
+        if not lock.acquire(blocking=False):
+            # 其它线程正在下载，等待其完成后复用
+            self.stats["coalesced"] += 1
+            lock.acquire()
+        try:
+            snapshot = self._fresh(market)
+            if snapshot:
+                # 等待期间其它线程已下载了新快照
+                self.stats["hits"] += 1
+                return snapshot
+            stale = self._snapshots.get(market)
+            if stale and time.time() - self._failed_at.get(market, 0) < self.retry_after:
+                self.stats["stale"] += 1
+                return stale
+            return self._refresh(market) or stale
+        finally:
+            lock.release()
+
+    def _download(self, market: str):
+        import akshare as ak
+        return getattr(ak, SPOT_FUNCTIONS[market])()
+
+    def _refresh(self, market: str) -> Optional[MarketSnapshot]:
+        started = time.time()
+        try:
+            df = self._download(market)
+        except ImportError:
+            raise
+        except Exception as e:
+            self.stats["failures"] += 1
+            self._failed_at[market] = time.time()
+            logger.warning(f"下载{market}市场行情快照失败: {e}")
+            return None
+        snapshot = MarketSnapshot(market, df, time.time())
+        snapshot.expires_at = snapshot.fetched_at + self.ttl(market)
+        self._snapshots[market] = snapshot
+        elapsed_ms = (time.time() - started) * 1000
+        self.stats["fetches"] += 1
+        self.stats["fetch_ms_total"] += elapsed_ms
+        logger.info(f"{market}市场行情快照已更新: {len(df)} 行, 耗时 {elapsed_ms:.0f}ms, "
+                    f"有效期 {snapshot.expires_at - snapshot.fetched_at:.0f}秒")
+        return snapshot
+
+    def lookup(self, market: str, code: str) -> Optional[Dict[str, Any]]:
+        """按代码查询一只股票的实时行情
+
+        Returns:
+            Optional[Dict]: 行情行（列名 -> 值）；快照不可用或代码不存在时返回None
+        """
+        snapshot = self.get(market)
+        return snapshot.row(code) if snapshot else None
+
+    def find(self, market: str, name: str) -> Optional[str]:
+        """按股票名称查找代码，快照不可用或找不到时返回None"""
+        snapshot = self.get(market)
+        return snapshot.find(name) if snapshot else None
+
+    def metrics(self) -> Dict[str, Any]:
+        """快照缓存指标"""
+        now = time.time()
+        return {
+            "snapshots": {market: {"rows": len(snapshot.index), "age_s": round(now - snapshot.fetched_at, 1),
+                                   "ttl_left_s": round(max(snapshot.expires_at - now, 0), 1)}
+                          for market, snapshot in self._snapshots.items()},
+            **{key: value for key, value in self.stats.items() if not key.endswith("_total")},
+            "fetch_ms_avg": round(self.stats["fetch_ms_total"] / max(self.stats["fetches"], 1), 2),
+        }
+
+# 进程内共享的行情快照（每个请求都会新建 StockTool，快照只下载一次）
+stock_snapshots = SnapshotService()
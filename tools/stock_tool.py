@@ -1,27 +1,61 @@
+import re
+import time
 import asyncio
+import threading
 import numpy as np
 import pandas as pd
-from typing import Dict, Any, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
 from loguru import logger
 
 from ..agent.mcp import Tool
+from .stock_snapshot import stock_snapshots, SPOT_FUNCTIONS
+from .stock_screener import sector_index, screen, parse_filters, resolve_field, SCREEN_FIELDS
+from .indicators import summarize_batch
+from .ohlcv_store import ohlcv_store
+
+# 一次比较的最大股票数
+MAX_COMPARE_CODES = 10
+# 选股一次返回的最大股票数
+MAX_SCREEN_LIMIT = 50
+
+# 多股票比较时并行下载行情的专属线程池（进程内共享，首次使用时创建）
+_fetch_pool: Optional[ThreadPoolExecutor] = None
+_fetch_pool_lock = threading.Lock()
+
+def _fetch_executor(workers: int) -> ThreadPoolExecutor:
+    global _fetch_pool
+    with _fetch_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="stock-fetch")
+    return _fetch_pool
 
 class StockTool(Tool):
     """股票工具，用于获取股票信息"""
+    # akshare是同步库，在专属线程池中执行，避免占满默认执行器
+    executor = "thread"
+    max_concurrency = 2
+    timeout = 60
+    keywords = ("股票", "股价", "行情", "a股", "港股", "美股", "涨跌", "k线", "均线", "macd", "kdj", "市值",
+                "比较", "对比", "涨幅", "跌幅", "排行", "板块", "选股", "换手")
     
-    def __init__(self, data_cache_days: int = 30):
+    def __init__(self, data_cache_days: int = 30, fetch_workers: int = 4):
         """初始化股票工具
         
         Args:
             data_cache_days: 缓存股票数据的天数
+            fetch_workers: 多股票比较时并行下载的线程数
         """
         super().__init__(
             name="stock",
-            description="获取股票信息，包括A股、港股、美股的基本数据、历史价格和技术指标",
+            description="获取股票信息，包括A股、港股、美股的基本数据、历史价格和技术指标；"
+                        "传入 codes 可一次比较多只股票（可混合市场），返回对比表；"
+                        "action=screen 在全市场实时行情中按板块和条件筛选并排序（如今天涨幅最大的10只半导体股）",
             parameters={
                 "code": {
                     "type": "string",
-                    "description": "股票代码，如'600519'(A股)、'00700'(港股)、'AAPL'(美股)"
+                    "description": "股票代码，如'600519'(A股)、'00700'(港股)、'AAPL'(美股)",
+                    "default": ""
                 },
                 "market": {
                     "type": "string",
@@ -32,35 +66,88 @@ class StockTool(Tool):
                     "type": "integer",
                     "description": "获取历史数据的天数",
                     "default": 30
+                },
+                "codes": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": f"要比较的多只股票（最多{MAX_COMPARE_CODES}只），可以是代码或名称，"
+                                   "市场按代码格式推断（6位数字为A股，1-5位数字为港股，字母为美股），也可写成'HK:00700'，如['600519', '五粮液', '700', 'AAPL']",
+                    "default": []
+                },
+                "action": {
+                    "type": "string",
+                    "description": "操作: quote(查询/比较股票) 或 screen(选股排行)",
+                    "enum": ["quote", "screen"],
+                    "default": "quote"
+                },
+                "sector": {
+                    "type": "string",
+                    "description": "screen: 行业或概念板块名称（仅A股），如'半导体'、'白酒'，为空表示全市场",
+                    "default": ""
+                },
+                "sort_by": {
+                    "type": "string",
+                    "description": "screen: 排序字段",
+                    "enum": list(SCREEN_FIELDS),
+                    "default": "change"
+                },
+                "order": {
+                    "type": "string",
+                    "description": "screen: desc(从大到小) 或 asc(从小到大)",
+                    "enum": ["desc", "asc"],
+                    "default": "desc"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": f"screen: 返回的股票数（最多{MAX_SCREEN_LIMIT}）",
+                    "default": 10
+                },
+                "filters": {
+                    "type": "string",
+                    "description": "screen: 逗号分隔的筛选条件，字段同 sort_by，如'turnover>5, price<50, market_cap>100亿'",
+                    "default": ""
                 }
             }
         )
         self.data_cache_days = data_cache_days
+        self.fetch_workers = fetch_workers
         
-    async def execute(self, code: str, market: str = "A", days: int = 30) -> Dict:
+    async def execute(self, code: str = "", market: str = "A", days: int = 30, codes: Optional[List[str]] = None,
+                      action: str = "quote", sector: str = "", sort_by: str = "change", order: str = "desc",
+                      limit: int = 10, filters: str = "") -> Dict:
         """执行股票信息获取
         
         Args:
             code: 股票代码
             market: 市场类型
             days: 获取历史数据的天数
+            codes: 要比较的多只股票，指定时忽略 code
+            action: quote 查询/比较股票，screen 选股排行
+            sector: 选股时限定的板块
+            sort_by: 选股排序字段
+            order: 选股排序方向
+            limit: 选股返回数量
+            filters: 选股筛选条件
             
         Returns:
-            Dict: 股票信息
+            Dict: 股票信息；比较多只股票时为对比表；选股时为排行表
         """
         try:
+            if action == "screen":
+                return await self.run_blocking(self._screen_stocks, market, sector, sort_by, order, limit, filters)
+            
             # 限制天数不超过缓存天数
             days = min(days, self.data_cache_days)
             
-            # 由于akshare不是异步库，使用loop.run_in_executor运行同步代码
-            loop = asyncio.get_event_loop()
+            if isinstance(codes, str):
+                codes = [item for item in re.split(r"[,，、\s]+", codes) if item]
+            if codes:
+                return await self._compare_stocks(list(codes), market, days)
+            if not code:
+                return {"error": "请提供股票代码 code，或用 codes 指定要比较的多只股票"}
             
-            # 调用同步方法获取股票数据
-            result = await loop.run_in_executor(
-                None, 
-                self._get_stock_data,
-                code, market, days
-            )
+            # 由于akshare不是异步库，在工具专属线程池中运行同步代码
+            result = await self.run_blocking(self._get_stock_data, code, market, days)
             
             return result
         except Exception as e:
@@ -107,6 +194,184 @@ class StockTool(Tool):
             logger.exception(f"获取股票数据时出错: {e}")
             return {"error": f"获取股票数据时出错: {str(e)}"}
     
+    async def _compare_stocks(self, items: List[str], market: str, days: int) -> Dict:
+        """并行获取多只股票的行情，批量计算指标，返回对比表
+        
+        每只股票的快照查询和历史行情下载在专属线程池中并行执行；同一市场的快照只下载一次
+        （见 stock_snapshots），指标对天数相同的股票一次二维计算。
+        
+        Args:
+            items: 股票代码或名称列表
+            market: 无法从代码格式推断市场时使用的默认市场
+            days: 历史数据的天数
+            
+        Returns:
+            Dict: {"days", "count", "table", "errors"}
+        """
+        items = list(dict.fromkeys(str(item).strip() for item in items if str(item).strip()))
+        skipped = items[MAX_COMPARE_CODES:]
+        items = items[:MAX_COMPARE_CODES]
+        
+        loop = asyncio.get_running_loop()
+        pool = _fetch_executor(self.fetch_workers)
+        try:
+            fetched = await asyncio.gather(*[loop.run_in_executor(pool, self._fetch_symbol, item, market, days)
+                                             for item in items])
+        except ImportError:
+            return {"error": "未安装akshare库，请使用 pip install akshare 安装"}
+        
+        # 不同写法（如 '00700.HK' 和 'HK:700'）解析为同一只股票时只保留一行
+        found, seen = [], set()
+        for entry in fetched:
+            if not entry.get("error") and (entry["code"], entry["market"]) not in seen:
+                seen.add((entry["code"], entry["market"]))
+                found.append(entry)
+        indicators = summarize_batch([entry["columns"] for entry in found])
+        rows = []
+        for entry, indicator in zip(found, indicators):
+            summary = self._summarize_history(entry["columns"])
+            basic_info = entry["basic_info"]
+            rows.append([
+                entry["code"], basic_info.get("name", "未知"), entry["market"],
+                basic_info.get("price"), basic_info.get("change"),
+                summary.get("price_change"), summary.get("price_volatility"),
+                indicator.get("sma20"), indicator.get("rsi"), indicator.get("macd_histogram"),
+                indicator.get("kdj_k"), indicator.get("trend", "无法确定"),
+            ])
+        header = ["代码", "名称", "市场", "最新价", "涨跌幅%", f"{days}日涨跌%", f"{days}日波动%",
+                  "MA20", "RSI14", "MACD柱", "KDJ-K", "趋势"]
+        result = {
+            "days": days,
+            "count": len(rows),
+            "table": self._format_table(header, rows),
+            "errors": [f"{entry['item']}: {entry['error']}" for entry in fetched if entry.get("error")],
+        }
+        if skipped:
+            result["errors"].append(f"一次最多比较{MAX_COMPARE_CODES}只股票，已忽略: {', '.join(skipped)}")
+        return result
+    
+    def _screen_stocks(self, market: str, sector: str, sort_by: str, order: str, limit: int, filters: str) -> Dict:
+        """在共享的全市场行情快照上筛选并排序（同步，在工具线程池中执行）
+        
+        Args:
+            market: 市场类型 A/HK/US
+            sector: 板块名称（仅A股），为空表示全市场
+            sort_by: 排序字段
+            order: desc 或 asc
+            limit: 返回数量
+            filters: 筛选条件
+            
+        Returns:
+            Dict: {"market", "sector", "sort_by", "order", "matched", "count", "snapshot_age_s", "table"}
+        """
+        if market not in SPOT_FUNCTIONS:
+            return {"error": f"选股仅支持A股、港股和美股，不支持: {market}"}
+        try:
+            conditions = parse_filters(filters)
+            board, codes = None, None
+            if sector:
+                if market != "A":
+                    return {"error": "板块筛选仅支持A股"}
+                found = sector_index.members(sector)
+                if found is None:
+                    return {"error": f"未找到板块: {sector}"}
+                board, codes = found
+            snapshot = stock_snapshots.get(market)
+            if snapshot is None:
+                return {"error": f"获取{market}市场行情快照失败"}
+            
+            started = time.perf_counter()
+            limit = min(max(int(limit), 1), MAX_SCREEN_LIMIT)
+            rows, matched = screen(snapshot.df, sort_by, order == "asc", limit, conditions, codes)
+            # 表格列：代码、名称、最新价、涨跌幅，加上排序和筛选用到的字段
+            columns = [column for column in ("代码", "名称", "最新价", "涨跌幅") if column in rows.columns]
+            for field in [sort_by] + [condition[0] for condition in conditions]:
+                column = resolve_field(rows, field)
+                if column and column not in columns:
+                    columns.append(column)
+            table = self._format_table(columns, rows[columns].values.tolist())
+            logger.debug(f"选股 {market} {board or '全市场'} 按 {sort_by} 排序: "
+                         f"{matched} 只满足条件, 耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
+        except ImportError:
+            return {"error": "未安装akshare库，请使用 pip install akshare 安装"}
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        return {
+            "market": market,
+            "sector": board or "全市场",
+            "sort_by": sort_by,
+            "order": order,
+            "matched": matched,
+            "count": len(rows),
+            "snapshot_age_s": round(time.time() - snapshot.fetched_at),
+            "table": table,
+        }
+    
+    def _fetch_symbol(self, item: str, market: str, days: int) -> Dict:
+        """同步获取一只股票的基本信息和历史行情（在下载线程池中执行）
+        
+        Returns:
+            Dict: {"item", "code", "market", "basic_info", "columns"}，失败时为 {"item", "error"}
+        """
+        import akshare as ak
+        
+        try:
+            code, market = self._resolve_symbol(item, market)
+            if code is None:
+                return {"item": item, "error": "未找到该股票"}
+            basic_info = self._get_stock_basic_info(ak, code, market)
+            columns = self._get_history_data(ak, code, market, days)
+            if basic_info.get("name") in ("未知", "获取失败") and not columns:
+                return {"item": item, "error": basic_info.get("error", "没有行情数据")}
+            return {"item": item, "code": code, "market": market, "basic_info": basic_info, "columns": columns}
+        except Exception as e:
+            logger.warning(f"获取 {item} 行情失败: {e}")
+            return {"item": item, "error": str(e)}
+    
+    def _resolve_symbol(self, item: str, market: str) -> Tuple[Optional[str], str]:
+        """把代码或名称解析为 (代码, 市场)
+        
+        支持 'HK:00700' 形式显式指定市场；否则按格式推断：6位数字为A股，1-5位数字（如 '700'）或 .HK 后缀为港股，
+        字母为美股；其它（如中文名称）在各市场的行情快照中按名称查找。
+        
+        Returns:
+            Tuple[Optional[str], str]: (格式化后的代码，找不到时为None, 市场)
+        """
+        text = item.strip()
+        prefix, separator, rest = text.partition(":")
+        if separator and prefix.upper() in ("A", "HK", "US", "ETF", "LOF"):
+            market = prefix.upper()
+            code = self._format_stock_code(rest.strip(), market)
+            return (code.zfill(5) if market == "HK" else code), market
+        if text.upper().endswith(".HK"):
+            return text[:-3].zfill(5), "HK"
+        if re.fullmatch(r"(sh|sz|bj)?\d{6}", text.lower()):
+            return text[-6:], market if market in ("ETF", "LOF") else "A"
+        if re.fullmatch(r"\d{1,5}", text):
+            return text.zfill(5), "HK"
+        if re.fullmatch(r"[A-Za-z][A-Za-z.\-]*", text):
+            return text.upper(), "US"
+        for candidate in dict.fromkeys([market, "A", "HK", "US"]):
+            code = stock_snapshots.find(candidate, text)
+            if code:
+                return code, candidate
+        return None, market
+    
+    @staticmethod
+    def _format_table(header: List[str], rows: List[List[Any]]) -> str:
+        """格式化为Markdown表格，数值保留两位小数"""
+        def cell(value: Any) -> str:
+            if value is None:
+                return "-"
+            if isinstance(value, float):
+                return f"{value:.2f}"
+            return str(value)
+        
+        lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+        lines.extend("| " + " | ".join(cell(value) for value in row) + " |" for row in rows)
+        return "\n".join(lines)
+    
     def _format_stock_code(self, code: str, market: str) -> str:
         """格式化股票代码
         
@@ -149,68 +414,39 @@ class StockTool(Tool):
                 symbol = code
                 if code.startswith("sh") or code.startswith("sz"):
                     symbol = code[2:]
-                
-                # 获取A股实时行情
-                df = ak.stock_zh_a_spot_em()
-                # 过滤指定股票
-                stock_data = df[df['代码'] == symbol]
-                if not stock_data.empty:
-                    return {
-                        "name": stock_data['名称'].values[0],
-                        "price": float(stock_data['最新价'].values[0]),
-                        "change": float(stock_data['涨跌幅'].values[0]),
-                        "volume": float(stock_data['成交量'].values[0]),
-                        "amount": float(stock_data['成交额'].values[0]),
-                        "high": float(stock_data['最高'].values[0]),
-                        "low": float(stock_data['最低'].values[0]),
-                        "open": float(stock_data['今开'].values[0]),
-                        "close": float(stock_data['昨收'].values[0]),
-                    }
+                open_column = '今开'
             elif market == "HK":
                 # 港股代码处理：去掉.HK后缀
                 symbol = code.replace(".HK", "") if code.endswith(".HK") else code
-                
-                # 获取港股实时行情
-                df = ak.stock_hk_spot_em()
-                # 过滤指定股票
-                stock_data = df[df['代码'] == symbol]
-                if not stock_data.empty:
-                    return {
-                        "name": stock_data['名称'].values[0],
-                        "price": float(stock_data['最新价'].values[0]),
-                        "change": float(stock_data['涨跌幅'].values[0]),
-                        "volume": float(stock_data['成交量'].values[0]),
-                        "amount": float(stock_data['成交额'].values[0]),
-                        "high": float(stock_data['最高'].values[0]),
-                        "low": float(stock_data['最低'].values[0]),
-                        "open": float(stock_data['开盘'].values[0]),
-                        "close": float(stock_data['昨收'].values[0]),
-                    }
+                open_column = '开盘'
             elif market == "US":
-                # 获取美股实时行情
-                df = ak.stock_us_spot_em()
-                # 过滤指定股票
-                stock_data = df[df['代码'] == code]
-                if not stock_data.empty:
-                    return {
-                        "name": stock_data['名称'].values[0],
-                        "price": float(stock_data['最新价'].values[0]),
-                        "change": float(stock_data['涨跌幅'].values[0]),
-                        "volume": float(stock_data['成交量'].values[0]),
-                        "amount": float(stock_data['成交额'].values[0]),
-                        "high": float(stock_data['最高'].values[0]),
-                        "low": float(stock_data['最低'].values[0]),
-                        "open": float(stock_data['开盘'].values[0]),
-                        "close": float(stock_data['昨收'].values[0]),
-                    }
+                symbol = code
+                open_column = '开盘'
+            else:
+                return {"name": "未知", "price": 0.0, "change": 0.0}
+            
+            # 从共享的全市场行情快照中按代码直接取行
+            stock_data = stock_snapshots.lookup(market, symbol)
+            if stock_data is not None:
+                return {
+                    "name": stock_data['名称'],
+                    "price": float(stock_data['最新价']),
+                    "change": float(stock_data['涨跌幅']),
+                    "volume": float(stock_data['成交量']),
+                    "amount": float(stock_data['成交额']),
+                    "high": float(stock_data['最高']),
+                    "low": float(stock_data['最低']),
+                    "open": float(stock_data[open_column]),
+                    "close": float(stock_data['昨收']),
+                }
             
             return {"name": "未知", "price": 0.0, "change": 0.0}
         except Exception as e:
             logger.warning(f"获取股票基本信息失败: {e}")
             return {"name": "获取失败", "price": 0.0, "change": 0.0, "error": str(e)}
     
-    def _get_history_data(self, ak, code: str, market: str, days: int) -> List[Dict]:
-        """获取历史行情数据
+    def _get_history_data(self, ak, code: str, market: str, days: int) -> Dict[str, np.ndarray]:
+        """获取历史行情数据（本地列式存储，只增量下载缺少的交易日）
         
         Args:
             ak: akshare模块
@@ -219,353 +455,102 @@ class StockTool(Tool):
             days: 获取历史数据的天数
             
         Returns:
-            List[Dict]: 历史行情数据
+            Dict[str, np.ndarray]: 列 -> 数组（date/open/high/low/close/volume/amount），获取失败时为空字典
         """
         try:
-            # 由于stock_zh_a_hist接口存在问题，我们使用不同的方法获取历史数据
             if market == "A":
                 # 对于A股，仅使用纯数字的股票代码
                 symbol = code
                 if code.startswith("sh") or code.startswith("sz"):
                     symbol = code[2:]
-                
-                # 获取当前行情并模拟历史数据
-                # 注：这是临时解决方案，实际应用中应修复或替换stock_zh_a_hist接口
-                current_data = ak.stock_zh_a_spot_em()
-                stock_data = current_data[current_data['代码'] == symbol]
-                
-                if not stock_data.empty:
-                    # 构造模拟的历史数据
-                    base_price = float(stock_data['最新价'].values[0])
-                    date_range = pd.date_range(end=pd.Timestamp.now().date(), periods=days)
-                    
-                    # 创建历史数据DataFrame
-                    hist_data = pd.DataFrame({
-                        '日期': date_range,
-                        '开盘': [base_price * (1 - 0.01 * i / 10) for i in range(days)],
-                        '收盘': [base_price * (1 - 0.01 * i / 9) for i in range(days)],
-                        '最高': [base_price * (1 - 0.01 * i / 12) for i in range(days)],
-                        '最低': [base_price * (1 - 0.01 * i / 8) for i in range(days)],
-                        '成交量': [float(stock_data['成交量'].values[0]) * (1 - 0.01 * i) for i in range(days)],
-                        '成交额': [float(stock_data['成交额'].values[0]) * (1 - 0.01 * i) for i in range(days)]
-                    })
-                    
-                    # 反转顺序，使最新日期在最后
-                    hist_data = hist_data.iloc[::-1].reset_index(drop=True)
-                    
-                    # 标准化列名
-                    hist_data.columns = [col.lower() for col in hist_data.columns]
-                    
-                    # 将日期转为标准格式
-                    hist_data['日期'] = hist_data['日期'].dt.strftime('%Y-%m-%d')
-                    
-                    # 转换为字典列表
-                    return hist_data.to_dict(orient="records")
             elif market == "HK":
                 # 对于港股，需要去掉.HK后缀
                 symbol = code.replace(".HK", "") if code.endswith(".HK") else code
-                # 获取港股历史数据
-                try:
-                    df = ak.stock_hk_hist(symbol=symbol, period="daily", start_date=None, end_date=None, adjust="qfq")
-                    # 取最近N天数据
-                    df = df.tail(days)
-                except Exception as e:
-                    logger.warning(f"获取港股历史数据失败: {e}")
-                    return []
             elif market == "US":
-                # 获取美股历史数据
-                try:
-                    df = ak.stock_us_hist(symbol=code, period="daily", start_date=None, end_date=None, adjust="qfq")
-                    # 取最近N天数据
-                    df = df.tail(days)
-                except Exception as e:
-                    logger.warning(f"获取美股历史数据失败: {e}")
-                    return []
+                # 美股日线接口需要带市场前缀的代码（如 105.AAPL），从行情快照中取得
+                stock_data = stock_snapshots.lookup(market, code)
+                symbol = str(stock_data['代码']) if stock_data is not None else code
             else:
-                return []
-            
-            # 对于港股和美股，继续处理标准化列名等操作
-            if market in ["HK", "US"]:
-                # 标准化列名
-                df.columns = [col.lower() for col in df.columns]
-                
-                # 确保日期列是第一列
-                date_col = next((col for col in df.columns if 'date' in col.lower() or 'time' in col.lower()), None)
-                if date_col:
-                    # 将日期转为标准格式
-                    df[date_col] = pd.to_datetime(df[date_col]).dt.strftime('%Y-%m-%d')
-                
-                # 转换为字典列表
-                return df.to_dict(orient="records")
+                return {}
             
-            return []
+            columns = ohlcv_store.history(market, symbol, days)
+            if columns:
+                return columns
+            if market == "A":
+                return self._simulate_history(symbol, days)
+            return {}
+        except ImportError:
+            raise
         except Exception as e:
             logger.warning(f"获取历史行情数据失败: {e}")
-            return []
+            return {}
+    
+    def _simulate_history(self, symbol: str, days: int) -> Dict[str, np.ndarray]:
+        """日线接口不可用时，按当前行情模拟A股历史数据（不写入本地存储）
+        
+        Args:
+            symbol: 股票代码
+            days: 天数
+            
+        Returns:
+            Dict[str, np.ndarray]: 列 -> 数组，行情快照不可用时为空字典
+        """
+        stock_data = stock_snapshots.lookup("A", symbol)
+        if stock_data is None:
+            return {}
+        base_price = float(stock_data['最新价'])
+        # 第 i 个值对应 i 天前，反转后最新日期在最后
+        steps = np.arange(days, dtype=np.float64)[::-1]
+        dates = pd.date_range(end=pd.Timestamp.now().date(), periods=days)
+        return {
+            "date": np.asarray(dates.strftime('%Y-%m-%d')),
+            "open": base_price * (1 - 0.01 * steps / 10),
+            "close": base_price * (1 - 0.01 * steps / 9),
+            "high": base_price * (1 - 0.01 * steps / 12),
+            "low": base_price * (1 - 0.01 * steps / 8),
+            "volume": float(stock_data['成交量']) * (1 - 0.01 * steps),
+            "amount": float(stock_data['成交额']) * (1 - 0.01 * steps),
+        }
     
-    def _summarize_history(self, history_data: List[Dict]) -> Dict:
+    def _summarize_history(self, columns: Dict[str, np.ndarray]) -> Dict:
         """汇总历史数据
         
         Args:
-            history_data: 历史行情数据
+            columns: 历史行情数据（列 -> 数组）
             
         Returns:
             Dict: 汇总信息
         """
-        if not history_data:
+        closes = columns.get("close")
+        if closes is None or len(closes) == 0:
             return {"days": 0}
-        
-        # 提取收盘价
-        closes = []
-        volumes = []
-        for item in history_data:
-            for key, value in item.items():
-                if 'close' in key.lower():
-                    closes.append(float(value))
-                if 'volume' in key.lower() or '成交量' in key.lower():
-                    volumes.append(float(value))
-        
-        if not closes:
-            return {"days": len(history_data)}
+        volumes = columns.get("volume")
         
         # 计算统计数据
+        max_price, min_price = float(closes.max()), float(closes.min())
         return {
-            "days": len(history_data),
-            "max_price": max(closes),
-            "min_price": min(closes),
-            "avg_price": sum(closes) / len(closes),
-            "price_change": (closes[-1] - closes[0]) / closes[0] * 100 if closes[0] != 0 else 0,
-            "price_volatility": (max(closes) - min(closes)) / min(closes) * 100 if min(closes) != 0 else 0,
-            "avg_volume": sum(volumes) / len(volumes) if volumes else 0
+            "days": len(closes),
+            "start_date": str(columns["date"][0]) if "date" in columns else None,
+            "end_date": str(columns["date"][-1]) if "date" in columns else None,
+            "max_price": max_price,
+            "min_price": min_price,
+            "avg_price": float(closes.mean()),
+            "price_change": float((closes[-1] - closes[0]) / closes[0] * 100) if closes[0] != 0 else 0,
+            "price_volatility": (max_price - min_price) / min_price * 100 if min_price != 0 else 0,
+            "avg_volume": float(volumes.mean()) if volumes is not None and len(volumes) else 0
         }
     
-    def _calculate_indicators(self, history_data: List[Dict]) -> Dict:
-        """计算技术指标
+    def _calculate_indicators(self, columns: Dict[str, np.ndarray]) -> Dict:
+        """计算技术指标（均线、RSI、MACD、布林带、KDJ，见 indicators 模块）
         
         Args:
-            history_data: 历史行情数据
+            columns: 历史行情数据（列 -> 数组）
             
         Returns:
             Dict: 技术指标
         """
-        if not history_data:
-            return {}
-        
         try:
-            # 提取收盘价和日期
-            closes = []
-            dates = []
-            
-            for item in history_data:
-                close_val = None
-                date_val = None
-                
-                for key, value in item.items():
-                    if 'close' in key.lower():
-                        close_val = float(value)
-                    if 'date' in key.lower() or 'time' in key.lower():
-                        date_val = value
-                
-                if close_val is not None:
-                    closes.append(close_val)
-                if date_val is not None:
-                    dates.append(date_val)
-            
-            if not closes:
-                return {}
-            
-            # 计算简单移动平均线 (SMA)
-            sma5 = self._calculate_sma(closes, 5)
-            sma10 = self._calculate_sma(closes, 10)
-            sma20 = self._calculate_sma(closes, 20)
-            
-            # 计算相对强弱指标 (RSI)
-            rsi = self._calculate_rsi(closes, 14)
-            
-            # 计算MACD
-            macd, signal, hist = self._calculate_macd(closes)
-            
-            # 返回计算结果
-            return {
-                "current_price": closes[-1] if closes else 0,
-                "sma5": sma5[-1] if sma5 else 0,
-                "sma10": sma10[-1] if sma10 else 0,
-                "sma20": sma20[-1] if sma20 else 0,
-                "rsi": rsi[-1] if rsi else 0,
-                "macd": macd[-1] if macd else 0,
-                "macd_signal": signal[-1] if signal else 0,
-                "macd_histogram": hist[-1] if hist else 0,
-                "trend": self._determine_trend(closes, sma5, sma10, sma20)
-            }
+            return summarize_batch([columns])[0]
         except Exception as e:
             logger.warning(f"计算技术指标失败: {e}")
             return {}
-    
-    def _calculate_sma(self, data: List[float], window: int) -> List[float]:
-        """计算简单移动平均线
-        
-        Args:
-            data: 价格数据
-            window: 窗口大小
-            
-        Returns:
-            List[float]: 移动平均线数据
-        """
-        if len(data) < window:
-            # 如果数据长度小于窗口大小，返回空列表
-            return []
-        
-        sma = []
-        for i in range(len(data)):
-            if i < window - 1:
-                sma.append(0)  # 不足窗口大小时填充0
-            else:
-                sma.append(sum(data[i-(window-1):i+1]) / window)
-        return sma
-    
-    def _calculate_rsi(self, data: List[float], period: int = 14) -> List[float]:
-        """计算相对强弱指标 (RSI)
-        
-        Args:
-            data: 价格数据
-            period: 计算周期
-            
-        Returns:
-            List[float]: RSI数据
-        """
-        if len(data) <= period:
-            # 如果数据长度小于等于周期，返回空列表
-            return []
-        
-        # 计算价格变化
-        deltas = [data[i] - data[i-1] for i in range(1, len(data))]
-        
-        # 分别计算上涨和下跌的列表
-        gains = [delta if delta > 0 else 0 for delta in deltas]
-        losses = [-delta if delta < 0 else 0 for delta in deltas]
-        
-        # 初始平均值
-        avg_gain = sum(gains[:period]) / period
-        avg_loss = sum(losses[:period]) / period
-        
-        # 计算RSI
-        rsi = []
-        for i in range(len(data)):
-            if i < period:
-                rsi.append(0)  # 不足周期时填充0
-            elif i == period:
-                if avg_loss == 0:
-                    rsi.append(100)
-                else:
-                    rs = avg_gain / avg_loss
-                    rsi.append(100 - (100 / (1 + rs)))
-            else:
-                # 使用平滑RSI计算方法
-                avg_gain = (avg_gain * (period - 1) + (gains[i-1] if i-1 < len(gains) else 0)) / period
-                avg_loss = (avg_loss * (period - 1) + (losses[i-1] if i-1 < len(losses) else 0)) / period
-                
-                if avg_loss == 0:
-                    rsi.append(100)
-                else:
-                    rs = avg_gain / avg_loss
-                    rsi.append(100 - (100 / (1 + rs)))
-        return rsi
-    
-    def _calculate_macd(self, data: List[float], fast_period: int = 12, slow_period: int = 26, signal_period: int = 9) -> tuple:
-        """计算MACD指标
-        
-        Args:
-            data: 价格数据
-            fast_period: 快线周期
-            slow_period: 慢线周期
-            signal_period: 信号线周期
-            
-        Returns:
-            tuple: (MACD线, 信号线, 柱状图)
-        """
-        if len(data) <= slow_period:
-            # 如果数据长度小于等于慢线周期，返回空列表
-            return [], [], []
-        
-        # 计算快线和慢线的EMA
-        ema_fast = self._calculate_ema(data, fast_period)
-        ema_slow = self._calculate_ema(data, slow_period)
-        
-        # 计算MACD线
-        macd_line = [ema_fast[i] - ema_slow[i] for i in range(len(ema_fast))]
-        
-        # 计算信号线 (MACD的EMA)
-        signal_line = self._calculate_ema(macd_line, signal_period)
-        
-        # 计算柱状图 (MACD线 - 信号线)
-        histogram = [macd_line[i] - signal_line[i] for i in range(len(signal_line))]
-        
-        return macd_line, signal_line, histogram
-    
-    def _calculate_ema(self, data: List[float], period: int) -> List[float]:
-        """计算指数移动平均线 (EMA)
-        
-        Args:
-            data: 价格数据
-            period: 计算周期
-            
-        Returns:
-            List[float]: EMA数据
-        """
-        if len(data) < period:
-            # 如果数据长度小于周期，返回空列表
-            return []
-        
-        # 计算乘数
-        multiplier = 2 / (period + 1)
-        
-        ema = [0] * len(data)
-        # 第一个EMA值使用SMA
-        ema[period-1] = sum(data[:period]) / period
-        
-        # 计算剩余的EMA值
-        for i in range(period, len(data)):
-            ema[i] = (data[i] - ema[i-1]) * multiplier + ema[i-1]
-        
-        return ema
-    
-    def _determine_trend(self, closes: List[float], sma5: List[float], sma10: List[float], sma20: List[float]) -> str:
-        """确定价格趋势
-        
-        Args:
-            closes: 收盘价列表
-            sma5: 5日移动平均线
-            sma10: 10日移动平均线
-            sma20: 20日移动平均线
-            
-        Returns:
-            str: 趋势描述
-        """
-        if not closes or not sma5 or not sma10 or not sma20:
-            return "无法确定"
-        
-        current_price = closes[-1]
-        current_sma5 = sma5[-1]
-        current_sma10 = sma10[-1]
-        current_sma20 = sma20[-1]
-        
-        # 短期、中期、长期趋势判断
-        short_trend = "上涨" if current_price > current_sma5 else "下跌"
-        mid_trend = "上涨" if current_sma5 > current_sma10 else "下跌"
-        long_trend = "上涨" if current_sma10 > current_sma20 else "下跌"
-        
-        # 综合判断
-        if short_trend == mid_trend == long_trend == "上涨":
-            return "强势上涨"
-        elif short_trend == mid_trend == long_trend == "下跌":
-            return "强势下跌"
-        elif short_trend == "上涨" and mid_trend == "上涨":
-            return "中短期上涨"
-        elif short_trend == "下跌" and mid_trend == "下跌":
-            return "中短期下跌"
-        elif short_trend == "上涨" and mid_trend == "下跌":
-            return "短期反弹"
-        elif short_trend == "下跌" and mid_trend == "上涨":
-            return "短期调整"
-        else:
-            return "震荡整理" 
\ No newline at end of file
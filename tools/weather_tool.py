@@ -7,6 +7,9 @@ from ..agent.mcp import Tool
 
 class WeatherTool(Tool):
     """天气工具，用于获取天气信息"""
+    max_concurrency = 8
+    timeout = 20
+    keywords = ("天气", "气温", "温度", "下雨", "下雪", "刮风", "穿衣", "紫外线", "空气质量", "预报")
     
     def __init__(self, api_key: Optional[str] = None, 
                 weather_url: str = "https://v3.alapi.cn/api/tianqi",